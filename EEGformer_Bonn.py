@@ -193,36 +193,46 @@ class RTM(nn.Module):  # Regional transformer module
         trunc_normal(self.cls, std=.02)
 
         self.tfb = nn.ModuleList([GenericTFB(self.inputshape[1], self.hA, self.dtype) for _ in range(self.tK)])
+        self.verbose = True  # per-call shape prints; they break graph capture, EEGformer.set_traceable turns them off
 
     def forward(self, x):  # x: [B, C, D, S]
-        print(f"\n[RTM] Input to forward(): {x.shape}")
+        if self.verbose:
+            print(f"\n[RTM] Input to forward(): {x.shape}")
 
         # Permute: [B, C, D, S] → [B, D, S, C]
         x = x.permute(0, 2, 3, 1)
-        print(f"[RTM] After permute (B, D, S, C): {x.shape}")
-        print(f"[RTM] self.weight: {self.weight.shape}")
+        if self.verbose:
+            print(f"[RTM] After permute (B, D, S, C): {x.shape}")
+            print(f"[RTM] self.weight: {self.weight.shape}")
 
         # Apply einsum: [B, D, S], [B, D, S, C] → [B, S, C, D]
         savespace = torch.einsum('bds,bdsc->bscd', self.weight, x)
-        print(f"[RTM] After einsum (B, S, C, D): {savespace.shape}")
+        if self.verbose:
+            print(f"[RTM] After einsum (B, S, C, D): {savespace.shape}")
 
         # Add CLS token: [B, S, 1, D]
-        print(f"[RTM] CLS shape: {self.cls.shape}")
+        if self.verbose:
+            print(f"[RTM] CLS shape: {self.cls.shape}")
         # Add CLS token: [B, S, 1, D]
         savespace = torch.cat([self.cls, savespace], dim=2)  # [B, S, C+1, D]
-        print(f"[RTM] After CLS concat (B, S, C+1, D): {savespace.shape}")
+        if self.verbose:
+            print(f"[RTM] After CLS concat (B, S, C+1, D): {savespace.shape}")
 
         # Add bias
-        print(f"[RTM] Bias shape: {self.bias.shape}")
+        if self.verbose:
+            print(f"[RTM] Bias shape: {self.bias.shape}")
         savespace = savespace + self.bias
-        print(f"[RTM] After adding bias: {savespace.shape}")
+        if self.verbose:
+            print(f"[RTM] After adding bias: {savespace.shape}")
 
         # Apply transformer blocks
         for i, tfb in enumerate(self.tfb):
-            print(f"[RTM] Passing through Transformer Block {i+1}")
+            if self.verbose:
+                print(f"[RTM] Passing through Transformer Block {i+1}")
             savespace = tfb(x, savespace)
 
-        print(f"[RTM] Output shape: {savespace.shape}")
+        if self.verbose:
+            print(f"[RTM] Output shape: {savespace.shape}")
         return savespace  # [B, S, C+1, D]
 
 
@@ -289,13 +299,23 @@ class TTM(nn.Module):  # Temporal transformer module
 
         self.lnorm_extra = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # EXPERIMENTAL
 
+        # traceable=True replaces the segment loops by one matmul with this averaging matrix (same segments as the loops)
+        self.traceable = False
+        segment_avg = torch.zeros(self.avgf, self.input.shape[0], dtype=self.dtype)
+        for i in range(self.avgf):
+            segment_avg[i, int(i * self.seg):int((i + 1) * self.seg)] = 1 / self.seg
+        self.register_buffer('segment_avg', segment_avg.to(device), persistent=False)
+
     def forward(self, x):
         input = x.transpose(0, 2)  # D x S x C
-        inputc = torch.zeros(self.avgf, input.shape[1], input.shape[2], dtype=self.dtype).to(device)  # M x S x C
-        for i in range(0, self.avgf):  # each i consists self.input.shape[0]/avgf
-            for j in range(int(i * self.seg), int((i + 1) * self.seg)):  # int(i*self.seg), int((i+1)*self.seg)
-                inputc[i, :, :] = inputc[i, :, :] + input[j, :, :]
-            inputc[i, :, :] = inputc[i, :, :] / self.seg
+        if self.traceable:
+            inputc = torch.einsum('ms,sjk -> mjk', self.segment_avg.to(input.dtype), input)  # M x S x C
+        else:
+            inputc = torch.zeros(self.avgf, input.shape[1], input.shape[2], dtype=self.dtype).to(device)  # M x S x C
+            for i in range(0, self.avgf):  # each i consists self.input.shape[0]/avgf
+                for j in range(int(i * self.seg), int((i + 1) * self.seg)):  # int(i*self.seg), int((i+1)*self.seg)
+                    inputc[i, :, :] = inputc[i, :, :] + input[j, :, :]
+                inputc[i, :, :] = inputc[i, :, :] / self.seg
 
         altx = inputc.reshape(self.avgf, input.shape[1] * input.shape[2]).to(device)  # M x L -> M x (S*C)
 
@@ -378,6 +398,11 @@ class EEGformer(nn.Module):
 
         return torch.softmax(x, dim=1)
 
+    def set_traceable(self, traceable=True):  # no per-call prints and loop-free TTM averaging for torch.jit.trace / torch.compile / export
+        self.rtm.verbose = not traceable
+        self.ttm.traceable = traceable
+        return self
+
     # CE - uses one hot encoded label or similar(such as multi class probability label)
     def eegloss(self, xf, label, L1_reg_const):  # CE Loss with L1 regularization
         wt = self.sa(self.cnndecoder.fc.weight) + self.sa(self.cnndecoder.cvd1.weight) + self.sa(self.cnndecoder.cvd2.weight) + self.sa(self.cnndecoder.cvd3.weight)
@@ -0,0 +1,658 @@
+import argparse
+import copy
+import io
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+
+from models import EEGformer, device
+from checkpoint import load_checkpoint
+from quantization import quantize_dynamic_eegformer
+from qat import export_int8, finetune_qat, prepare_qat_eegformer
+from mixed_precision import bf16_autocast, cpu_bf16_info, train_step
+from export import export_numpy
+from freeze import freeze_for_inference
+from lowrank import factorize_ttm
+from pruning import prune_eegformer
+from distill import build_student, cache_soft_targets, distill
+from early_exit import add_exit_heads, exit_report, train_exit_heads
+from feature_cache import TRAINED, build_feature_cache, finetune_from_cache, prefix_forward
+from lora import adapter_state_dict, add_lora, load_adapter
+from buckets import BucketedEEGformer, bucket_samples
+from recording import (RecordingClassifier, build_recording_cache, predict_sliding, score_recordings, sliding_odcm, sliding_windows,
+                       train_recording_classifier)
+from prediction_cache import CachedEEGformer, PredictionCache
+
+# Training setup of the notebooks: single channel 3 s crops at 177 Hz
+sampling_rate = 177
+duration = 3
+DEFAULT_SAMPLES = sampling_rate * duration
+DEFAULT_BATCH = 8
+DEFAULT_CONFIG = dict(num_cls=2, input_channels=1, kernel_size=10, num_blocks=3, num_heads_RTM=6, num_heads_STM=6,
+                      num_heads_TTM=11, num_submatrices=12, CF_second=2)
+
+
+def build_model(batch_size=DEFAULT_BATCH, samples=DEFAULT_SAMPLES, checkpoint=None, **overrides):
+    config = dict(DEFAULT_CONFIG, **overrides)
+    sample_input = torch.randn(batch_size, samples, config['input_channels']).to(device)  # dummy input fixing B and T
+    model = EEGformer(input=sample_input, **config).to(device)
+    if checkpoint is not None:
+        load_checkpoint(model, checkpoint)
+    return model.eval()
+
+
+def synthetic_loader(batch_size=DEFAULT_BATCH, samples=DEFAULT_SAMPLES, input_channels=1, num_cls=2, num_batches=4, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    return [(torch.randn(batch_size, input_channels, samples, generator=gen), torch.randint(0, num_cls, (batch_size,), generator=gen))
+            for _ in range(num_batches)]
+
+
+def predict(model, loader, batch_size=DEFAULT_BATCH, autocast=False):  # (probabilities, labels) over the full batches of a loader
+    probs, labels = [], []
+    with torch.no_grad(), bf16_autocast(autocast):
+        for inputs, label in loader:
+            if inputs.shape[0] != batch_size:  # the model is built for a fixed batch size
+                continue
+            probs.append(model(inputs.to(device)).float().cpu())
+            labels.append(label)
+    return torch.cat(probs), torch.cat(labels)
+
+
+def accuracy(probs, labels):
+    return (probs.argmax(-1) == labels).float().mean().item() * 100
+
+
+def time_forward(model, x, n_warmup=2, n_runs=10, autocast=False):  # mean milliseconds per forward pass
+    with torch.no_grad(), bf16_autocast(autocast):
+        for _ in range(n_warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            model(x)
+    return (time.perf_counter() - start) / n_runs * 1e3
+
+
+def state_dict_mb(model):  # serialized size of the model's state dict
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2 ** 20
+
+
+def print_report(title, rows):
+    print(f"==== {title} ====")
+    keys = list(rows[0].keys())
+    print(" | ".join(f"{k:>12}" for k in keys))
+    for row in rows:
+        print(" | ".join(f"{v:>12.4f}" if isinstance(v, float) else f"{str(v):>12}" for v in row.values()))
+
+
+def bench_quantization(model, loader, n_runs=10):
+    """Accuracy/latency of the int8 dynamic quantized model against the fp32 model."""
+    model = model.cpu().eval()
+    qmodel = quantize_dynamic_eegformer(model)
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+
+    p32, labels = predict(model, loader, x.shape[0])
+    p8, _ = predict(qmodel, loader, x.shape[0])
+
+    rows = []
+    for name, m, p in (("fp32", model, p32), ("int8", qmodel, p8)):
+        rows.append(dict(model=name, ms_per_batch=time_forward(m, x, n_runs=n_runs), size_mb=state_dict_mb(m),
+                         accuracy=accuracy(p, labels), agreement=(p.argmax(-1) == p32.argmax(-1)).float().mean().item() * 100,
+                         max_abs_diff=(p - p32).abs().max().item()))
+    rows[1]['speedup'] = rows[0]['ms_per_batch'] / rows[1]['ms_per_batch']
+    rows[0]['speedup'] = 1.0
+    print_report("Dynamic INT8 quantization", rows)
+    return rows
+
+
+def bench_qat(model, loader, n_runs=10, num_epochs=1):
+    """fp32 vs post-training int8 vs QAT fine-tuned int8, fine-tuned and evaluated on loader."""
+    model = model.cpu().eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    ptq = quantize_dynamic_eegformer(model)
+
+    qat_model = prepare_qat_eegformer(copy.deepcopy(model))
+    finetune_qat(qat_model, loader, num_epochs=num_epochs, batch_size=x.shape[0])
+    qat_int8 = export_int8(qat_model)
+
+    p32, labels = predict(model, loader, x.shape[0])
+    rows = []
+    for name, m in (("fp32", model), ("ptq_int8", ptq), ("qat_int8", qat_int8)):
+        p, _ = predict(m, loader, x.shape[0])
+        rows.append(dict(model=name, ms_per_batch=time_forward(m, x, n_runs=n_runs), size_mb=state_dict_mb(m),
+                         accuracy=accuracy(p, labels), agreement=(p.argmax(-1) == p32.argmax(-1)).float().mean().item() * 100))
+    print_report("Quantization-aware training", rows)
+    return rows
+
+
+def time_train_step(model, x, labels, n_warmup=1, n_runs=5, autocast=False):  # mean milliseconds per optimizer step
+    model = copy.deepcopy(model).train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-6)
+    for _ in range(n_warmup):
+        train_step(model, x, labels, optimizer, enabled=autocast)
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        train_step(model, x, labels, optimizer, enabled=autocast)
+    return (time.perf_counter() - start) / n_runs * 1e3
+
+
+def bench_bf16(model, loader, n_runs=10):
+    """fp32 vs bf16 autocast: inference/training step latency and validation parity."""
+    print(f"host: {cpu_bf16_info()}")
+    model = model.eval()
+    x, labels = loader[0] if isinstance(loader, list) else next(iter(loader))
+    x, labels = x.to(device), labels.to(device)
+
+    p32, y = predict(model, loader, x.shape[0])
+    rows = []
+    for name, autocast in (("fp32", False), ("bf16", True)):
+        p, _ = predict(model, loader, x.shape[0], autocast=autocast)
+        rows.append(dict(mode=name, infer_ms=time_forward(model, x, n_runs=n_runs, autocast=autocast),
+                         train_ms=time_train_step(model, x, labels, n_runs=max(n_runs // 2, 1), autocast=autocast),
+                         accuracy=accuracy(p, y), agreement=(p.argmax(-1) == p32.argmax(-1)).float().mean().item() * 100,
+                         max_abs_diff=(p - p32).abs().max().item()))
+    for row in rows:
+        row['infer_speedup'] = rows[0]['infer_ms'] / row['infer_ms']
+        row['train_speedup'] = rows[0]['train_ms'] / row['train_ms']
+    print_report("bf16 autocast", rows)
+    return rows
+
+
+def _rss_mb():  # current resident set size
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def _train_memory_worker(batch_size, samples, config, n_runs, queue):  # runs in a fresh process so ru_maxrss is per config
+    torch.manual_seed(0)
+    model = build_model(batch_size, samples, **config).train()
+    x, labels = synthetic_loader(batch_size, samples, config['input_channels'], config['num_cls'], num_batches=1)[0]
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-6)  # stateless, so the peak is weights + activations + grads
+    rss_before = _rss_mb()
+    train_step(model, x, labels, optimizer, enabled=False)
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        train_step(model, x, labels, optimizer, enabled=False)
+    step_ms = (time.perf_counter() - start) / n_runs * 1e3
+    queue.put(dict(peak_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10 - rss_before, step_ms=step_ms))
+
+
+def bench_checkpointing(model, loader, n_runs=10):
+    """Peak training memory above the built model and step time with activation checkpointing every k blocks."""
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    config = model.get_config()
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for k in sorted({0, 1, model.tK}):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_train_memory_worker, args=(x.shape[0], x.shape[-1], dict(config, checkpoint_every=k), max(n_runs // 2, 1), queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        rows.append(dict(checkpoint_every=k, **result))
+    for row in rows:
+        row['mem_saving_%'] = (1 - row['peak_mb'] / rows[0]['peak_mb']) * 100
+        row['overhead_%'] = (row['step_ms'] / rows[0]['step_ms'] - 1) * 100
+    print_report("Activation checkpointing (train step)", rows)
+    return rows
+
+
+def bench_numpy(model, loader, n_runs=10):
+    """Torch model vs the NumPy runtime: latency, import time of the runtime and parity."""
+    from numpy_runtime import NumpyEEGformer
+
+    model = model.cpu().eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = export_numpy(model, os.path.join(tmp, "eegformer.npz"))
+        np_model = NumpyEEGformer(path)
+        cmd = "import time; t = time.perf_counter(); import numpy_runtime; print(time.perf_counter() - t)"
+        import_s = float(subprocess.run([sys.executable, "-c", cmd], capture_output=True, text=True, check=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+
+    np_model(x.numpy())
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        np_model(x.numpy())
+    np_ms = (time.perf_counter() - start) / n_runs * 1e3
+
+    p32, labels = predict(model, loader, x.shape[0])
+    pnp = torch.cat([torch.from_numpy(np_model(inputs.numpy())) for inputs, _ in loader if inputs.shape[0] == x.shape[0]])
+    rows = [dict(runtime="torch", ms_per_batch=time_forward(model, x, n_runs=n_runs), import_s=float('nan'),
+                 accuracy=accuracy(p32, labels), max_abs_diff=0.0),
+            dict(runtime="numpy", ms_per_batch=np_ms, import_s=import_s,
+                 accuracy=accuracy(pnp, labels), max_abs_diff=(pnp - p32).abs().max().item())]
+    print_report("NumPy runtime", rows)
+    return rows
+
+
+def bench_freeze(model, loader, n_runs=10):
+    """Model vs freeze_for_inference (cls/bias and LayerNorm affine folded): latency and parity."""
+    model = model.eval()
+    frozen = freeze_for_inference(model)
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    x = x.to(device)
+
+    p32, labels = predict(model, loader, x.shape[0])
+    rows = []
+    for name, m in (("eager", model), ("frozen", frozen)):
+        p, _ = predict(m, loader, x.shape[0])
+        rows.append(dict(model=name, ms_per_batch=time_forward(m, x, n_runs=n_runs), accuracy=accuracy(p, labels),
+                         max_abs_diff=(p - p32).abs().max().item()))
+    for row in rows:
+        row['speedup'] = rows[0]['ms_per_batch'] / row['ms_per_batch']
+    print_report("Inference constant folding", rows)
+    return rows
+
+
+def bench_lowrank(model, loader, n_runs=10, ranks=None):
+    """Full-rank TTM vs truncated-SVD factorizations (factorize_ttm) at several ranks: size, latency and parity."""
+    model = model.eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    x = x.to(device)
+    D = model.ttm.M_size1
+    ranks = ranks or [D // 2, D // 4, D // 8]
+
+    p32, labels = predict(model, loader, x.shape[0])
+    rows = []
+    for rank in [None] + list(ranks):
+        m = model if rank is None else factorize_ttm(model, rank)
+        p, _ = predict(m, loader, x.shape[0])
+        rows.append(dict(ttm_rank=rank or D, size_mb=state_dict_mb(m), ms_per_batch=time_forward(m, x, n_runs=n_runs),
+                         accuracy=accuracy(p, labels), agreement=(p.argmax(-1) == p32.argmax(-1)).float().mean().item() * 100,
+                         max_abs_diff=(p - p32).abs().max().item()))
+    print_report("Low-rank TTM projections", rows)
+    return rows
+
+
+def bench_sharing(model, loader, n_runs=10):
+    """Cross-block weight sharing (share_blocks): parameters, checkpoint size, inference and train step latency."""
+    x, labels = loader[0] if isinstance(loader, list) else next(iter(loader))
+    x, labels = x.to(device), labels.to(device)
+    rows = []
+    for share in (None, 'attention', 'mlp', 'all'):
+        m = model.rebuild(share_blocks=share).eval()
+        rows.append(dict(share_blocks=share or 'none', params=sum(p.numel() for p in m.parameters()), size_mb=state_dict_mb(m),
+                         infer_ms=time_forward(m, x, n_runs=n_runs), train_ms=time_train_step(m, x, labels, n_runs=max(n_runs // 2, 1))))
+    for row in rows:
+        row['size_ratio'] = rows[0]['size_mb'] / row['size_mb']
+    print_report("Cross-block weight sharing", rows)
+    return rows
+
+
+def bench_pruning(model, loader, n_runs=10, ratios=(0.25, 0.5)):
+    """Structured head/Mlp pruning (prune_eegformer) at several ratios: parameters, size, latency and agreement."""
+    model = model.eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    x = x.to(device)
+
+    p32, labels = predict(model, loader, x.shape[0])
+    rows = []
+    for ratio in (0.0,) + tuple(ratios):
+        m = model if not ratio else prune_eegformer(model, head_ratio=ratio, hidden_ratio=ratio).eval()
+        p, _ = predict(m, loader, x.shape[0])
+        rows.append(dict(pruned=ratio, params=sum(t.numel() for t in m.parameters()), size_mb=state_dict_mb(m),
+                         ms_per_batch=time_forward(m, x, n_runs=n_runs), accuracy=accuracy(p, labels),
+                         agreement=(p.argmax(-1) == p32.argmax(-1)).float().mean().item() * 100))
+    for row in rows:
+        row['speedup'] = rows[0]['ms_per_batch'] / row['ms_per_batch']
+    print_report("Structured head/Mlp pruning", rows)
+    return rows
+
+
+def bench_distillation(model, loader, n_runs=10, num_epochs=2, **student_overrides):
+    """Teacher vs distilled student (distill.build_student): parameters, size, latency, accuracy and agreement."""
+    model = model.eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    x = x.to(device)
+    with tempfile.TemporaryDirectory() as tmp:
+        targets = cache_soft_targets(model, loader, os.path.join(tmp, 'teacher.pt'), x.shape[0])
+    student = build_student(model, **student_overrides)
+    losses = distill(student, loader, targets, num_epochs=num_epochs)
+    student.eval()
+    print(f"distillation loss per epoch: {[round(loss, 4) for loss in losses]}")
+
+    rows = []
+    for name, m in (('teacher', model), ('student', student)):
+        p, labels = predict(m, loader, x.shape[0])
+        rows.append(dict(model=name, params=sum(t.numel() for t in m.parameters()), size_mb=state_dict_mb(m),
+                         ms_per_batch=time_forward(m, x, n_runs=n_runs), accuracy=accuracy(p, labels),
+                         agreement=(p.argmax(-1) == targets['probs'].argmax(-1)).float().mean().item() * 100))
+    for row in rows:
+        row['speedup'] = rows[0]['ms_per_batch'] / row['ms_per_batch']
+    print_report("Knowledge distillation", rows)
+    return rows
+
+
+def bench_early_exit(model, loader, n_runs=10, thresholds=(0.6, 0.75, 0.9, 1.01)):
+    """Early exit at the RTM/STM CLS tokens: per-exit share and accuracy, and mean latency, at several confidence thresholds."""
+    model = model.eval()
+    x = loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]
+    exiting = add_exit_heads(model)
+    losses = train_exit_heads(exiting, loader, num_epochs=2, batch_size=x.shape[0])
+    print(f"exit head loss per epoch: {[round(loss, 4) for loss in losses]}, full forward {time_forward(model, x.to(device), n_runs=n_runs):.1f} ms")
+    rows = [exit_report(exiting, loader, threshold, x.shape[0]) for threshold in thresholds]  # 1.01: nothing exits early
+    print_report("Early exit", rows)
+    return rows
+
+
+def bench_feature_cache(model, loader, n_runs=10, stage='stm'):
+    """Fine-tuning epoch of ttm + cnndecoder (or cnndecoder) through the frozen prefix vs from the feature cache."""
+    batches = loader if isinstance(loader, list) else list(loader)
+    batch_size = batches[0][0].shape[0]
+    dataset = torch.utils.data.TensorDataset(torch.cat([x for x, _ in batches]), torch.cat([y for _, y in batches]))
+    model = copy.deepcopy(model)
+    criterion = torch.nn.CrossEntropyLoss()
+    trained = [getattr(model, name) for name in TRAINED[stage]]
+    optimizer = torch.optim.Adam([p for module in trained for p in module.parameters()], lr=1e-5)
+
+    start = time.perf_counter()
+    for x, y in batches:  # the usual epoch: the frozen prefix runs every time
+        with torch.no_grad():
+            features = prefix_forward(model, x.to(device), stage)
+        loss = criterion(model.decode(features if stage == 'ttm' else model.ttm(features)), y.to(device))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    full_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        cache = build_feature_cache(model, dataset, tmp, stage, batch_size)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        finetune_from_cache(model, cache, num_epochs=1, batch_size=batch_size)
+        cached_s = time.perf_counter() - start
+        cache_mb = os.path.getsize(os.path.join(cache.path, 'features.npy')) / 2 ** 20
+    rows = [dict(mode='full prefix', epoch_s=full_s, build_s=0.0, cache_mb=0.0),
+            dict(mode='feature cache', epoch_s=cached_s, build_s=build_s, cache_mb=cache_mb)]
+    for row in rows:
+        row['speedup'] = full_s / row['epoch_s']
+    print_report(f"Frozen-prefix feature cache ({stage})", rows)
+    return rows
+
+
+def bench_lora(model, loader, n_runs=10, rank=4):
+    """Per-patient LoRA adapters: checkpoint size, patient switch time and latency with the adapter applied on the fly or merged."""
+    x = (loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]).to(device)
+    adapted = add_lora(copy.deepcopy(model).eval(), rank=rank)
+    patients = []
+    for seed in (1, 2):  # two stand-in patients with random adapter deltas
+        with torch.no_grad():
+            for name, param in adapted.named_parameters():
+                if name.endswith('.B'):
+                    param.normal_(0, 1e-3)
+        patients.append(copy.deepcopy(adapter_state_dict(adapted)))
+    full_state = copy.deepcopy(model.state_dict())
+
+    def switch_ms(fn, n=5):
+        start = time.perf_counter()
+        for i in range(n):
+            fn(i)
+        return (time.perf_counter() - start) / n * 1000
+
+    full_ms = switch_ms(lambda i: model.load_state_dict(full_state))
+    merged_ms = switch_ms(lambda i: load_adapter(adapted, patients[i % 2], merge=True))
+    merged_infer = time_forward(adapted, x, n_runs=n_runs)
+    load_adapter(adapted, patients[0])
+    rows = [dict(mode='full state dict', checkpoint_mb=state_dict_mb(model), switch_ms=full_ms, infer_ms=time_forward(model, x, n_runs=n_runs)),
+            dict(mode='adapter on the fly', checkpoint_mb=sum(t.numel() * t.element_size() for t in patients[0].values()) / 2 ** 20,
+                 switch_ms=switch_ms(lambda i: load_adapter(adapted, patients[i % 2])), infer_ms=time_forward(adapted, x, n_runs=n_runs))]
+    rows.append(dict(rows[1], mode='adapter merged', switch_ms=merged_ms, infer_ms=merged_infer))
+    print_report(f"LoRA adapters (rank {rank})", rows)
+    return rows
+
+
+def bench_patient_heads(model, loader, n_runs=10, num_patients=4):
+    """Mixed-patient batch: one forward per patient vs one shared odcm/rtm/stm pass with per-sample patient heads."""
+    x = (loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]).to(device)
+    model = copy.deepcopy(model).eval()
+    for _ in range(num_patients):
+        model.add_patient_head()
+    head = torch.arange(x.shape[0], device=device) % num_patients
+
+    def per_patient():  # the previous request cycle: each patient's windows, padded to the model's fixed batch, through that patient's model
+        for k in range(num_patients):
+            idx = (head == k).nonzero().squeeze(1)
+            model(torch.cat((x[idx], x.new_zeros((x.shape[0] - len(idx),) + x.shape[1:]))), k)
+
+    with torch.no_grad():
+        per_patient()
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            per_patient()
+        loop_ms = (time.perf_counter() - start) / n_runs * 1000
+    rows = [dict(mode='forward per patient', patients=num_patients, ms_per_batch=loop_ms),
+            dict(mode='per-sample heads', patients=num_patients, ms_per_batch=time_forward(lambda inputs: model(inputs, head), x, n_runs=n_runs))]
+    for row in rows:
+        row['speedup'] = loop_ms / row['ms_per_batch']
+    print_report("Multi-patient batched inference", rows)
+    return rows
+
+
+def bench_channels(model, loader, n_runs=10, channels=19):
+    """Multichannel windows on a single-channel model: one forward per channel vs channels folded into chunks of B or one batched forward."""
+    x = (loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]).to(device)
+    x = x.repeat(1, channels, 1) + 0.1 * torch.randn(x.shape[0], channels, x.shape[-1], device=device)  # [B, C, T]
+    model = model.eval()
+    n_runs = max(n_runs // 5, 1)
+
+    def per_channel():  # one [B, 1, T] forward per channel
+        return torch.stack([model(x[:, c:c + 1]) for c in range(channels)], 1)
+
+    with torch.no_grad():
+        per_channel()
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            per_channel()
+        loop_ms = (time.perf_counter() - start) / n_runs * 1000
+    rows = [dict(mode='forward per channel', channels=channels, ms_per_batch=loop_ms),
+            dict(mode='channels folded, chunks of B', channels=channels,
+                 ms_per_batch=time_forward(lambda inputs: model.predict_channels(inputs, chunk_size=x.shape[0]), x, n_warmup=1, n_runs=n_runs)),
+            dict(mode='channels folded', channels=channels,
+                 ms_per_batch=time_forward(lambda inputs: model.predict_channels(inputs), x, n_warmup=1, n_runs=n_runs))]
+    for row in rows:
+        row['speedup'] = loop_ms / row['ms_per_batch']
+    print_report("Channel-batched inference", rows)
+    return rows
+
+
+def bench_montages(model, loader, n_runs=10, montages=(19, 21, 23, 32)):
+    """
+    Windows of several montages: one zero-padded batch with a channel mask on a model of the largest montage vs
+    the alternative without masks, one model per montage each running its own batch of that montage's windows.
+    """
+    C = max(montages)
+    model = build_model(input_channels=C, num_cls=model.num_cls).eval() if model.input_channels != C else model.eval()
+    B = model.rtm.inputshape[0]
+    x = torch.randn(B, C, DEFAULT_SAMPLES, device=device)
+    counts = torch.tensor(montages, device=device).repeat_interleave(-(-B // len(montages)))[:B]  # channels of each window
+    mask = torch.arange(C, device=device)[None] < counts[:, None]
+    x = x * mask[:, :, None]
+    n_runs = max(n_runs // 5, 1)
+    # without masks: one forward per montage on its own model, with its channels only (the models are built for a
+    # fixed batch size B, so each montage's group of windows runs as one batch of B)
+    loop_ms = 0.0
+    for m in montages:
+        montage_model = model if m == C else build_model(B, input_channels=m, num_cls=model.num_cls).eval()
+        loop_ms += time_forward(montage_model, x[:, :m].clone(), n_warmup=1, n_runs=n_runs)
+        del montage_model  # one montage model in memory at a time
+    rows = [dict(mode='model per montage', montages=len(montages), ms_per_batch=loop_ms),
+            dict(mode='masked mixed batch', montages=len(montages),
+                 ms_per_batch=time_forward(lambda inputs: model(inputs, channel_mask=mask), x, n_warmup=1, n_runs=n_runs))]
+    for row in rows:
+        row['speedup'] = loop_ms / row['ms_per_batch']
+    print_report("Mixed-montage batches", rows)
+    return rows
+
+
+def bench_buckets(model, loader, n_runs=10, seconds=(3, 6, 12)):
+    """Throughput of every length bucket, and of running the same windows zero-padded to the longest bucket."""
+    config = {k: v for k, v in model.get_config().items() if k in DEFAULT_CONFIG}
+    B = model.rtm.inputshape[0]
+    buckets = BucketedEEGformer(bucket_samples(config, seconds, sampling_rate), batch_size=B, **config).to(device).eval()
+    longest = buckets.lengths[-1]
+    n_runs = max(n_runs // 5, 1)
+    rows = []
+    for t in buckets.lengths:
+        x = torch.randn(B, config['input_channels'], t, device=device)
+        padded = torch.nn.functional.pad(x, (0, longest - t))
+        for mode, inputs in (('bucket', x), ('padded to longest', padded)):
+            if mode != 'bucket' and t == longest:
+                continue
+            ms = time_forward(buckets, inputs, n_warmup=1, n_runs=n_runs)
+            rows.append(dict(mode=mode, seconds=round(t / sampling_rate, 2), samples=inputs.shape[-1], ms_per_batch=ms,
+                             windows_per_s=B / ms * 1000))
+    print_report("Length buckets", rows)
+    return rows
+
+
+def bench_token_stride(model, loader, n_runs=10, strides=(1, 2, 3, 6), num_epochs=2, lr=1e-4):
+    """
+    Temporal token pooling after ODCM (token_stride): tokens, size, latency, and the accuracy of each stride
+    trained from scratch for num_epochs on the loader (the RTM/STM/TTM weights are sized by the token count).
+    """
+    x = (loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]).to(device)
+    rows = []
+    for stride in strides:
+        m = model.rebuild(token_stride=stride, pruned=None).train()
+        optimizer = torch.optim.Adam(m.parameters(), lr=lr)
+        for epoch_idx in range(num_epochs):
+            for inputs, labels in loader:
+                if inputs.shape[0] == x.shape[0]:
+                    train_step(m, inputs.to(device), labels.to(device), optimizer, enabled=False)
+        p, labels = predict(m.eval(), loader, x.shape[0])
+        rows.append(dict(token_stride=stride, tokens=m.outshape1.shape[3], size_mb=state_dict_mb(m),
+                         ms_per_batch=time_forward(m, x, n_runs=n_runs), accuracy=accuracy(p, labels)))
+    for row in rows:
+        row['speedup'] = rows[0]['ms_per_batch'] / row['ms_per_batch']
+    print_report("Temporal token pooling", rows)
+    return rows
+
+
+def bench_recording(model, loader, n_runs=10, num_recordings=4, minutes=1, hop_seconds=1.0, num_epochs=5):
+    """Recording-level classification: one backbone pass to cache window embeddings, then aggregator epochs and re-scoring from the cache."""
+    window = model.samples
+    hop = int(hop_seconds * sampling_rate)
+    gen = torch.Generator().manual_seed(0)
+    recordings = [(f'rec{i}', torch.randn(model.input_channels, int(minutes * 60 * sampling_rate), generator=gen), i % model.num_cls)
+                  for i in range(num_recordings)]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        dataset = build_recording_cache(model, recordings, tmp, window, hop)
+        cache_s = time.perf_counter() - start
+        num_windows = sum(len(dataset[i][0]) for i in range(len(dataset)))
+        classifier = RecordingClassifier(dataset[0][0].shape[1], model.num_cls).to(device)
+        start = time.perf_counter()
+        train_recording_classifier(classifier, dataset, num_epochs=num_epochs)
+        epoch_ms = (time.perf_counter() - start) / num_epochs * 1000
+        start = time.perf_counter()
+        score_recordings(classifier, dataset)
+        score_ms = (time.perf_counter() - start) * 1000
+    rows = [dict(step='backbone pass + cache', recordings=num_recordings, windows=num_windows, ms=cache_s * 1000),
+            dict(step='aggregator epoch', recordings=num_recordings, windows=num_windows, ms=epoch_ms),
+            dict(step='re-score from cache', recordings=num_recordings, windows=num_windows, ms=score_ms)]
+    print_report("Recording-level classifier", rows)
+    return rows
+
+
+def bench_sliding(model, loader, n_runs=10, seconds=60, hop_seconds=0.5):
+    """Sliding-window scan of a recording: ODCM per window vs one ODCM pass per chunk of windows (sliding_odcm), ODCM alone and end to end."""
+    model = model.eval()
+    window, hop = model.samples, int(hop_seconds * sampling_rate)
+    recording = torch.randn(model.input_channels, int(seconds * sampling_rate))
+    windows = sliding_windows(recording, window, hop).to(device)
+    B = model.outshape1.shape[0]
+    n_runs = max(n_runs // 5, 1)
+
+    def odcm_per_window():
+        return [model.odcm(windows[i:i + B]) for i in range(0, windows.shape[0], B)]
+
+    def odcm_shared():
+        return [sliding_odcm(model, recording, window, hop, i, min(B, windows.shape[0] - i)) for i in range(0, windows.shape[0], B)]
+
+    rows = []
+    with torch.no_grad():
+        for mode, fn in (('ODCM per window', odcm_per_window), ('ODCM shared', odcm_shared),
+                         ('scan, ODCM per window', lambda: predict_sliding(model, recording, hop, shared_odcm=False)),
+                         ('scan, ODCM shared', lambda: predict_sliding(model, recording, hop))):
+            fn()
+            start = time.perf_counter()
+            for _ in range(n_runs):
+                fn()
+            rows.append(dict(mode=mode, windows=windows.shape[0], ms=(time.perf_counter() - start) / n_runs * 1000))
+    for row in rows:
+        row['speedup'] = rows[0 if row['mode'].startswith('ODCM') else 2]['ms'] / row['ms']
+    print_report("Sliding-window ODCM sharing", rows)
+    return rows
+
+
+def bench_prediction_cache(model, loader, n_runs=10, repeat_fractions=(0.0, 0.5, 0.9), num_requests=10):
+    """Repeated scoring requests: plain forward vs CachedEEGformer at several fractions of re-requested batches."""
+    model = model.eval()
+    x = (loader[0][0] if isinstance(loader, list) else next(iter(loader))[0]).to(device)
+    gen = torch.Generator().manual_seed(0)
+    rows = []
+    for fraction in repeat_fractions:
+        requests = [torch.randn(x.shape, generator=gen).to(device)]
+        for _ in range(num_requests - 1):
+            repeat = torch.rand(1, generator=gen).item() < fraction
+            requests.append(requests[torch.randint(len(requests), (1,), generator=gen).item()] if repeat else torch.randn(x.shape, generator=gen).to(device))
+        cached = CachedEEGformer(model, PredictionCache())
+        timings = {}
+        with torch.no_grad():
+            for name, m in (('plain', model), ('cached', cached)):
+                start = time.perf_counter()
+                for inputs in requests:
+                    m(inputs)
+                timings[name] = (time.perf_counter() - start) / num_requests * 1000
+        rows.append(dict(repeat_fraction=fraction, hit_rate=cached.stats()['hit_rate'], plain_ms=timings['plain'],
+                         cached_ms=timings['cached'], speedup=timings['plain'] / timings['cached']))
+    print_report("Prediction cache", rows)
+    return rows
+
+
+BENCHMARKS = {
+    'quantization': bench_quantization,
+    'qat': bench_qat,
+    'bf16': bench_bf16,
+    'checkpointing': bench_checkpointing,
+    'numpy': bench_numpy,
+    'freeze': bench_freeze,
+    'lowrank': bench_lowrank,
+    'sharing': bench_sharing,
+    'pruning': bench_pruning,
+    'distillation': bench_distillation,
+    'early_exit': bench_early_exit,
+    'feature_cache': bench_feature_cache,
+    'lora': bench_lora,
+    'patient_heads': bench_patient_heads,
+    'channels': bench_channels,
+    'montages': bench_montages,
+    'buckets': bench_buckets,
+    'token_stride': bench_token_stride,
+    'recording': bench_recording,
+    'sliding': bench_sliding,
+    'prediction_cache': bench_prediction_cache,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EEGformer CPU benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--checkpoint", default=None, help="fp32 state dict (.pth); random weights if omitted")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--num-batches", type=int, default=4, help="synthetic batches used for accuracy/agreement")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = build_model(args.batch_size, checkpoint=args.checkpoint)
+    loader = synthetic_loader(args.batch_size, num_batches=args.num_batches)
+    BENCHMARKS[args.benchmark](model, loader, n_runs=args.runs)
@@ -0,0 +1,134 @@
+import random
+import torch
+import torch.nn as nn
+from torch.utils.data import Sampler
+
+from models import EEGformer
+from validate import config_problems, validate_config
+
+# Variable-duration windows: EEGformer fixes its input length T at construction (RTM/STM embed the S = T - 3(k-1)
+# time steps), so each length bucket is its own EEGformer. Windows are cropped to the largest bucket that fits them
+# and batched per bucket, so 3 s windows never pay for the 12 s model.
+
+
+def fit_samples(config, samples):  # largest input length <= samples the config can be built for
+    for t in range(samples, 0, -1):
+        if not config_problems(config, t):
+            return t
+    validate_config(config, samples)  # raises with the reason no length fits
+
+
+def bucket_samples(config, seconds, sampling_rate):
+    """Bucket input lengths for window durations in seconds: each duration cropped to the nearest length valid for the config."""
+    return sorted({fit_samples(config, int(round(s * sampling_rate))) for s in seconds})
+
+
+class BucketedEEGformer(nn.Module):
+    """
+    One EEGformer per input length bucket; a batch runs through the model of the largest bucket not longer than it.
+
+    The ODCM depthwise convs do not depend on the input length, so with share_odcm all buckets use the same ODCM
+    weights. RTM/STM/TTM/CNNdecoder weights are sized by the length and stay per bucket.
+
+    Args:
+        lengths: bucket input lengths T, e.g. from bucket_samples
+        batch_size: batch size B the buckets are built for (the per-position RTM/STM/TTM weights)
+        share_odcm: use the first bucket's ODCM in every bucket
+        **config: EEGformer constructor arguments (num_cls, input_channels, kernel_size, ...)
+    """
+    def __init__(self, lengths, batch_size=8, share_odcm=True, **config):
+        super(BucketedEEGformer, self).__init__()
+        self.lengths = sorted(lengths)
+        self.batch_size = batch_size
+        self.share_odcm = share_odcm
+        self.config = config
+        for t in self.lengths:
+            validate_config(config, t)
+        self.models = nn.ModuleDict({str(t): EEGformer(input=torch.randn(batch_size, t, config['input_channels']), **config)
+                                     for t in self.lengths})
+        if share_odcm:
+            for t in self.lengths[1:]:
+                self.models[str(t)].odcm = self.models[str(self.lengths[0])].odcm
+        self.compiled = {}  # bucket length -> compiled model, filled by compile_buckets
+
+    def bucket(self, samples):  # largest bucket length <= samples
+        fitting = [t for t in self.lengths if t <= samples]
+        if not fitting:
+            raise ValueError(f"windows of {samples} samples are shorter than the smallest bucket ({self.lengths[0]})")
+        return fitting[-1]
+
+    def forward(self, x, **kwargs):  # x: [B, C, T] windows of one length, cropped to its bucket
+        t = self.bucket(x.shape[-1])
+        if t in self.compiled and not kwargs and not self.training:
+            return self.compiled[t](x[..., :t])
+        return self.models[str(t)](x[..., :t], **kwargs)
+
+    def compile_buckets(self, **compile_kwargs):  # torch.compile every bucket once up front (eval mode inference)
+        from export import compile_model, example_input
+        self.compiled = {t: compile_model(self.models[str(t)], example=example_input(self.models[str(t)]), **compile_kwargs)
+                         for t in self.lengths}
+        return self
+
+    def get_config(self):
+        return dict(lengths=self.lengths, batch_size=self.batch_size, share_odcm=self.share_odcm, **self.config)
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batches of dataset indices whose windows fall into the same length bucket.
+
+    Args:
+        sample_lengths: available samples of every dataset window
+        lengths: bucket input lengths; a window goes to the largest bucket not longer than it (shorter windows are dropped)
+        batch_size: windows per batch
+        shuffle: shuffle within buckets and the order of the batches every epoch
+        drop_last: drop each bucket's last incomplete batch (the models are built for a fixed batch size)
+    """
+    def __init__(self, sample_lengths, lengths, batch_size, shuffle=True, drop_last=True, seed=0):
+        self.lengths = sorted(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.buckets = {t: [] for t in self.lengths}
+        for idx, samples in enumerate(sample_lengths):
+            fitting = [t for t in self.lengths if t <= samples]
+            if fitting:
+                self.buckets[fitting[-1]].append(idx)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self):  # list of (bucket length, indices)
+        rng = random.Random(self.seed + self.epoch)
+        batches = []
+        for t, indices in self.buckets.items():
+            indices = list(indices)
+            if self.shuffle:
+                rng.shuffle(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append((t, batch))
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):  # a new shuffle every epoch
+        batches = self.batches()
+        self.epoch += 1
+        return iter([batch for t, batch in batches])
+
+    def __len__(self):
+        return sum(len(v) // self.batch_size if self.drop_last else -(-len(v) // self.batch_size) for v in self.buckets.values())
+
+
+def bucket_collate(lengths):
+    """DataLoader collate_fn stacking (window [C, T_i], label) items cropped to the bucket of the shortest window."""
+    lengths = sorted(lengths)
+
+    def collate(items):
+        t = [t for t in lengths if t <= min(x.shape[-1] for x, _ in items)][-1]
+        return torch.stack([x[..., :t] for x, _ in items]), torch.stack([torch.as_tensor(y) for _, y in items])
+    return collate
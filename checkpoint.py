@@ -0,0 +1,49 @@
+import hashlib
+import torch
+from collections import OrderedDict
+
+
+def load_state_dict_file(path, map_location="cpu"):
+    """
+    Load a saved EEGformer state dict.
+
+    Args:
+        path: .pth file written with torch.save(model.state_dict(), path)
+        map_location: device the tensors are loaded onto
+
+    Returns:
+        OrderedDict with the "module." prefix of nn.DataParallel checkpoints removed
+    """
+    state_dict = torch.load(path, map_location=map_location)
+
+    # If trained with DataParallel, remove "module." prefix
+    if len(state_dict) and "module." in list(state_dict.keys())[0]:
+        new_state_dict = OrderedDict()
+        for k, v in state_dict.items():
+            new_state_dict[k.replace("module.", "")] = v
+        state_dict = new_state_dict
+
+    return state_dict
+
+
+def load_checkpoint(model, path, strict=True):
+    model.load_state_dict(load_state_dict_file(path), strict=strict)
+    return model
+
+
+def state_dict_hash(state_dict, prefixes=None):
+    """
+    SHA-256 hex digest of a state dict's entries (names, shapes, dtypes and values), e.g. to key caches of model outputs.
+
+    Args:
+        state_dict: model.state_dict() or the result of load_state_dict_file
+        prefixes: only hash the entries whose name starts with one of these (e.g. ('odcm.', 'rtm.')); None hashes all
+    """
+    digest = hashlib.sha256()
+    for name in sorted(state_dict):
+        if prefixes is not None and not name.startswith(tuple(prefixes)):
+            continue
+        tensor = state_dict[name].detach().cpu().contiguous().reshape(-1)
+        digest.update(f"{name}:{tuple(state_dict[name].shape)}:{tensor.dtype};".encode())
+        digest.update(tensor.view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,101 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data import BatchSampler, DataLoader, SequentialSampler
+
+from models import device
+
+# Knowledge distillation of a trained (teacher) EEGformer into a smaller student EEGformer.
+# The teacher runs once over the training data and its class probabilities are cached to disk, so
+# student epochs cost only the student's forward/backward.
+
+STUDENT_CONFIG = dict(num_blocks=1, num_heads_RTM=3, num_heads_STM=3, num_submatrices=6)  # overrides of the teacher's config
+EPS = 1e-8  # floor of the probabilities before the log (the models output softmax probabilities, not logits)
+
+
+def check_fixed_order(loader):  # the targets are matched to the batches by their position, so a DataLoader must not shuffle
+    if not isinstance(loader, DataLoader):
+        return
+    batches = loader.batch_sampler
+    sampler = loader.sampler if batches is None else batches.sampler if type(batches) is BatchSampler else None
+    if not isinstance(sampler, SequentialSampler):
+        raise ValueError("soft targets are matched to the loader's batches in order; use a DataLoader with shuffle=False and no custom sampler")
+
+
+def cache_soft_targets(teacher, loader, path, batch_size=None):
+    """
+    Run the teacher once over loader and save its class probabilities.
+
+    Args:
+        teacher: trained EEGformer
+        loader: iterable of (inputs, labels) batches in a fixed order (no shuffling), e.g. a list or a DataLoader with shuffle=False
+        path: .pt file the targets are written to
+        batch_size: batch size the teacher is built for; other batches are skipped (and skipped again by distill)
+
+    Returns:
+        dict with 'probs' [N, num_cls] and 'labels' [N] in loader order, as saved
+    """
+    check_fixed_order(loader)
+    teacher = teacher.eval()
+    probs, labels = [], []
+    with torch.no_grad():
+        for inputs, label in loader:
+            if batch_size is not None and inputs.shape[0] != batch_size:
+                continue
+            probs.append(teacher(inputs.to(device)).float().cpu())
+            labels.append(label)
+    targets = dict(probs=torch.cat(probs), labels=torch.cat(labels), batch_size=batch_size)
+    torch.save(targets, path)
+    return targets
+
+
+def build_student(teacher, **overrides):
+    """Freshly initialized student for the teacher's input shape: the teacher config with STUDENT_CONFIG and overrides applied."""
+    return teacher.rebuild(**dict(STUDENT_CONFIG, pruned=None, **overrides))
+
+
+def distillation_loss(probs, teacher_probs, labels, temperature=2.0, alpha=0.5):
+    """
+    alpha * T^2 * KL(teacher || student) on the temperature-softened distributions + (1 - alpha) * the hard-label loss.
+
+    Both models output probabilities, so their logs serve as logits (softmax is invariant to the per-sample shift).
+    The hard-label term is the notebooks' nn.CrossEntropyLoss on the model output.
+    """
+    student = F.log_softmax(torch.log(probs.float().clamp_min(EPS)) / temperature, dim=-1)
+    teacher = F.softmax(torch.log(teacher_probs.float().clamp_min(EPS)) / temperature, dim=-1)
+    soft = F.kl_div(student, teacher, reduction='batchmean') * temperature ** 2
+    return alpha * soft + (1 - alpha) * F.cross_entropy(probs, labels)
+
+
+def distill(student, loader, targets, num_epochs=1, lr=1e-4, temperature=2.0, alpha=0.5):
+    """
+    Train the student against cached teacher targets; returns the mean loss per epoch.
+
+    Args:
+        student: EEGformer, e.g. from build_student
+        loader: the loader the targets were cached from, iterated in the same order (a DataLoader must not shuffle)
+        targets: path written by cache_soft_targets, or its returned dict
+    """
+    if not isinstance(targets, dict):
+        targets = torch.load(targets)
+    check_fixed_order(loader)
+    batch_size = targets['batch_size']
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    student.train()
+    losses = []
+    for epoch_idx in range(num_epochs):
+        total_loss, num_batches, offset = 0.0, 0, 0
+        for inputs, labels in loader:
+            if batch_size is not None and inputs.shape[0] != batch_size:
+                continue
+            teacher_probs = targets['probs'][offset:offset + inputs.shape[0]]
+            if not torch.equal(targets['labels'][offset:offset + inputs.shape[0]], labels):
+                raise ValueError(f"batch {num_batches} does not match the cached targets; the loader must keep the order used by cache_soft_targets")
+            offset += inputs.shape[0]
+            loss = distillation_loss(student(inputs.to(device)), teacher_probs.to(device), labels.to(device), temperature, alpha)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            num_batches += 1
+        losses.append(total_loss / max(num_batches, 1))
+    return losses
@@ -0,0 +1,87 @@
+import time
+import torch
+import torch.nn as nn
+
+from models import device
+
+EXIT_NAMES = ('rtm', 'stm', 'final')  # exit index 0, 1, 2 of EEGformer.predict_early_exit
+
+
+def add_exit_heads(model):
+    """Copy of a trained EEGformer with freshly initialized exit heads (early_exit=True) and all other weights kept."""
+    exiting = model.rebuild(early_exit=True).train(model.training)
+    missing, unexpected = exiting.load_state_dict(model.state_dict(), strict=False)
+    assert not unexpected and all(k.startswith('exits.') for k in missing), (missing, unexpected)
+    return exiting
+
+
+def exit_outputs(model, x):  # [RTM exit, STM exit] logits with the backbone run without autograd (no TTM/decoder pass)
+    with torch.no_grad():
+        x = model.rtm(model.odcm(x))
+        rtm_cls = x[:, :, 0]
+        stm_cls = model.stm(x)[:, :, 0]
+    return [model.exits['rtm'](rtm_cls), model.exits['stm'](stm_cls)]
+
+
+def train_exit_heads(model, train_loader, num_epochs=1, lr=1e-3, batch_size=None, weights=(1.0, 1.0, 0.0)):
+    """
+    Train the exit heads with the notebooks' loss/optimizer; returns the mean loss per epoch.
+
+    weights scale the loss of the RTM exit, the STM exit and the final output. With the default (0 for the
+    final output) only the exit heads are updated: the backbone runs without autograd up to STM (no TTM/decoder
+    pass), so no gradients accumulate in its parameters. A non-zero final weight fine-tunes the whole model jointly.
+    The exit losses are on the heads' logits; the final output keeps the notebooks' loss on the model's probabilities.
+    """
+    criterion = nn.CrossEntropyLoss()
+    joint = bool(weights[2])
+    optimizer = torch.optim.Adam(model.parameters() if joint else model.exits.parameters(), lr=lr)
+    if joint:
+        model.train()
+    else:  # frozen backbone in inference mode, only the heads train
+        model.eval()
+        model.exits.train()
+    losses = []
+    for epoch_idx in range(num_epochs):
+        total_loss, num_batches = 0.0, 0
+        for inputs, labels in train_loader:
+            if batch_size is not None and inputs.shape[0] != batch_size:
+                continue
+            inputs, labels = inputs.to(device), labels.to(device)
+            outputs = model.forward_exits(inputs) if joint else exit_outputs(model, inputs)
+            loss = sum(w * criterion(out, labels) for w, out in zip(weights, outputs) if w)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            num_batches += 1
+        losses.append(total_loss / max(num_batches, 1))
+    return losses
+
+
+def exit_report(model, loader, threshold=0.9, batch_size=None):
+    """
+    Early-exit inference over a loader.
+
+    Returns:
+        dict with the overall accuracy, mean milliseconds per batch, and per exit ('rtm', 'stm', 'final')
+        the fraction of samples leaving there and their accuracy (None if no sample left there)
+    """
+    model = model.eval()
+    exits, correct, elapsed, num_batches = [], [], 0.0, 0
+    with torch.no_grad():
+        for inputs, labels in loader:
+            if batch_size is not None and inputs.shape[0] != batch_size:
+                continue
+            start = time.perf_counter()
+            probs, exit_index = model.predict_early_exit(inputs.to(device), threshold)
+            elapsed += time.perf_counter() - start
+            num_batches += 1
+            exits.append(exit_index.cpu())
+            correct.append(probs.argmax(-1).cpu() == labels)
+    exits, correct = torch.cat(exits), torch.cat(correct)
+    report = dict(threshold=threshold, accuracy=correct.float().mean().item() * 100, ms_per_batch=elapsed / max(num_batches, 1) * 1000)
+    for index, name in enumerate(EXIT_NAMES):
+        here = exits == index
+        report[f'{name}_fraction'] = here.float().mean().item() * 100
+        report[f'{name}_accuracy'] = correct[here].float().mean().item() * 100 if here.any() else None
+    return report
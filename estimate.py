@@ -0,0 +1,198 @@
+import argparse
+import math
+
+# Analytic cost model of models.EEGformer, computed from the config and input shape alone (no torch needed).
+# FLOPs count a multiply-add as 2; elementwise ops (LayerNorm, GELU, adds) as a few FLOPs per element.
+# Memory is in bytes of dtype_bytes elements; activations count the tensors the ops keep alive, so the measured
+# process peak is higher (allocator slack, transient gradient buffers in backward).
+
+NCF = 120  # depth-wise filters per channel in ODCM
+LN_FLOPS = 5  # per element: mean, variance, normalize, scale, shift
+GELU_FLOPS = 8
+
+
+def _block_cost(groups, tokens, D, num_heads, temporal, rank=None, heads=None, hidden=None):
+    """
+    One GenericTFB/TemporalTFB applied to groups x tokens token vectors of size D (attention over tokens),
+    with only heads of the num_heads heads and an Mlp of width hidden (default 4D) when pruned.
+
+    Returns ((attention params, Mlp params), flops, inference peak elements, saved-for-backward elements).
+    """
+    Dh = D // num_heads
+    heads = num_heads if heads is None else heads
+    hidden = hidden or 4 * D
+    hd = heads * Dh
+    N = groups * tokens  # token vectors
+    scores = groups * heads * tokens * tokens
+
+    if temporal:  # Wo [D, hd], or its rank-r factors (TemporalTFB with ttm_rank)
+        wo = D * hd if rank is None else (D + hd) * rank
+    else:  # Wo [hd, D]
+        wo = hd * D
+    mlp = 2 * D * hidden if rank is None else 2 * (D + hidden) * rank  # fc1 + fc2 weights
+    params = (3 * hd * D + wo + 2 * D, mlp + hidden + D + 2 * D)  # Wqkv, Wo, lnorm / Mlp with biases, lnormz
+    flops = 2 * LN_FLOPS * N * D  # lnorm, lnormz
+    flops += 2 * N * D * 3 * hd  # Q, K, V
+    flops += 2 * 2 * scores * Dh + scores  # QK^T (scaled), attention @ V
+    flops += 2 * N * wo if temporal else hd * D + N * hd  # Wo: matmul, or row-sum of Wo and a per-feature scale
+    flops += 2 * N * mlp + GELU_FLOPS * N * hidden  # Mlp
+    flops += 2 * N * D  # residual adds
+
+    attention_peak = N * D * 2 + N * 3 * hd + 2 * N * hd + 2 * scores  # z, LN(z), qkv, cloned q/k, scores (+ clone)
+    mlp_peak = N * D * 2 + 2 * N * hidden  # z, LN(z), fc1 output and GELU output
+    saved = N * D * 8 + N * 3 * hd + 3 * N * hd + 2 * scores + 2 * N * hidden  # inputs of every op in the block
+    return params, flops, max(attention_peak, mlp_peak), saved
+
+
+def _block_costs(config, name, groups, tokens, D, num_heads, temporal, rank=None):  # _block_cost of every block of a stage
+    pruned = (config.get('pruned') or {}).get(name)
+    if pruned is None:
+        return [_block_cost(groups, tokens, D, num_heads, temporal, rank)] * config['num_blocks']
+    return [_block_cost(groups, tokens, D, num_heads, temporal, rank, len(block['heads']), block['hidden']) for block in pruned]
+
+
+def _stage(name, params, flops, peak, saved, embed_out, blocks, checkpoint_every, share=None):
+    num_blocks = len(blocks)
+    attention_params = [attention for (attention, _), _, _, _ in blocks]
+    mlp_params = [mlp for (_, mlp), _, _, _ in blocks]
+    if share in ('all', 'attention'):  # share_blocks ties these parts to the first block
+        attention_params = attention_params[:1]
+    if share in ('all', 'mlp'):
+        mlp_params = mlp_params[:1]
+    block_flops = sum(block[1] for block in blocks)
+    block_saved = [block[3] for block in blocks]
+    if checkpoint_every:  # only the block inputs at group boundaries are kept, one group at a time is recomputed in backward
+        kept = math.ceil(num_blocks / checkpoint_every) * embed_out
+        recompute = max(sum(block_saved[k:k + checkpoint_every]) for k in range(0, num_blocks, checkpoint_every))
+        recompute_flops = block_flops  # every block runs its forward again in backward
+    else:
+        kept, recompute, recompute_flops = sum(block_saved), 0, 0
+    return dict(stage=name, params=params + sum(attention_params) + sum(mlp_params), flops=flops + block_flops,
+                infer_peak=max(peak, max(block[2] for block in blocks) + embed_out), train_saved=saved + kept, recompute=recompute,
+                recompute_flops=recompute_flops)
+
+
+def estimate_cost(config, batch_size, samples, dtype_bytes=4, optimizer_states=2):
+    """
+    Parameter count, FLOPs and activation memory per stage of an EEGformer, without building it.
+
+    Args:
+        config: EEGformer constructor arguments, e.g. EEGformer.get_config() or benchmark.DEFAULT_CONFIG
+        batch_size: batch size B the model is built for (RTM/STM/TTM parameters scale with it)
+        samples: input length T
+        dtype_bytes: bytes per parameter/activation element (4 for fp32)
+        optimizer_states: optimizer tensors kept per parameter for training (2 for Adam)
+
+    Returns:
+        dict with 'stages' (per stage: params, inference FLOPs, inference peak activation bytes, the
+        activation bytes kept for backward and, with checkpoint_every, the bytes of one recomputed group)
+        and the totals: params, param_bytes, infer_flops, train_flops (forward + backward ~ 3x forward,
+        plus the recomputed forwards), infer_peak_bytes and train_peak_bytes (weights, gradients,
+        optimizer states and saved activations).
+    """
+    B, C, T = batch_size, config['input_channels'], samples
+    k, M = config['kernel_size'], config['num_submatrices']
+    num_cls, N2 = config['num_cls'], config['CF_second']
+    ckpt = config.get('checkpoint_every', 0)
+    rank = config.get('ttm_rank')
+    share = config.get('share_blocks')
+    stride = config.get('token_stride', 1)
+    S_conv = T - 3 * (k - 1)  # time steps after the three valid convs
+    S = S_conv // stride  # tokens after the strided average pooling
+    if S <= 0:
+        raise ValueError(f"input length {T} is too short for three convolutions of kernel size {k} and token_stride {stride}")
+    F = NCF + 1  # features + cls token
+    L = (C + 1) * F  # TTM token size
+    stages = []
+
+    # ODCM: two depth-wise convs over C channels, then NCF filters per channel
+    t1, t2 = T - k + 1, T - 2 * (k - 1)
+    conv_out, odcm_out = B * C * NCF * S_conv, B * C * NCF * S
+    pool = (conv_out + odcm_out if stride > 1 else 0)  # pooling reads the conv output and writes the tokens
+    stages.append(dict(stage='odcm', params=2 * (C * k + C) + NCF * C * (k + 1),
+                       flops=2 * B * C * k * (t1 + t2) + 2 * B * NCF * C * k * S_conv + B * C * (t1 + t2) + conv_out + pool,
+                       infer_peak=B * C * T + B * C * t1 + conv_out + (odcm_out if stride > 1 else 0),
+                       train_saved=B * C * (T + 2 * t1 + 2 * t2) + 2 * conv_out + (odcm_out if stride > 1 else 0)))
+
+    # RTM: per-sample [S, S] embedding of every (channel, filter) row, attention over the 121 filter tokens
+    rtm_out = B * C * F * S
+    stages.append(_stage('rtm', B * S * S + B * C * (F + 1) * S, 2 * B * C * NCF * S * S + 2 * rtm_out,
+                         odcm_out + 2 * rtm_out, odcm_out + 2 * rtm_out, rtm_out,
+                         _block_costs(config, 'rtm', B * C, F, S, config['num_heads_RTM'], False), ckpt, share))
+
+    # STM: per-sample [S, S] embedding, attention over the C+1 channel tokens of every filter
+    stm_out = B * F * (C + 1) * S
+    stages.append(_stage('stm', B * S * S + B * F * (C + 2) * S, 2 * B * F * C * S * S + 2 * stm_out,
+                         rtm_out + 2 * stm_out, rtm_out + 2 * stm_out, stm_out,
+                         _block_costs(config, 'stm', B * F, C + 1, S, config['num_heads_STM'], False), ckpt, share))
+
+    # TTM: average S steps into M segments, per-sample [L, L] embedding, attention over the M+1 segment tokens
+    ttm_out = B * (M + 1) * L
+    embed = L * L if rank is None else 2 * L * rank  # per-sample weight, or its rank-r factors
+    ttm = _stage('ttm', B * embed + B * (M + 2) * L, B * S * L + 2 * B * M * embed + 2 * ttm_out,
+                 stm_out + B * M * L + 2 * ttm_out, B * M * L + 2 * ttm_out, ttm_out,
+                 _block_costs(config, 'ttm', B, M + 1, L, config['num_heads_TTM'], True, rank), ckpt, share)
+    ttm['params'] += 2 * L  # lnorm_extra
+    ttm['flops'] += LN_FLOPS * ttm_out
+    ttm['train_saved'] += ttm_out
+    stages.append(ttm)
+
+    # CNNdecoder: 1x1 convs over the features, channels and segment tokens, then fc
+    half = (M + 1) // 2
+    stages.append(dict(stage='decoder', params=(F + 1) + (C + 1) * N2 + N2 + (M + 1) * half + half + half * N2 * num_cls + num_cls,
+                       flops=2 * B * (M + 1) * (C + 1) * F + 2 * B * N2 * (C + 1) * (M + 1) + 2 * B * half * (M + 1) * N2 + 2 * B * half * N2 * num_cls,
+                       infer_peak=ttm_out + B * (C + 1) * (M + 1), train_saved=ttm_out + B * ((C + 1) * (M + 1) + N2 * (M + 1) + half * N2)))
+    if config.get('early_exit'):  # LayerNorm + Linear on the mean RTM / STM CLS token
+        stages.append(dict(stage='exits', params=2 * (2 * S + S * num_cls + num_cls), flops=0, infer_peak=0, train_saved=0))
+    stages.append(dict(stage='fc_layer (unused)', params=NCF * 150 * num_cls + num_cls, flops=0, infer_peak=0, train_saved=0))
+
+    for stage in stages:
+        stage['infer_peak_bytes'] = stage.pop('infer_peak') * dtype_bytes
+        stage['train_saved_bytes'] = stage.pop('train_saved') * dtype_bytes
+        stage['recompute_bytes'] = stage.pop('recompute', 0) * dtype_bytes
+
+    params = sum(stage['params'] for stage in stages)
+    infer_flops = sum(stage['flops'] for stage in stages)
+    activations = sum(stage['train_saved_bytes'] for stage in stages) + max(stage['recompute_bytes'] for stage in stages)
+    recompute_flops = sum(stage.pop('recompute_flops', 0) for stage in stages)
+    return dict(stages=stages, params=params, param_bytes=params * dtype_bytes, infer_flops=infer_flops, train_flops=3 * infer_flops + recompute_flops,
+                infer_peak_bytes=params * dtype_bytes + max(stage['infer_peak_bytes'] for stage in stages),
+                train_peak_bytes=params * dtype_bytes * (2 + optimizer_states) + activations)
+
+
+def fits_budget(cost, max_infer_gflops=None, max_train_gflops=None, max_infer_mb=None, max_train_mb=None):
+    """Whether an estimate_cost result stays within every given budget (None = no limit)."""
+    limits = ((cost['infer_flops'] / 1e9, max_infer_gflops), (cost['train_flops'] / 1e9, max_train_gflops),
+              (cost['infer_peak_bytes'] / 2 ** 20, max_infer_mb), (cost['train_peak_bytes'] / 2 ** 20, max_train_mb))
+    return all(limit is None or value <= limit for value, limit in limits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EEGformer cost estimate")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=531)
+    parser.add_argument("--input-channels", type=int, default=1)
+    parser.add_argument("--num-cls", type=int, default=2)
+    parser.add_argument("--kernel-size", type=int, default=10)
+    parser.add_argument("--num-blocks", type=int, default=3)
+    parser.add_argument("--num-heads", type=int, nargs=3, default=(6, 6, 11), metavar=("RTM", "STM", "TTM"))
+    parser.add_argument("--num-submatrices", type=int, default=12)
+    parser.add_argument("--cf-second", type=int, default=2)
+    parser.add_argument("--checkpoint-every", type=int, default=0)
+    parser.add_argument("--ttm-rank", type=int, default=None)
+    parser.add_argument("--share-blocks", choices=("all", "attention", "mlp"), default=None)
+    parser.add_argument("--token-stride", type=int, default=1)
+    args = parser.parse_args()
+
+    config = dict(num_cls=args.num_cls, input_channels=args.input_channels, kernel_size=args.kernel_size, num_blocks=args.num_blocks,
+                  num_heads_RTM=args.num_heads[0], num_heads_STM=args.num_heads[1], num_heads_TTM=args.num_heads[2],
+                  num_submatrices=args.num_submatrices, CF_second=args.cf_second, checkpoint_every=args.checkpoint_every, ttm_rank=args.ttm_rank, share_blocks=args.share_blocks,
+                  token_stride=args.token_stride)
+    cost = estimate_cost(config, args.batch_size, args.samples)
+    print(f"{'stage':>18} | {'params':>12} | {'GFLOPs':>10} | {'infer MB':>10} | {'train act MB':>12}")
+    for stage in cost['stages']:
+        print(f"{stage['stage']:>18} | {stage['params']:>12} | {stage['flops'] / 1e9:>10.3f} | "
+              f"{stage['infer_peak_bytes'] / 2 ** 20:>10.1f} | {stage['train_saved_bytes'] / 2 ** 20:>12.1f}")
+    print(f"params {cost['params']} ({cost['param_bytes'] / 2 ** 20:.1f} MB), inference {cost['infer_flops'] / 1e9:.2f} GFLOPs / "
+          f"{cost['infer_peak_bytes'] / 2 ** 20:.1f} MB peak, training step {cost['train_flops'] / 1e9:.2f} GFLOPs / "
+          f"{cost['train_peak_bytes'] / 2 ** 20:.1f} MB peak")
@@ -0,0 +1,150 @@
+import argparse
+import copy
+import os
+import torch
+
+from models import device
+
+
+def example_input(model):  # zero [B, C, T] batch with the shapes the model was built for
+    B, C = model.outshape1.shape[:2]
+    return torch.zeros(B, C, model.samples, dtype=model.dtype, device=device)
+
+
+def export_torchscript(model, path, example=None):
+    """
+    Trace the model in its traceable mode and save it as TorchScript.
+
+    Args:
+        model: EEGformer (left unchanged, a traced copy is exported)
+        path: output .pt file, restored with torch.jit.load(path) without the Python model code
+        example: input batch used for tracing, zeros of the built shape if omitted
+
+    Returns:
+        the frozen traced module
+    """
+    model = copy.deepcopy(model).eval().set_traceable(True)
+    example = example_input(model) if example is None else example
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(traced, path)
+    return traced
+
+
+def load_torchscript(path):
+    return torch.jit.load(path, map_location=device)
+
+
+def export_onnx(model, path, example=None, dynamic_batch=True, opset_version=17):
+    """
+    Export the model in its traceable mode to ONNX.
+
+    Args:
+        model: EEGformer (left unchanged, a copy is exported)
+        path: output .onnx file, input "eeg" [N, C, T] and output "probs" [N, num_cls]
+        example: input batch used for tracing, zeros of the built shape if omitted
+        dynamic_batch: export N as a dynamic axis. RTM/STM/TTM weights are per batch position,
+            sample i of any batch uses the parameters of position i % B (exact for N == B).
+            T stays fixed: RTM/STM embed along the time axis, so the parameter shapes depend on it.
+
+    Returns:
+        path
+    """
+    model = copy.deepcopy(model).eval().set_traceable(True, dynamic_batch=dynamic_batch)
+    example = example_input(model) if example is None else example
+    dynamic_axes = {'eeg': {0: 'batch'}, 'probs': {0: 'batch'}} if dynamic_batch else None
+    with torch.no_grad():
+        torch.onnx.export(model, (example,), path, input_names=['eeg'], output_names=['probs'],
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, dynamo=False)
+    return path
+
+
+def check_onnx_parity(model, path, batch_sizes=None, atol=1e-4):
+    """
+    Compare onnxruntime outputs of an exported model against the PyTorch model.
+
+    The reference for a batch of N samples is the PyTorch model in dynamic-batch mode, which equals
+    the original model for N == B. Returns {N: max abs difference}; raises AssertionError above atol.
+    """
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+    reference = copy.deepcopy(model).eval().set_traceable(False, dynamic_batch=True)
+    B, C, T = example_input(model).shape
+    diffs = {}
+    for n in batch_sizes or sorted({1, B, 2 * B + 1}):
+        x = torch.randn(n, C, T, dtype=model.dtype)
+        with torch.no_grad():
+            expected = reference(x.to(device)).float().cpu()
+        got = torch.from_numpy(session.run(None, {'eeg': x.numpy()})[0])
+        diffs[n] = (got - expected).abs().max().item()
+        assert diffs[n] <= atol, f"ONNX output differs from PyTorch by {diffs[n]:.2e} at batch size {n}"
+    return diffs
+
+
+def export_numpy(model, path):
+    """
+    Save the model for numpy_runtime.NumpyEEGformer: an .npz with one float32 array per state dict entry
+    and the constructor config (config.<name>), loadable on hosts without torch.
+    """
+    import numpy as np
+    from numpy_runtime import CONFIG_PREFIX
+
+    arrays = {k: v.detach().float().cpu().numpy() for k, v in model.state_dict().items()}
+    # a pruned config is carried by the weight shapes and head_features arrays themselves
+    config = {CONFIG_PREFIX + k: np.asarray(v) for k, v in model.get_config().items() if k not in ('dtype', 'pruned') and v is not None}
+    np.savez(path, **arrays, **config)
+    return path
+
+
+def compile_model(model, cache_dir=None, example=None, **compile_kwargs):
+    """
+    torch.compile the model in its traceable mode.
+
+    With cache_dir, the inductor cache lives in that directory and the compiled artifacts of this
+    process are saved there as well (reloaded on the next start). A restarted serving process
+    pointing at the same directory then reuses the compiled kernels instead of recompiling.
+    The model is compiled eagerly with one forward of example.
+    """
+    model = copy.deepcopy(model).eval().set_traceable(True)
+    artifacts_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+        artifacts_path = os.path.join(cache_dir, "compiled_artifacts.bin")
+        if os.path.exists(artifacts_path):
+            with open(artifacts_path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+
+    compiled = torch.compile(model, **compile_kwargs)
+    with torch.no_grad():
+        compiled(example_input(model) if example is None else example)
+
+    if artifacts_path is not None:
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is not None:
+            with open(artifacts_path, "wb") as f:
+                f.write(artifacts[0])
+    return compiled
+
+
+if __name__ == "__main__":
+    from benchmark import DEFAULT_BATCH, build_model
+
+    parser = argparse.ArgumentParser(description="Export EEGformer for serving")
+    parser.add_argument("--checkpoint", default=None, help="fp32 state dict (.pth)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--format", choices=("torchscript", "onnx", "numpy", "compile"), default="torchscript")
+    parser.add_argument("--out", required=True, help="TorchScript .pt / ONNX .onnx / NumPy .npz file, or compiled-artifact cache directory")
+    args = parser.parse_args()
+
+    model = build_model(args.batch_size, checkpoint=args.checkpoint)
+    if args.format == "torchscript":
+        export_torchscript(model, args.out)
+    elif args.format == "onnx":
+        export_onnx(model, args.out)
+        print(f"onnxruntime max abs diff per batch size: {check_onnx_parity(model, args.out)}")
+    elif args.format == "numpy":
+        export_numpy(model, args.out)
+    else:
+        compile_model(model, cache_dir=args.out)
@@ -0,0 +1,133 @@
+import json
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+
+from models import device
+from checkpoint import state_dict_hash
+
+# Fine-tuning of the last EEGformer stages on cached outputs of the frozen first stages.
+# 'stm': odcm, rtm and stm are frozen, their output [121, C+1, S] per sample is cached, ttm and cnndecoder are trained.
+# 'ttm': odcm to ttm are frozen, their output [M+1, (C+1)*121] per sample is cached, cnndecoder is trained.
+
+PREFIXES = {'stm': ('odcm', 'rtm', 'stm'), 'ttm': ('odcm', 'rtm', 'stm', 'ttm')}
+TRAINED = {'stm': ('ttm', 'cnndecoder'), 'ttm': ('cnndecoder',)}
+FP16_RANGE = 2.0 ** 15  # largest magnitude stored unscaled in float16 (max 65504)
+
+
+class FeatureCache(Dataset):
+    """
+    Memory-mapped stage outputs written by build_feature_cache; item i is (features of dataset sample i as float32,
+    label, i). The index is the row the sample was computed at: the stages after the cache use its batch position.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        self.scales = np.load(os.path.join(path, 'scales.npy'))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        features = torch.from_numpy(self.features[idx].astype(np.float32) * self.scales[idx])
+        return features, torch.tensor(self.labels[idx], dtype=torch.long), torch.tensor(idx, dtype=torch.long)
+
+
+def prefix_forward(model, x, stage='stm', rows=None):  # output of the frozen stages up to and including stage
+    x = model.stm(model.rtm(model.odcm(x), rows), rows)
+    return model.ttm(x, rows) if stage == 'ttm' else x
+
+
+def cache_path(model, cache_dir, stage='stm', fp16=True, key=None):
+    """Cache directory of this model's frozen prefix: named by the stage, dtype, hash of the prefix weights and an optional dataset key."""
+    digest = state_dict_hash(model.state_dict(), [name + '.' for name in PREFIXES[stage]])
+    name = f"{stage}-{'fp16' if fp16 else 'fp32'}-{digest[:16]}" + (f"-{key}" if key else '')
+    return os.path.join(cache_dir, name)
+
+
+def build_feature_cache(model, dataset, cache_dir, stage='stm', batch_size=8, fp16=True, key=None, num_workers=0):
+    """
+    Run the frozen prefix once over a dataset and store its outputs, or reuse the cache of an earlier run.
+
+    Row i of the cache is dataset sample i, computed at batch position i % B of the model (the per-position
+    RTM/STM/TTM weights it would see in a sequential loader).
+
+    Args:
+        model: trained EEGformer
+        dataset: map-style dataset of (inputs [C, T], label), e.g. the notebooks' EEGDataset
+        cache_dir: directory holding the caches (one subdirectory per prefix hash, see cache_path)
+        stage: 'stm' (train ttm and cnndecoder) or 'ttm' (train cnndecoder)
+        fp16: store float16 features (half the disk and page cache); training reads them back as float32. Samples whose
+            values exceed FP16_RANGE are stored divided by a power-of-two scale (attention without softmax can grow large)
+        key: dataset name mixed into the cache name when one checkpoint is cached for several datasets
+
+    Returns:
+        FeatureCache
+    """
+    path = cache_path(model, cache_dir, stage, fp16, key)
+    if os.path.exists(os.path.join(path, 'meta.json')):  # meta.json is written last, so its presence marks a complete cache
+        cache = FeatureCache(path)
+        if len(cache) != len(dataset):
+            raise ValueError(f"cache {path} holds {len(cache)} samples, the dataset has {len(dataset)}; pass a different key")
+        return cache
+    os.makedirs(path, exist_ok=True)
+
+    model = model.eval()
+    features, offset = None, 0
+    labels, scales = np.empty(len(dataset), dtype=np.int64), np.ones(len(dataset), dtype=np.float32)
+    with torch.no_grad():
+        for inputs, label in DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers):
+            rows = torch.arange(offset, offset + inputs.shape[0], device=device)
+            out = prefix_forward(model, inputs.to(device), stage, rows).float().cpu().numpy()
+            if features is None:
+                features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+',
+                                                     dtype=np.float16 if fp16 else np.float32, shape=(len(dataset),) + out.shape[1:])
+            if fp16:
+                peak = np.abs(out).reshape(out.shape[0], -1).max(1)
+                scale = np.exp2(np.ceil(np.log2(np.maximum(peak, 1) / FP16_RANGE))).clip(min=1).astype(np.float32)
+                out /= scale.reshape((-1,) + (1,) * (out.ndim - 1))
+                scales[offset:offset + inputs.shape[0]] = scale
+            features[offset:offset + inputs.shape[0]] = out
+            labels[offset:offset + inputs.shape[0]] = label.numpy()
+            offset += inputs.shape[0]
+    features.flush()
+    del features
+    np.save(os.path.join(path, 'labels.npy'), labels)
+    np.save(os.path.join(path, 'scales.npy'), scales)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(dict(stage=stage, fp16=fp16, num_samples=len(dataset), config={k: v for k, v in model.get_config().items() if k != 'dtype'}), f)
+    return FeatureCache(path)
+
+
+def finetune_from_cache(model, cache, num_epochs=1, lr=1e-5, batch_size=8, num_workers=0):
+    """
+    Fine-tune the stages after the cached prefix (ttm and cnndecoder, or cnndecoder alone) with the notebooks'
+    loss/optimizer; returns the mean loss per epoch. The frozen prefix is never run.
+
+    The batches are shuffled, so TTM runs every sample at the batch position its features were cached at (rows),
+    not at its position in the shuffled batch.
+    """
+    stage = cache.meta['stage']
+    trained = [getattr(model, name) for name in TRAINED[stage]]
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam([p for module in trained for p in module.parameters()], lr=lr)
+    for module in trained:
+        module.train()
+    losses = []
+    for epoch_idx in range(num_epochs):
+        total_loss, num_batches = 0.0, 0
+        for features, labels, rows in DataLoader(cache, batch_size=batch_size, shuffle=True, drop_last=True, num_workers=num_workers):
+            features, labels = features.to(device, dtype=model.dtype), labels.to(device)
+            loss = criterion(model.decode(features if stage == 'ttm' else model.ttm(features, rows.to(device))), labels)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            num_batches += 1
+        losses.append(total_loss / max(num_batches, 1))
+    return losses
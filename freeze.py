@@ -0,0 +1,100 @@
+import copy
+import torch
+import torch.nn as nn
+
+from models import LayerNorm, LowRankLinear, RTM, STM, TTM, GenericTFB, TemporalTFB
+from quantization import LinearGenericTFB, LinearTemporalTFB
+
+
+def _plain_norm(norm):  # the LayerNorm without its affine terms, which were moved into the next projection
+    return LayerNorm(norm.normalized_shape, eps=norm.eps, elementwise_affine=False)
+
+
+def fold_layernorm(norm, linear):
+    """
+    nn.Linear computing linear(norm(x)) from the normalized x, i.e. W diag(gamma) x + (W beta + b).
+
+    Args:
+        norm: LayerNorm with affine weight gamma and bias beta
+        linear: nn.Linear (with or without bias) or LowRankLinear applied right after norm
+    """
+    if isinstance(linear, LowRankLinear):  # gamma goes into the down factor, the bias through both factors into up.bias
+        folded = copy.deepcopy(linear)
+        with torch.no_grad():
+            folded.down.weight.mul_(norm.weight)
+            shift = linear.up.weight @ (linear.down.weight @ norm.bias)
+            if folded.up.bias is None:
+                folded.up.bias = nn.Parameter(shift)
+            else:
+                folded.up.bias.add_(shift)
+        return folded
+    weight = linear.weight.detach()
+    folded = nn.Linear(linear.in_features, linear.out_features, bias=True, dtype=weight.dtype, device=weight.device)
+    with torch.no_grad():
+        folded.weight.copy_(weight * norm.weight)
+        folded.bias.copy_(weight @ norm.bias + (linear.bias if linear.bias is not None else 0))
+    return folded
+
+
+class FrozenGenericTFB(LinearGenericTFB):  # GenericTFB with lnorm folded into qkv, lnormz into mlp.fc1 and the Wo scale into V
+    def __init__(self, tfb):
+        super(FrozenGenericTFB, self).__init__(tfb)
+        self.qkv = fold_layernorm(self.lnorm, self.qkv)
+        with torch.no_grad():  # attention is linear in V, so scaling V's features equals scaling the attention output
+            v_rows = slice(2 * self.hA * self.Dh, 3 * self.hA * self.Dh)
+            self.qkv.weight[v_rows] *= self.wo_scale[:, None]
+            self.qkv.bias[v_rows] *= self.wo_scale
+        del self.wo_scale
+        self.mlp = copy.deepcopy(self.mlp)  # the Mlp may be shared with other blocks (share_blocks='mlp')
+        self.mlp.fc1 = fold_layernorm(self.lnormz, self.mlp.fc1)
+        self.lnorm = _plain_norm(self.lnorm)
+        self.lnormz = _plain_norm(self.lnormz)
+
+    def project_out(self, imv):
+        return imv
+
+
+class FrozenTemporalTFB(LinearTemporalTFB):  # TemporalTFB with lnorm folded into qkv and lnormz into mlp.fc1 (Wo mixes heads, it stays)
+    def __init__(self, tfb):
+        super(FrozenTemporalTFB, self).__init__(tfb)
+        self.qkv = fold_layernorm(self.lnorm, self.qkv)
+        self.mlp = copy.deepcopy(self.mlp)  # the Mlp may be shared with other blocks (share_blocks='mlp')
+        self.mlp.fc1 = fold_layernorm(self.lnormz, self.mlp.fc1)
+        self.lnorm = _plain_norm(self.lnorm)
+        self.lnormz = _plain_norm(self.lnormz)
+
+
+def freeze_for_inference(model):
+    """
+    Inference copy of an EEGformer with its constant parts precomputed.
+
+    - RTM/STM/TTM: cat((cls, x)) + bias becomes one constant token_bias added in place to the zero-padded
+      embedding (cls and bias stay in the state dict but are no longer read).
+    - every transformer block: the LayerNorm affine terms are folded into the Wqkv projection and mlp.fc1,
+      and in GenericTFB the Wo per-feature scale is folded into the V projection.
+    - TTM averaging and CNNdecoder run in their loop-free traceable form.
+
+    The source model is not modified. The result is for inference only (no_grad, eval mode).
+    """
+    frozen = copy.deepcopy(model).eval()
+    frozen.set_traceable(True, dynamic_batch=frozen.rtm.dynamic_batch)
+    blocks, shared = {}, {}  # a block shared across positions (share_blocks='all') is frozen once
+    for module in frozen.modules():
+        if isinstance(module, (RTM, STM, TTM)) and module.token_bias is None:
+            with torch.no_grad():
+                dim = 1 if isinstance(module, TTM) else 2
+                token_bias = torch.cat((module.cls, torch.zeros_like(module.bias.narrow(dim, 1, module.bias.shape[dim] - 1))), dim=dim) + module.bias
+            del module.token_bias
+            module.register_buffer('token_bias', token_bias)
+        elif isinstance(module, nn.ModuleList):
+            for i, tfb in enumerate(module):
+                if id(tfb) not in blocks and type(tfb) in (GenericTFB, TemporalTFB):
+                    frozen_tfb = FrozenGenericTFB(tfb) if type(tfb) is GenericTFB else FrozenTemporalTFB(tfb)
+                    # parts shared across blocks (share_blocks='attention'/'mlp') fold identically, keep one copy
+                    frozen_tfb.qkv = shared.setdefault(('qkv', id(tfb.Wqkv)), frozen_tfb.qkv)
+                    frozen_tfb.mlp = shared.setdefault(('mlp', id(tfb.mlp)), frozen_tfb.mlp)
+                    if type(tfb) is TemporalTFB:
+                        frozen_tfb.wo = shared.setdefault(('wo', id(tfb.Wo if tfb.rank is None else tfb.Wo_u)), frozen_tfb.wo)
+                    blocks[id(tfb)] = frozen_tfb
+                module[i] = blocks.get(id(tfb), tfb)
+    return frozen.requires_grad_(False)
@@ -0,0 +1,143 @@
+import math
+import torch
+import torch.nn as nn
+from torch.nn.utils import parametrize
+
+from models import GenericTFB, TemporalTFB
+
+# Low-rank adapters (LoRA) on the transformer blocks of RTM/STM/TTM: each adapted weight W becomes
+# W + alpha / r * (B @ A) with A [r, in], B [out, r] (B starts at zero, so a fresh adapter changes nothing).
+# The adapters are torch parametrizations: the base weights stay in place and only A/B are per patient.
+
+TARGETS = ('Wqkv', 'Wo', 'mlp')
+
+
+class LoRA(nn.Module):  # parametrization W -> W + scale * (B @ A), on W viewed as [prod(shape[:-1]), shape[-1]]
+    def __init__(self, weight, rank, alpha):
+        super(LoRA, self).__init__()
+        rows, cols = weight.numel() // weight.shape[-1], weight.shape[-1]
+        self.A = nn.Parameter(torch.randn(rank, cols, dtype=weight.dtype, device=weight.device) / math.sqrt(cols))
+        self.B = nn.Parameter(torch.zeros(rows, rank, dtype=weight.dtype, device=weight.device))
+        self.scale = alpha / rank
+        self.merged = False  # True: the delta has been added to the base weight, which is then returned unchanged
+
+    def delta(self, shape):
+        return (self.B @ self.A).reshape(shape) * self.scale
+
+    def forward(self, weight):
+        return weight if self.merged else weight + self.delta(weight.shape)
+
+
+def _lora_targets(tfb, targets):  # (module, parameter name) pairs of a GenericTFB/TemporalTFB to adapt
+    if 'Wqkv' in targets:
+        yield tfb, 'Wqkv'
+    if 'Wo' in targets:
+        for name in ('Wo', 'Wo_u', 'Wo_v'):  # Wo, or both factors of a low-rank TemporalTFB Wo
+            if isinstance(getattr(tfb, name, None), torch.Tensor):
+                yield tfb, name
+    if 'mlp' in targets:
+        for module in tfb.mlp.modules():
+            if isinstance(module, nn.Linear):
+                yield module, 'weight'
+
+
+def add_lora(model, rank=4, alpha=None, targets=TARGETS, stages=('rtm', 'stm', 'ttm'), freeze_base=True):
+    """
+    Add low-rank adapters to the transformer blocks of an EEGformer, in place.
+
+    Args:
+        model: EEGformer (blocks must not be partially shared: share_blocks None or 'all')
+        rank: adapter rank r
+        alpha: scale numerator (delta = alpha / r * B @ A); defaults to rank, i.e. scale 1
+        targets: any of 'Wqkv', 'Wo' and 'mlp' (fc1/fc2)
+        stages: modules whose blocks get adapters
+        freeze_base: only the adapter A/B parameters keep requires_grad
+
+    Returns:
+        the model, whose forward now includes the (initially zero) adapter deltas
+    """
+    if model.share_blocks not in (None, 'all'):
+        raise ValueError(f"adapters need each adapted weight in one block, the model shares them (share_blocks={model.share_blocks!r})")
+    if freeze_base:
+        model.requires_grad_(False)
+    done = set()  # a block shared by all positions (share_blocks='all') is adapted once
+    for stage in stages:
+        for tfb in getattr(model, stage).tfb:
+            if id(tfb) in done or not isinstance(tfb, (GenericTFB, TemporalTFB)):
+                continue
+            done.add(id(tfb))
+            for module, name in list(_lora_targets(tfb, targets)):
+                parametrize.register_parametrization(module, name, LoRA(getattr(module, name), rank, rank if alpha is None else alpha))
+    return model
+
+
+def adapter_state_dict(model):
+    """The adapter A/B tensors only: the per-patient checkpoint."""
+    return {k: v for k, v in model.state_dict().items() if '.parametrizations.' in k and not k.endswith('.original')}
+
+
+def save_adapter(model, path):
+    torch.save(adapter_state_dict(model), path)
+    return path
+
+
+def merge_lora(model):
+    """Add every adapter delta into its base weight in place (inference without adapter overhead)."""
+    with torch.no_grad():
+        for module in model.modules():
+            for name, plist in getattr(module, 'parametrizations', {}).items():
+                for p in plist:
+                    if isinstance(p, LoRA) and not p.merged:
+                        plist.original.add_(p.delta(plist.original.shape))
+                        p.merged = True
+    return model
+
+
+def unmerge_lora(model):
+    """Subtract merged adapter deltas from the base weights again (up to float rounding)."""
+    with torch.no_grad():
+        for module in model.modules():
+            for name, plist in getattr(module, 'parametrizations', {}).items():
+                for p in plist:
+                    if isinstance(p, LoRA) and p.merged:
+                        plist.original.sub_(p.delta(plist.original.shape))
+                        p.merged = False
+    return model
+
+
+def load_adapter(model, adapter, merge=False):
+    """
+    Switch the model to another patient's adapter without touching the rest of the base weights.
+
+    Args:
+        model: EEGformer prepared with add_lora (same rank and targets as the saved adapter)
+        adapter: path written by save_adapter, or an adapter_state_dict
+        merge: merge the new adapter into the base weights (serving); otherwise it is applied on the fly (training)
+    """
+    if not isinstance(adapter, dict):
+        adapter = torch.load(adapter, map_location=next(model.parameters()).device)
+    unmerge_lora(model)
+    missing, unexpected = model.load_state_dict(adapter, strict=False)
+    missing = [k for k in missing if '.parametrizations.' in k and not k.endswith('.original')]
+    if missing or unexpected:
+        raise ValueError(f"adapter does not match the model's adapters: missing {missing}, unexpected {unexpected}")
+    return merge_lora(model) if merge else model
+
+
+def remove_lora(model, merge=True):
+    """
+    Plain EEGformer without adapters holding the adapted weights (merge=True) or the base weights (merge=False),
+    e.g. to export or quantize one patient's model. The adapted model is not modified.
+    """
+    state = {k: v for k, v in model.state_dict().items() if '.parametrizations.' not in k}
+    with torch.no_grad():
+        for prefix, module in model.named_modules(remove_duplicate=False):  # every alias of a shared block (share_blocks='all') has its own keys
+            for name, plist in getattr(module, 'parametrizations', {}).items():
+                weight = plist.original.detach().clone()
+                for p in plist:
+                    if isinstance(p, LoRA) and p.merged != merge:  # add a missing delta, or subtract a merged one
+                        weight += p.delta(weight.shape) * (1 if merge else -1)
+                state[f"{prefix}.{name}" if prefix else name] = weight
+    plain = model.rebuild().train(model.training)
+    plain.load_state_dict(state)
+    return plain
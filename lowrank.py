@@ -0,0 +1,58 @@
+import torch
+
+from models import LowRankLinear
+
+
+def svd_factors(weight, rank):
+    """
+    Truncated SVD of weight [..., out, in] split as up [..., out, rank] @ down [..., rank, in] with balanced
+    singular values; the best rank-r approximation in Frobenius norm.
+    """
+    U, S, Vh = torch.linalg.svd(weight.detach().float(), full_matrices=False)
+    root = S[..., :rank].sqrt()
+    up = U[..., :, :rank] * root.unsqueeze(-2)
+    down = root.unsqueeze(-1) * Vh[..., :rank, :]
+    return up.to(weight.dtype), down.to(weight.dtype)
+
+
+def _copy_linear(target, linear):  # full nn.Linear -> nn.Linear or truncated LowRankLinear
+    with torch.no_grad():
+        if isinstance(target, LowRankLinear):
+            up, down = svd_factors(linear.weight, target.down.out_features)
+            target.up.weight.copy_(up)
+            target.down.weight.copy_(down)
+            target.up.bias.copy_(linear.bias)
+        else:
+            target.load_state_dict(linear.state_dict())
+
+
+def factorize_ttm(model, rank):
+    """
+    Low-rank copy of a trained full-rank EEGformer (ttm_rank=rank in its config).
+
+    TTM.weight, every TemporalTFB.Wo and the TTM Mlp fc1/fc2 are initialized with their truncated SVD,
+    all other weights are copied. The result can be fine-tuned and saved like any EEGformer; the source
+    model is not modified.
+    """
+    if model.ttm_rank is not None:
+        raise ValueError(f"model is already factorized (ttm_rank={model.ttm_rank})")
+    low = model.rebuild(ttm_rank=rank).eval()
+    full_ttm, low_ttm = model.ttm, low.ttm
+
+    # everything outside the factorized projections keeps its trained value
+    factorized = {'weight'} | {f'tfb.{i}.{name}' for i in range(len(full_ttm.tfb)) for name in ('Wo', 'mlp.fc1.weight', 'mlp.fc1.bias', 'mlp.fc2.weight', 'mlp.fc2.bias')}
+    state = {k: v for k, v in model.state_dict().items() if not k.startswith('ttm.') or k[len('ttm.'):] not in factorized}
+    missing, unexpected = low.load_state_dict(state, strict=False)
+    assert not unexpected, unexpected
+
+    with torch.no_grad():
+        up, down = svd_factors(full_ttm.weight, rank)
+        low_ttm.weight_u.copy_(up)
+        low_ttm.weight_v.copy_(down)
+        for full_tfb, low_tfb in zip(full_ttm.tfb, low_ttm.tfb):
+            up, down = svd_factors(full_tfb.Wo, rank)
+            low_tfb.Wo_u.copy_(up)
+            low_tfb.Wo_v.copy_(down)
+            _copy_linear(low_tfb.mlp.fc1, full_tfb.mlp.fc1)
+            _copy_linear(low_tfb.mlp.fc2, full_tfb.mlp.fc2)
+    return low
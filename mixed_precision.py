@@ -0,0 +1,42 @@
+import torch
+import torch.nn as nn
+
+from models import device
+
+# Mixed precision policy: parameters stay fp32, linear/einsum/conv compute runs in bf16 under autocast,
+# LayerNorm (models.LayerNorm), the output softmax and the loss run in fp32.
+
+
+def bf16_autocast(enabled=True):
+    return torch.autocast(device.type, dtype=torch.bfloat16, enabled=enabled)
+
+
+def cpu_bf16_info():  # what the host offers for bf16 - without AVX512-BF16/AMX the bf16 kernels are emulated
+    flags = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+    return dict(capability=torch.backends.cpu.get_cpu_capability(), avx512_bf16="avx512_bf16" in flags,
+                amx_bf16="amx_bf16" in flags, mkldnn_bf16=torch.ops.mkldnn._is_mkldnn_bf16_supported())
+
+
+def train_step(model, inputs, labels, optimizer, criterion=None, enabled=True):
+    """One optimizer step with the forward in bf16 autocast; backward and the update stay fp32."""
+    criterion = criterion or nn.CrossEntropyLoss()
+    with bf16_autocast(enabled):
+        outputs = model(inputs)
+    loss = criterion(outputs.float(), labels)
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
+
+def predict_bf16(model, inputs, enabled=True):
+    with torch.no_grad(), bf16_autocast(enabled):
+        return model(inputs).float()
@@ -1,8 +1,13 @@
+import copy
 import os
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+import torch.utils.checkpoint
 import math
 
+from validate import validate_config
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
@@ -13,6 +18,10 @@ def trunc_normal(tensor, mean=0., std=1., a=-2., b=2.):  # for positional embedd
     if (mean < a - 2 * std) or (mean > b + 2 * std):
         print("mean is more than 2 std from [a, b] in nn.init.trunc_normal\nThe distribution of values may be incorrect.")
 
+    if tensor.dtype not in (torch.float32, torch.float64):  # erfinv_ is too coarse in half precision - draw in fp32 and cast
+        with torch.no_grad():
+            return tensor.copy_(trunc_normal(torch.empty(tensor.shape, dtype=torch.float32, device=tensor.device), mean, std, a, b))
+
     with torch.no_grad():  # Values are generated by using a truncated uniform distribution and then using the inverse CDF for the normal distribution.
         # Get upper and lower cdf values
         l = norm_cdf((a - mean) / std)
@@ -33,14 +42,35 @@ def trunc_normal(tensor, mean=0., std=1., a=-2., b=2.):  # for positional embedd
         return tensor
 
 
+class LayerNorm(nn.LayerNorm):  # LayerNorm that stays in the parameter dtype (fp32) under bf16 autocast
+    def forward(self, x):
+        dtype = self.weight.dtype if self.weight is not None else torch.promote_types(x.dtype, torch.float32)  # no affine once folded
+        with torch.autocast(x.device.type, enabled=False):
+            return super().forward(x.to(dtype))
+
+
+class LowRankLinear(nn.Module):  # nn.Linear with its [out, in] weight factorized as up.weight [out, rank] @ down.weight [rank, in]
+    def __init__(self, in_features, out_features, rank, bias=True, dtype=torch.float32):
+        super(LowRankLinear, self).__init__()
+        self.down = nn.Linear(in_features, rank, bias=False, dtype=dtype)
+        self.up = nn.Linear(rank, out_features, bias=bias, dtype=dtype)
+
+    def forward(self, x):
+        return self.up(self.down(x))
+
+
 class Mlp(nn.Module): # Multilayer perceptron
-    def __init__(self, in_features, hidden_features=None, out_features=None, act_layer=nn.GELU, drop=0., dtype=torch.float32):
+    def __init__(self, in_features, hidden_features=None, out_features=None, act_layer=nn.GELU, drop=0., dtype=torch.float32, rank=None):
         super().__init__()
         out_features = out_features or in_features
         hidden_features = hidden_features or in_features
-        self.fc1 = nn.Linear(in_features, hidden_features, dtype=dtype)
+        if rank is None:
+            self.fc1 = nn.Linear(in_features, hidden_features, dtype=dtype)
+            self.fc2 = nn.Linear(hidden_features, out_features, dtype=dtype)
+        else:  # rank-r bottleneck in both projections
+            self.fc1 = LowRankLinear(in_features, hidden_features, rank, dtype=dtype)
+            self.fc2 = LowRankLinear(hidden_features, out_features, rank, dtype=dtype)
         self.act = act_layer()
-        self.fc2 = nn.Linear(hidden_features, out_features, dtype=dtype)
         self.drop = nn.Dropout(drop)
 
     def forward(self, x):
@@ -52,44 +82,48 @@ class Mlp(nn.Module): # Multilayer perceptron
         return x
 
 
+def head_feature_index(heads, Dh, device=None):  # feature positions of the kept heads in the hA * Dh attention output
+    return (torch.tensor(heads, device=device)[:, None] * Dh + torch.arange(Dh, device=device)).reshape(-1)
+
+
 class GenericTFB(nn.Module):
-    def __init__(self, emb_size, num_heads, dtype):
+    def __init__(self, emb_size, num_heads, dtype, heads=None, hidden=None):
         super(GenericTFB, self).__init__()
 
         self.M_size1 = emb_size  # -> D
         self.dtype = dtype
-        self.hA = num_heads  # number of multi-head self-attention units (A is the number of units in a block)
-        self.Dh = int(self.M_size1 / self.hA)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
+        self.heads = heads  # kept head indices after structured pruning (None = all num_heads heads)
+        self.hA = num_heads if heads is None else len(heads)  # number of multi-head self-attention units (A is the number of units in a block)
+        self.Dh = int(self.M_size1 / num_heads)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
 
         self.Wqkv = nn.Parameter(torch.randn((3, self.hA, self.Dh, self.M_size1), dtype=self.dtype))
-        self.Wo = nn.Parameter(torch.randn(self.M_size1, self.M_size1, dtype=self.dtype))
+        self.Wo = nn.Parameter(torch.randn(self.hA * self.Dh, self.M_size1, dtype=self.dtype))  # only rows of kept heads when pruned
+        # pruned heads output zeros: the kept features are scattered back to D before the residual add
+        self.register_buffer('head_features', None if heads is None else head_feature_index(heads, self.Dh))
 
-        self.lnorm = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for dimension D
-        self.lnormz = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for z
-        self.mlp = Mlp(in_features=self.M_size1, hidden_features=int(self.M_size1 * 4), act_layer=nn.GELU, dtype=self.dtype)  # mlp_ratio=4
+        self.lnorm = LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for dimension D
+        self.lnormz = LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for z
+        self.mlp = Mlp(in_features=self.M_size1, hidden_features=hidden or int(self.M_size1 * 4), act_layer=nn.GELU, dtype=self.dtype)  # mlp_ratio=4
 
-    def forward(self, x, savespace):
+    def project_qkv(self, z):  # LN(z) -> Q, K, V : [batch_size, 3, timesteps, channels+1, num_heads, Dh]
+        return torch.einsum('xhdm,bijm -> bxijhd', self.Wqkv, z)
+
+    def project_out(self, imv):  # imv -> z' : note 'nm,bijn -> bijn' sums Wo over m, so Wo acts as a per-feature scale
+        return torch.einsum('nm,bijn -> bijn', self.Wo, imv)
+
+    def expand_heads(self, out):  # [..., hA * Dh] -> [..., D] with zeros at the features of pruned heads
+        if self.head_features is None:
+            return out
+        return out.new_zeros(out.shape[:-1] + (self.M_size1,)).index_copy(-1, self.head_features, out)
+
+    def forward(self, x, savespace, mask=None):  # mask: [batch_size, channels+1] tokens that may be attended to (None = all)
         #print('Input x shape:', x.shape)  # Expected: [batch_size, channels, timesteps]
         #print('Input savespace shape:', savespace.shape)  # Expected: [batch_size, channels, timesteps, embedding_dim]
 
-        # Initialize spaces with batch size included
         batch_size = x.shape[0]
-        qkvspace = torch.zeros(
-            batch_size, 3, x.shape[3], x.shape[1] + 1, self.hA, self.Dh, dtype=self.dtype
-        ).to(device)  # Q, K, V
-        atspace = torch.zeros(
-            batch_size, x.shape[3], self.hA, x.shape[1] + 1, x.shape[1] + 1, dtype=self.dtype
-        ).to(device)
-        imv = torch.zeros(
-            batch_size, x.shape[3], x.shape[1] + 1, self.hA, self.Dh, dtype=self.dtype
-        ).to(device)
-
-        #print('qkv space:', qkvspace.shape)
-        #print('atspace:', atspace.shape)
-        #print('imv:', imv.shape)
 
         # Compute Q, K, V using einsum with batch dimension
-        qkvspace = torch.einsum('xhdm,bijm -> bxijhd', self.Wqkv, self.lnorm(savespace))
+        qkvspace = self.project_qkv(self.lnorm(savespace))
         #print('qkv space after einsum:', qkvspace.shape)  # [batch_size, 3, timesteps, channels+1, num_heads, Dh]
 
         # Compute attention scores
@@ -97,6 +131,8 @@ class GenericTFB(nn.Module):
             qkvspace[:, 0].clone().transpose(2, 3) / math.sqrt(self.Dh)
         ) @ qkvspace[:, 1].clone().transpose(2, 3).transpose(-2, -1)
         #print('atspace:', atspace.shape)  # [batch_size, timesteps, num_heads, channels+1, channels+1]
+        if mask is not None:  # no softmax: a zero score removes the masked key's contribution
+            atspace = atspace * mask[:, None, None, None, :].to(atspace.dtype)
 
         # Compute intermediate vectors
         imv = (
@@ -105,9 +141,9 @@ class GenericTFB(nn.Module):
         #print('imv:', imv.shape)  # [batch_size, timesteps, channels+1, num_heads, Dh]
 
         # Compute new z (output)
-        savespace = torch.einsum(
-            'nm,bijn -> bijn', self.Wo, imv.clone().reshape(batch_size, x.shape[3], x.shape[1] + 1, self.M_size1)
-        ) + savespace
+        savespace = self.expand_heads(self.project_out(
+            imv.clone().reshape(batch_size, x.shape[3], x.shape[1] + 1, self.hA * self.Dh)
+        )) + savespace
         
         # savespace = torch.einsum('nm,ijm -> ijn', self.Wo, imv.clone().reshape(x.shape[2], x.shape[0] + 1, self.M_size1)) + savespace
 
@@ -121,39 +157,43 @@ class GenericTFB(nn.Module):
 
 
 class TemporalTFB(nn.Module):
-    def __init__(self, emb_size, num_heads, avgf, dtype):
+    def __init__(self, emb_size, num_heads, avgf, dtype, rank=None, heads=None, hidden=None):
         super(TemporalTFB, self).__init__()
 
         self.avgf = avgf  # average factor (M)
         self.M_size1 = emb_size  # -> D
         self.dtype = dtype
-        self.hA = num_heads  # number of multi-head self-attention units (A is the number of units in a block)
-        self.Dh = int(self.M_size1 / self.hA)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
+        self.rank = rank  # None: full D x D Wo and Mlp, else rank-r factors (D = (C+1)*121 makes them the largest weights)
+        self.heads = heads  # kept head indices after structured pruning (None = all num_heads heads)
+        self.hA = num_heads if heads is None else len(heads)  # number of multi-head self-attention units (A is the number of units in a block)
+        self.Dh = int(self.M_size1 / num_heads)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
         self.Wqkv = nn.Parameter(torch.randn((3, self.hA, self.Dh, self.M_size1), dtype=self.dtype))
-        self.Wo = nn.Parameter(torch.randn(self.M_size1, self.M_size1, dtype=self.dtype))
+        if rank is None:  # Wo reads the hA * Dh attention features (fewer than D when pruned)
+            self.Wo = nn.Parameter(torch.randn(self.M_size1, self.hA * self.Dh, dtype=self.dtype))
+        else:  # Wo = Wo_u @ Wo_v, entries with the same variance as the full randn Wo
+            self.Wo_u = nn.Parameter(torch.randn(self.M_size1, rank, dtype=self.dtype))
+            self.Wo_v = nn.Parameter(torch.randn(rank, self.hA * self.Dh, dtype=self.dtype) / math.sqrt(rank))
 
-        self.lnorm = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for dimension D
-        self.lnormz = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for z
-        self.mlp = Mlp(in_features=self.M_size1, hidden_features=int(self.M_size1 * 4), act_layer=nn.GELU, dtype=self.dtype)  # mlp_ratio=4
+        self.lnorm = LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for dimension D
+        self.lnormz = LayerNorm(self.M_size1, dtype=self.dtype)  # LayerNorm operation for z
+        self.mlp = Mlp(in_features=self.M_size1, hidden_features=hidden or int(self.M_size1 * 4), act_layer=nn.GELU, dtype=self.dtype, rank=rank)  # mlp_ratio=4
 
-    def forward(self, x, savespace):
-        # Initialize spaces with batch size included
-        batch_size = x.shape[0]
+    def project_qkv(self, z):  # LN(z) -> Q, K, V : [batch_size, 3, M+1, num_heads, Dh]
+        return torch.einsum('xhdm,bim -> bxihd', self.Wqkv, z)
 
-        # Initialize spaces
-        qkvspace = torch.zeros(batch_size, 3, self.avgf + 1, self.hA, self.Dh, dtype=self.dtype).to(device)  # Q, K, V
-        atspace = torch.zeros(batch_size, self.hA, self.avgf + 1, self.avgf + 1, dtype=self.dtype).to(device)
-        imv = torch.zeros(batch_size, self.avgf + 1, self.hA, self.Dh, dtype=self.dtype).to(device)
+    def project_out(self, imv):  # imv -> z' : [batch_size, M+1, D]
+        if self.rank is not None:
+            return F.linear(F.linear(imv, self.Wo_v), self.Wo_u)
+        return torch.einsum('nm,bim -> bin', self.Wo, imv)
 
-        #print(f"qkvspace initialized with shape: {qkvspace.shape}")
-        #print(f"atspace initialized with shape: {atspace.shape}")
-        #print(f"imv initialized with shape: {imv.shape}")
+    def forward(self, x, savespace):
+        batch_size = x.shape[0]
 
         # Compute Q, K, V using einsum
         #print("Computing Q, K, V using einsum...")
         #print("wqkv", self.Wqkv.shape)
         #print("savespace", self.lnorm(savespace).shape)
-        qkvspace = torch.einsum('xhdm,bim -> bxihd', self.Wqkv, self.lnorm(savespace))  # Q, K, V
+        qkvspace = self.project_qkv(self.lnorm(savespace))  # Q, K, V
         #print(f"qkvspace after einsum computation: {qkvspace.shape}")
 
         # Compute attention scores
@@ -168,7 +208,7 @@ class TemporalTFB(nn.Module):
 
         # Update savespace with new Z
         #print("Updating savespace with new Z...")
-        savespace = torch.einsum('nm,bim -> bin', self.Wo, imv.clone().reshape(batch_size, self.avgf + 1, self.M_size1)) + savespace
+        savespace = self.project_out(imv.clone().reshape(batch_size, self.avgf + 1, self.hA * self.Dh)) + savespace
         #print(f"savespace updated with new Z: {savespace.shape}")
 
         # Normalize and pass through MLP
@@ -178,23 +218,83 @@ class TemporalTFB(nn.Module):
         return savespace
 
 
+SHARED_PARTS = {'attention': ('Wqkv', 'Wo', 'Wo_u', 'Wo_v', 'lnorm'), 'mlp': ('lnormz', 'mlp')}  # share_blocks options besides 'all'
+
+
+def tie_blocks(blocks, share=None):  # tie the weights of every block to the first one: 'all', 'attention' or 'mlp' (None = independent)
+    if share is None:
+        return blocks
+    if share == 'all':  # the same block applied num_blocks times
+        return nn.ModuleList([blocks[0]] * len(blocks))
+    for tfb in blocks[1:]:
+        for name in SHARED_PARTS[share]:
+            if hasattr(blocks[0], name):
+                setattr(tfb, name, getattr(blocks[0], name))
+    return blocks
+
+
+def block_shape(pruned, k):  # heads/hidden arguments of block k from a module's pruned config entry (list of dicts per block)
+    if pruned is None:
+        return {}
+    return dict(heads=list(pruned[k]['heads']), hidden=pruned[k]['hidden'])
+
+
+def per_sample(param, batch_size, dynamic_batch=False, rows=None):  # batch-position parameter [B, ...] -> the slices used by a batch of batch_size
+    if rows is not None:  # explicit batch positions of the samples, e.g. the ones still running after an early exit
+        return param.index_select(0, rows % param.shape[0])
+    if not dynamic_batch:
+        return param
+    return param.index_select(0, torch.arange(batch_size, device=param.device) % param.shape[0])  # sample i uses slice i % B
+
+
+def embed_tokens(savespace, token_bias):  # frozen path of cat((cls, savespace)) + bias: token_bias = cat((cls, 0)) + bias
+    savespace = F.pad(savespace, (0, 0, 1, 0))  # zero cls slot in front of the token axis
+    return savespace.add_(token_bias)
+
+
+def _run_group(blocks, x, savespace, mask=None):
+    for tfb in blocks:
+        savespace = tfb(x, savespace) if mask is None else tfb(x, savespace, mask)
+    return savespace
+
+
+def run_blocks(blocks, x, savespace, checkpoint_every=0, mask=None):  # checkpoint_every=k: keep only every k-th block input, recompute the rest in backward
+    if checkpoint_every and torch.is_grad_enabled():
+        for start in range(0, len(blocks), checkpoint_every):
+            savespace = torch.utils.checkpoint.checkpoint(_run_group, blocks[start:start + checkpoint_every], x, savespace, mask, use_reentrant=False)
+        return savespace
+    return _run_group(blocks, x, savespace, mask)
+
+
+def token_mask(channel_mask):  # [B, C] present channels -> [B, C+1] channel tokens, the cls token always present
+    return None if channel_mask is None else F.pad(channel_mask.bool(), (1, 0), value=True)
+
+
+def mask_channels(savespace, mask, dim):  # zero the tokens of padded channels along dim (mask: [B, tokens], True = present)
+    if mask is None:
+        return savespace
+    shape = [mask.shape[0]] + [1] * (savespace.dim() - 1)
+    shape[dim] = mask.shape[1]
+    return savespace * mask.reshape(shape).to(savespace.dtype)
+
+
 class ODCM(nn.Module):
-    def __init__(self, input_channels, num_scales, kernel_size, dtype=torch.float32):
+    def __init__(self, input_channels, kernel_size, dtype=torch.float32, token_stride=1):
         super(ODCM, self).__init__()
         self.inpch = input_channels
-        self.num_scales = num_scales
-        self.ksize = kernel_size
-        self.ncf = 120  # Example output channels for depthwise convolution
+        self.ksize = kernel_size  # 1X10
+        self.ncf = 120  # The number of the depth-wise convolutional filter used in the three layers is set to 120
         self.dtype = dtype
-        self.cvf1 = nn.Conv1d(in_channels=self.inpch, out_channels=self.inpch, 
-                               kernel_size=self.ksize, padding='valid', stride=1, groups=self.inpch * self.num_scales, dtype=self.dtype)
-        self.cvf2 = nn.Conv1d(in_channels=self.cvf1.out_channels, out_channels=self.cvf1.out_channels, 
-                               kernel_size=self.ksize, padding='valid', stride=1, groups=self.cvf1.out_channels, dtype=self.dtype)
-        self.cvf3 = nn.Conv1d(in_channels=self.cvf2.out_channels, out_channels=self.ncf * self.cvf2.out_channels, 
-                               kernel_size=self.ksize, padding='valid', stride=1, groups=self.cvf2.out_channels, dtype=self.dtype)
+        self.token_stride = token_stride  # adjacent time steps averaged into one RTM/STM token (1 = every step is a token)
+        self.cvf1 = nn.Conv1d(in_channels=self.inpch, out_channels=self.inpch, kernel_size=self.ksize, padding='valid', stride=1, groups=self.inpch, dtype=self.dtype)
+        self.cvf2 = nn.Conv1d(in_channels=self.cvf1.out_channels, out_channels=self.cvf1.out_channels, kernel_size=self.ksize, padding='valid', stride=1, groups=self.cvf1.out_channels, dtype=self.dtype)
+        self.cvf3 = nn.Conv1d(in_channels=self.cvf2.out_channels, out_channels=self.ncf * self.cvf2.out_channels, kernel_size=self.ksize, padding='valid', stride=1, groups=self.cvf2.out_channels, dtype=self.dtype)
         self.relu = nn.ReLU()
 
     def forward(self, x):
+        return self.pool(self.convs(x))
+
+    def convs(self, x):  # [B, C, T] -> [B, C, ncf, T - 3(k-1)]; valid convs, so any slice of a longer input's output is the output of that slice
         # Apply the depthwise convolutions
         x = self.cvf1(x)
         x = self.relu(x)
@@ -202,13 +302,19 @@ class ODCM(nn.Module):
         x = self.relu(x)
         x = self.cvf3(x)
         x = self.relu(x)
-        
+        x = torch.reshape(x, (x.shape[0], (int)(x.shape[1] / self.ncf), self.ncf, (int)(x.shape[2])))  # [B, C, ncf, S] as RTM expects
+        return x
+
+    def pool(self, x):  # strided average pooling: S // token_stride tokens, the trailing remainder is dropped
+        if self.token_stride > 1:
+            S = x.shape[3] // self.token_stride
+            x = x[..., :S * self.token_stride].reshape(x.shape[0], x.shape[1], x.shape[2], S, self.token_stride).mean(-1)
         return x
 
 
 
 class RTM(nn.Module):  # Regional transformer module
-    def __init__(self, input, num_blocks, num_heads, dtype):  # input -> S x C x D
+    def __init__(self, input, num_blocks, num_heads, dtype, checkpoint_every=0, share=None, pruned=None):  # input -> S x C x D
         super(RTM, self).__init__()
         #print("Input shape RTM",input.shape)
         self.inputshape = input.transpose(1, 2).transpose(2, 3).shape  # C x D x S
@@ -216,6 +322,9 @@ class RTM(nn.Module):  # Regional transformer module
         self.dtype = dtype
         #print("-----",self.inputshape)
         self.tK = num_blocks  # number of transformer blocks - K in the paper
+        self.checkpoint_every = checkpoint_every  # activation checkpointing: recompute groups of this many blocks in backward (0 = off)
+        self.dynamic_batch = False  # weight/bias/cls are per batch position; True lets any batch size reuse them cyclically
+        self.token_bias = None  # cls token and bias folded into one constant by freeze.freeze_for_inference
         self.hA = num_heads  # number of multi-head self-attention units (A is the number of units in a block)
         self.Dh = int(self.M_size1 / self.hA)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
 
@@ -230,9 +339,9 @@ class RTM(nn.Module):  # Regional transformer module
 
         trunc_normal(self.bias, std=.02)
         trunc_normal(self.cls, std=.02)
-        self.tfb = nn.ModuleList([GenericTFB(self.M_size1, self.hA, self.dtype) for _ in range(self.tK)])
+        self.tfb = tie_blocks(nn.ModuleList([GenericTFB(self.M_size1, self.hA, self.dtype, **block_shape(pruned, k)) for k in range(self.tK)]), share)
 
-    def forward(self, x):
+    def forward(self, x, rows=None, channel_mask=None):  # channel_mask: [B, C] bool, False = padded channel (zeroed in the output)
         #print("====RTM Forward Pass Start ====")
         
         # Transpose the input tensor
@@ -240,50 +349,48 @@ class RTM(nn.Module):  # Regional transformer module
         x = x.transpose(1, 2).transpose(2, 3)  # Transpose to [channels, timesteps, batch_size]
         #print(f"Input shape after transpose (C x D x S): {x.shape}")  # C x D x S
 
-        # Initialize savespace tensor
-        #print(f"Initializing savespace with shape: [{x.shape[0]}, {x.shape[3]}, {x.shape[1]}, {self.M_size1}]")  # S x C x D
-        savespace = torch.zeros(x.shape[0], x.shape[3], x.shape[1], self.M_size1, dtype=self.dtype).to(device)
-        #print(f"savespace initialized with shape: {savespace.shape}")
-
         # Apply einsum operation
         #print("Performing einsum operation...")
         #print("Weight---------",self.weight.shape)
         #print("x---", x.shape)
 
-        savespace = torch.einsum('bjk,bnki->binj', self.weight, x)
+        weight, cls, bias = (per_sample(p, x.shape[0], self.dynamic_batch, rows) for p in (self.weight, self.cls, self.bias))
+        savespace = torch.einsum('bjk,bnki->binj', weight, x)
         # savespace = torch.einsum('lm,jmi -> ijl', self.weight, x)  # Matrix multiplication
         #print(f"savespace after einsum: {savespace.shape}")  # Expected: S x C x D
 
         # Concatenate class token
         #print(f"self.cls shape before concatenation: {self.cls.shape}")  # Expected: [timesteps, 1, embedding_dim]
         #print(f"savespace shape before concatenation: {savespace.shape}")  # Expected: [timesteps, channels, embedding_dim]
-        savespace = torch.cat((self.cls, savespace), dim=2)  # Concatenate along channels (dim=1)
+        if self.token_bias is not None:
+            return mask_channels(run_blocks(self.tfb, x, embed_tokens(savespace, per_sample(self.token_bias, x.shape[0], self.dynamic_batch, rows)), self.checkpoint_every), channel_mask, 1)
+        savespace = torch.cat((cls, savespace), dim=2)  # Concatenate along channels (dim=1)
         #print(f"savespace shape after concatenation (with class token): {savespace.shape}")  # S x (C+1) x D
 
         # Add bias to savespace
         #print("Adding bias to savespace...")
-        savespace = torch.add(savespace, self.bias)  # Element-wise addition
+        savespace = torch.add(savespace, bias)  # Element-wise addition
         #print(f"savespace shape after adding bias: {savespace.shape}")  # S x C x D
 
         # Pass through transformer blocks
         #print("Passing through transformer blocks...")
-        for idx, tfb in enumerate(self.tfb):
-         #   print(f"  Transformer block {idx + 1}: Input shape: {savespace.shape}")
-            savespace = tfb(x, savespace)
-          #  print(f"  Transformer block {idx + 1}: Output shape: {savespace.shape}")
+        savespace = run_blocks(self.tfb, x, savespace, self.checkpoint_every)
 
         #print("====RTM Forward Pass End ====")
-        return savespace  # Final shape: S x C x D
+        return mask_channels(savespace, channel_mask, 1)  # Final shape: S x C x D; padded channels zeroed
 
 
 class STM(nn.Module):  # Synchronous transformer module
-    def __init__(self, input, num_blocks, num_heads, dtype):  # input -> # S x C x D
+    def __init__(self, input, num_blocks, num_heads, dtype, checkpoint_every=0, share=None, pruned=None):  # input -> # S x C x D
         super(STM, self).__init__()
         self.inputshape = input.transpose(2, 3).shape  # S x D x C (S x Le x C in the paper)
         self.M_size1 = self.inputshape[2]  # -> D
         self.dtype = dtype
 
         self.tK = num_blocks  # number of transformer blocks - K in the paper
+        self.checkpoint_every = checkpoint_every  # activation checkpointing: recompute groups of this many blocks in backward (0 = off)
+        self.dynamic_batch = False  # weight/bias/cls are per batch position; True lets any batch size reuse them cyclically
+        self.token_bias = None  # cls token and bias folded into one constant by freeze.freeze_for_inference
         self.hA = num_heads  # number of multi-head self-attention units (A is the number of units in a block)
         self.Dh = int(self.M_size1 / self.hA)  # Dh is the quotient computed by D/A and denotes the dimension number of three vectors.
 
@@ -295,9 +402,9 @@ class STM(nn.Module):  # Synchronous transformer module
         self.cls = nn.Parameter(torch.zeros(self.inputshape[0], self.inputshape[3], 1, self.M_size1, dtype=self.dtype))
         trunc_normal(self.bias, std=.02)
         trunc_normal(self.cls, std=.02)
-        self.tfb = nn.ModuleList([GenericTFB(self.M_size1, self.hA, self.dtype) for _ in range(self.tK)])
+        self.tfb = tie_blocks(nn.ModuleList([GenericTFB(self.M_size1, self.hA, self.dtype, **block_shape(pruned, k)) for k in range(self.tK)]), share)
 
-    def forward(self, x):  # S x C x D -> x
+    def forward(self, x, rows=None, channel_mask=None):  # S x C x D -> x; channel_mask: [B, C] bool, False = padded channel
         #print("====STM Forward Pass Start ====")
         #print(f"Input shape (x): {x.shape} (expected: [batch_size, timesteps, channels])")
 
@@ -305,49 +412,40 @@ class STM(nn.Module):  # Synchronous transformer module
         x = x.transpose(2, 3)  # From [batch_size, timesteps, channels] -> [batch_size, channels, timesteps]
         #print(f"Transposed input shape: {x.shape} (expected: [batch_size, channels, timesteps])")
 
-        # Initialize savespace
-        #print("Initializing savespace...")
-        savespace = torch.zeros(
-            x.shape[3],  # timesteps
-            x.shape[1] + 1,  # batch_size + 1 (to accommodate CLS token)
-            self.M_size1,  # Embedding size
-            dtype=self.dtype
-        ).to(device)
-        #print(f"Initialized savespace shape: {savespace.shape} (expected: [timesteps, batch_size + 1, embedding_dim])")
-
         # Perform einsum operation
         #print("Performing einsum operation to compute savespace...")
         #print(f"Weight shape: {self.weight.shape}")  # lm
         #print(f"x shape: {x.shape}")  # jmi
-        savespace = torch.einsum('blm,bjmi -> bijl', self.weight, x)
+        weight, cls, bias = (per_sample(p, x.shape[0], self.dynamic_batch, rows) for p in (self.weight, self.cls, self.bias))
+        savespace = torch.einsum('blm,bjmi -> bijl', weight, x)
 
         #print(f"savespace after einsum: {savespace.shape} (expected: [timesteps, batch_size, embedding_dim])")
 
         # Concatenate CLS token
         #print("Concatenating CLS token to savespace...")
         #print(f"CLS token shape: {self.cls.shape} (expected: [timesteps, 1, embedding_dim])")
-        savespace = torch.cat((self.cls, savespace), dim=2)  # Concatenate along the batch dimension
+        mask = token_mask(channel_mask)  # padded channel tokens are neither attended to nor passed on
+        if self.token_bias is not None:
+            return mask_channels(run_blocks(self.tfb, x, embed_tokens(savespace, per_sample(self.token_bias, x.shape[0], self.dynamic_batch, rows)), self.checkpoint_every, mask), mask, 2)
+        savespace = torch.cat((cls, savespace), dim=2)  # Concatenate along the batch dimension
         #print(f"savespace after concatenation: {savespace.shape} (expected: [timesteps, batch_size + 1, embedding_dim])")
 
         # Add bias to savespace
         #print("Adding bias to savespace...")
         #print(f"Bias shape: {self.bias.shape} (expected: [timesteps, batch_size + 1, embedding_dim])")
-        savespace = torch.add(savespace, self.bias)
+        savespace = torch.add(savespace, bias)
         #print(f"savespace after adding bias: {savespace.shape} (expected: [timesteps, batch_size + 1, embedding_dim])")
 
         # Pass savespace through each transformer block
         #print("Passing savespace through transformer blocks...")
-        for idx, tfb in enumerate(self.tfb):
-            #print(f"Passing through transformer block {idx + 1}...")
-            savespace = tfb(x, savespace)
-            #print(f"savespace after transformer block {idx + 1}: {savespace.shape} (expected: [timesteps, batch_size + 1, embedding_dim])")
+        savespace = run_blocks(self.tfb, x, savespace, self.checkpoint_every, mask)
 
         #print("====STM Forward Pass End ====")
-        return savespace  # C x S x D - z5 in the paper
+        return mask_channels(savespace, mask, 2)  # C x S x D - z5 in the paper
 
 
 class TTM(nn.Module):  # Temporal transformer module
-    def __init__(self, input, num_submatrices, num_blocks, num_heads, dtype):  # input -> # C x S x D
+    def __init__(self, input, num_submatrices, num_blocks, num_heads, dtype, checkpoint_every=0, rank=None, share=None, pruned=None):  # input -> # C x S x D
         super(TTM, self).__init__()
         self.dtype = dtype
         self.avgf = num_submatrices  # average factor (M)
@@ -362,43 +460,61 @@ class TTM(nn.Module):  # Temporal transformer module
 
         self.M_size1 = self.input.shape[2] * self.input.shape[3]
         self.tK = num_blocks  # number of transformer blocks - K in the paper
+        self.checkpoint_every = checkpoint_every  # activation checkpointing: recompute groups of this many blocks in backward (0 = off)
+        self.dynamic_batch = False  # weight/bias/cls are per batch position; True lets any batch size reuse them cyclically
+        self.token_bias = None  # cls token and bias folded into one constant by freeze.freeze_for_inference
         self.hA = num_heads  # number of multi-head self-attention units (A is the number of units in a block)
         self.Dh = int(self.M_size1 / self.hA)
 
         if self.M_size1 % self.hA != 0 or int(self.M_size1 / self.hA) == 0:  # - Dh = 121*(S+1) / num_heads
             print(f"ERROR 4 - TTM : self.Dh = {int(self.M_size1 / self.hA)} != {self.M_size1}/{self.hA} \nTry with different num_heads")
 
-        self.weight = nn.Parameter(torch.randn(self.input.shape[0],self.M_size1, self.input.shape[2] * self.input.shape[3], dtype=self.dtype))
+        self.rank = rank  # None: full [D, D] embedding per sample, else weight = weight_u @ weight_v of rank r
+        if rank is None:
+            self.weight = nn.Parameter(torch.randn(self.input.shape[0],self.M_size1, self.input.shape[2] * self.input.shape[3], dtype=self.dtype))
+        else:
+            self.weight_u = nn.Parameter(torch.randn(self.input.shape[0], self.M_size1, rank, dtype=self.dtype))
+            self.weight_v = nn.Parameter(torch.randn(self.input.shape[0], rank, self.input.shape[2] * self.input.shape[3], dtype=self.dtype) / math.sqrt(rank))
         self.bias = nn.Parameter(torch.zeros(self.input.shape[0], self.avgf + 1, self.M_size1, dtype=self.dtype))
         self.cls = nn.Parameter(torch.zeros(self.input.shape[0], 1, self.M_size1, dtype=self.dtype))
         trunc_normal(self.bias, std=.02)
         trunc_normal(self.cls, std=.02)
-        self.tfb = nn.ModuleList([TemporalTFB(self.M_size1, self.hA, self.avgf, self.dtype) for _ in range(self.tK)])
+        self.tfb = tie_blocks(nn.ModuleList([TemporalTFB(self.M_size1, self.hA, self.avgf, self.dtype, rank, **block_shape(pruned, k)) for k in range(self.tK)]), share)
 
-        self.lnorm_extra = nn.LayerNorm(self.M_size1, dtype=self.dtype)  # EXPERIMENTAL
+        self.lnorm_extra = LayerNorm(self.M_size1, dtype=self.dtype)  # EXPERIMENTAL
 
-    def forward(self, x):
+        # traceable=True replaces the segment loops by one matmul with this averaging matrix (same segments as the loops)
+        self.traceable = False
+        segment_avg = torch.zeros(self.avgf, self.input.shape[1], dtype=self.dtype)
+        for i in range(self.avgf):
+            segment_avg[i, int(i * self.seg):int((i + 1) * self.seg)] = 1 / self.seg
+        self.register_buffer('segment_avg', segment_avg.to(device), persistent=False)
+
+    def forward(self, x, rows=None):
         ##print("====TTM Forward Pass Start ====")
         #print(f"Input x shape before transpose: {x.shape}")  # Initial shape: [batch_size, channels, timesteps]
         
         input = x.transpose(1, 3)  # D x S x C
         #print(f"Input shape after transpose (D x S x C): {input.shape}")
         
-        # Initialize inputc with zeros
-        inputc = torch.zeros(input.shape[0], self.avgf, input.shape[2], input.shape[3], dtype=self.dtype).to(device)  # M x S x C
-        #print(f"Initialized inputc (M x S x C): {inputc.shape}")
-        
-        # Perform segment-wise aggregation
-        #print("Performing segment-wise aggregation for batch...")
-        for b in range(input.shape[0]):  # Iterate over the batch dimension
-            #print(f"Processing batch sample {b + 1}/{input.shape[0]}...")
-            for i in range(self.avgf):  # Each segment covers input.shape[1]/avgf
-                #print(f"Processing segment {i + 1}/{self.avgf} for batch {b + 1}...")
-                for j in range(int(i * self.seg), int((i + 1) * self.seg)):  # Range for segment
-                    #print(f"Adding input[{b}, {j}, :, :] to inputc[{b}, {i}, :, :]")
-                    inputc[b, i, :, :] = inputc[b, i, :, :] + input[b, j, :, :]
-                inputc[b, i, :, :] = inputc[b, i, :, :] / self.seg  # Average the segment
-                #print(f"Segment {i + 1} after averaging for batch {b + 1}: inputc[{b}, {i}, :, :]")
+        if self.traceable:
+            inputc = torch.einsum('ms,bsjk -> bmjk', self.segment_avg.to(input.dtype), input)  # M x S x C
+        else:
+            # Initialize inputc with zeros
+            inputc = torch.zeros(input.shape[0], self.avgf, input.shape[2], input.shape[3], dtype=self.dtype).to(device)  # M x S x C
+            #print(f"Initialized inputc (M x S x C): {inputc.shape}")
+
+            # Perform segment-wise aggregation
+            #print("Performing segment-wise aggregation for batch...")
+            for b in range(input.shape[0]):  # Iterate over the batch dimension
+                #print(f"Processing batch sample {b + 1}/{input.shape[0]}...")
+                for i in range(self.avgf):  # Each segment covers input.shape[1]/avgf
+                    #print(f"Processing segment {i + 1}/{self.avgf} for batch {b + 1}...")
+                    for j in range(int(i * self.seg), int((i + 1) * self.seg)):  # Range for segment
+                        #print(f"Adding input[{b}, {j}, :, :] to inputc[{b}, {i}, :, :]")
+                        inputc[b, i, :, :] = inputc[b, i, :, :] + input[b, j, :, :]
+                    inputc[b, i, :, :] = inputc[b, i, :, :] / self.seg  # Average the segment
+                    #print(f"Segment {i + 1} after averaging for batch {b + 1}: inputc[{b}, {i}, :, :]")
 
         #print(f"inputc shape after aggregation: {inputc.shape}")
         
@@ -406,36 +522,37 @@ class TTM(nn.Module):  # Temporal transformer module
         altx = inputc.reshape(input.shape[0], self.avgf, input.shape[2] * input.shape[3]).to(device)  # M x L -> M x (S*C)
         #print(f"altx shape after reshape (M x (S*C)): {altx.shape}")
         
-        # Initialize savespace
-        savespace = torch.zeros(input.shape[0], self.avgf, self.M_size1, dtype=self.dtype).to(device)  # M x D
-        #print(f"Initialized savespace (M x D): {savespace.shape}")
-        
         # Perform einsum operation
         #print("Performing einsum operation...")
         #print(f"Weight shape: {self.weight.shape}")  # lm
         #print(f"altx shape: {altx.shape}")  # im
-        savespace = torch.einsum('blm,bim -> bil', self.weight, altx.clone())
+        cls, bias = (per_sample(p, x.shape[0], self.dynamic_batch, rows) for p in (self.cls, self.bias))
+        if self.rank is None:
+            savespace = torch.einsum('blm,bim -> bil', per_sample(self.weight, x.shape[0], self.dynamic_batch, rows), altx.clone())
+        else:
+            weight_u, weight_v = (per_sample(p, x.shape[0], self.dynamic_batch, rows) for p in (self.weight_u, self.weight_v))
+            savespace = torch.einsum('blr,bir -> bil', weight_u, torch.einsum('brm,bim -> bir', weight_v, altx))
         #print(f"savespace after einsum (M x D): {savespace.shape}")
         
         # Concatenate class token
         #print("Concatenating class token...")
         #print(f"Class token shape: {self.cls.shape}")
         #print(f"savespace shape before concatenation: {savespace.shape}")
-        savespace = torch.cat((self.cls, savespace), dim=1)  # Concatenate along the first dimension
-        #print(f"savespace shape after concatenation (M+1 x D): {savespace.shape}")
-        
-        # Add bias to savespace
-        #print("Adding bias to savespace...")
-        #print(f"Bias shape: {self.bias.shape}")
-        savespace = torch.add(savespace, self.bias)  # z -> M x D
+        if self.token_bias is not None:
+            savespace = embed_tokens(savespace, per_sample(self.token_bias, x.shape[0], self.dynamic_batch, rows))
+        else:
+            savespace = torch.cat((cls, savespace), dim=1)  # Concatenate along the first dimension
+            #print(f"savespace shape after concatenation (M+1 x D): {savespace.shape}")
+
+            # Add bias to savespace
+            #print("Adding bias to savespace...")
+            #print(f"Bias shape: {self.bias.shape}")
+            savespace = torch.add(savespace, bias)  # z -> M x D
         #print(f"savespace shape after adding bias: {savespace.shape}")
         
         # Pass through transformer blocks
         #print("Passing savespace through transformer blocks...")
-        for idx, tfb in enumerate(self.tfb):
-            #print(f"Transformer block {idx + 1}/{len(self.tfb)} input shape: {savespace.shape}")
-            savespace = tfb(x, savespace)
-            #print(f"Transformer block {idx + 1} output shape: {savespace.shape}")
+        savespace = run_blocks(self.tfb, x, savespace, self.checkpoint_every)
         
         # Layer normalization
         #print("Applying final layer normalization...")
@@ -477,13 +594,35 @@ class CNNdecoder(nn.Module):  # EEGformer decoder
         # Activation
         self.relu = nn.ReLU()
 
+        self.traceable = False  # True: run all samples through the convs at once instead of the per-sample loop
+
 
-    def forward(self, x):  # x -> [B, M, S, C]
+    def channel_weights(self, channel_mask, S, dtype):  # per channel slot factor of the cvd2 sum: padded slots dropped, the rest rescaled to S slots
+        if channel_mask is None:
+            return None
+        keep = token_mask(channel_mask).to(dtype)
+        return keep * (S / keep.sum(1, keepdim=True))
+
+    def features(self, x, channel_mask=None):  # [B, M, S, C] -> [B, (M/2)*N] fc inputs, the window embedding before the classifier
+        B, M, S, C = x.shape
+        keep = self.channel_weights(channel_mask, S, x.dtype)
+        x = self.relu(self.cvd1(x.permute(0, 2, 3, 1).reshape(B * S, C, M))).reshape(B, S, M)  # [B, S, M]
+        if keep is not None:
+            x = x * keep[:, :, None]
+        x = self.relu(self.cvd2(x)).transpose(1, 2)  # [B, M, N]
+        x = self.relu(self.cvd3(x))  # [B, M/2, N]
+        return x.reshape(B, x.shape[1] * x.shape[2])
+
+    def forward(self, x, channel_mask=None):  # x -> [B, M, S, C]; channel_mask: [B, S-1] bool, False = padded channel
         #print("==== CNN Decoder Forward Pass Start ====")
         #print(f"Input shape (B x M x S x C): {x.shape}")
 
         # Extract dimensions
         B, M, S, C = x.shape
+        keep = self.channel_weights(channel_mask, S, x.dtype)  # padded channel slots dropped from the cvd2 sum
+
+        if self.traceable:  # same convolutions as the loop below, with the batch folded into the conv batch dimension
+            return self.fc(self.features(x, channel_mask)[:, None])  # [B, 1, num_cls]
 
         # Initialize an empty list to store outputs for each batch
         batch_outputs = []
@@ -510,6 +649,8 @@ class CNNdecoder(nn.Module):  # EEGformer decoder
             # Remove the singleton channel dimension
             x_batch = x_batch[:, 0, :]  # [M, S]
             #print(f"Batch {b} after squeezing channel dimension, shape: {x_batch.shape}")
+            if keep is not None:
+                x_batch = x_batch * keep[b][:, None]
 
             # Apply the second convolution
             x_batch = self.cvd2(x_batch).transpose(0,1)  # [M, N]
@@ -574,9 +715,25 @@ class EEGformer(nn.Module):
         
         self.fc_layer = torch.nn.Linear(120 * 150, num_cls)  # Adjust to match the desired flattened size and output classes
 
+class ExitHead(nn.Module):  # early-exit classifier on the CLS tokens of an intermediate module (RTM or STM)
+    def __init__(self, emb_size, num_cls, dtype):
+        super(ExitHead, self).__init__()
+        self.norm = LayerNorm(emb_size, dtype=dtype)
+        self.fc = nn.Linear(emb_size, num_cls, dtype=dtype)
+
+    def forward(self, cls_tokens):  # [B, n, D] CLS tokens (one per channel / filter) -> [B, num_cls] logits (trained with nn.CrossEntropyLoss)
+        x = self.fc(self.norm(cls_tokens).mean(1))
+        if x.dtype in (torch.bfloat16, torch.float16):  # loss / softmax in fp32 under autocast
+            x = x.float()
+        return x
+
+
 class EEGformer(nn.Module):
-    def __init__(self, input, num_cls, input_channels, kernel_size, num_blocks, num_heads_RTM, num_heads_STM, num_heads_TTM, num_submatrices, CF_second, dtype=torch.float32):
+    def __init__(self, input, num_cls, input_channels, kernel_size, num_blocks, num_heads_RTM, num_heads_STM, num_heads_TTM, num_submatrices, CF_second, dtype=torch.float32, checkpoint_every=0, ttm_rank=None, share_blocks=None, pruned=None, early_exit=False, token_stride=1):
         super(EEGformer, self).__init__()
+        validate_config(dict(num_cls=num_cls, input_channels=input_channels, kernel_size=kernel_size, num_blocks=num_blocks,
+                             num_heads_RTM=num_heads_RTM, num_heads_STM=num_heads_STM, num_heads_TTM=num_heads_TTM,
+                             num_submatrices=num_submatrices, CF_second=CF_second, ttm_rank=ttm_rank, share_blocks=share_blocks, pruned=pruned, token_stride=token_stride), input.shape[1])  # before any allocation
         #print("input shape in model", input.shape)
         #print("input channels",input_channels)
         self.dtype = dtype
@@ -590,8 +747,15 @@ class EEGformer(nn.Module):
         self.hA_ttm = num_heads_TTM
         self.avgf = num_submatrices
         self.cfs = CF_second
-
-        self.outshape1 = torch.zeros(input.shape[0], self.input_channels, self.ncf, input.shape[1] - 3 * (self.kernel_size - 1)).to(device)
+        self.checkpoint_every = checkpoint_every
+        self.ttm_rank = ttm_rank  # rank of the factorized TTM embedding, Wo and Mlp projections (None = full rank)
+        self.share_blocks = share_blocks  # weights shared across the blocks of RTM/STM/TTM: None, 'all', 'attention' or 'mlp'
+        self.pruned = pruned  # structured pruning: {'rtm'/'stm'/'ttm': [dict(heads=[kept head indices], hidden=Mlp width) per block]}
+        self.early_exit = early_exit  # exit heads on the RTM and STM CLS tokens (predict_early_exit)
+        self.token_stride = token_stride  # ODCM time steps pooled per token, RTM/STM/TTM see S = (T - 3(k-1)) // token_stride
+        self.samples = input.shape[1]  # input length T
+
+        self.outshape1 = torch.zeros(input.shape[0], self.input_channels, self.ncf, (input.shape[1] - 3 * (self.kernel_size - 1)) // token_stride).to(device)
         #old self.outshape1 = torch.zeros(self.input_channels, self.ncf, input.shape[0] - 3 * (self.kernel_size - 1)).to(device)
         self.outshape2 = torch.zeros(self.outshape1.shape[0], self.outshape1.shape[1], self.outshape1.shape[2] + 1, self.outshape1.shape[3]).to(device)
         #old self.outshape2 = torch.zeros(self.outshape1.shape[0], self.outshape1.shape[1] + 1, self.outshape1.shape[2]).to(device)
@@ -600,30 +764,36 @@ class EEGformer(nn.Module):
         self.outshape4 = torch.zeros(self.outshape3.shape[0], self.avgf + 1, self.outshape3.shape[2], self.outshape3.shape[1]).to(device)
         #old self.outshape4 = torch.zeros(self.avgf + 1, self.outshape3.shape[1], self.outshape3.shape[0]).to(device)
 
-        self.odcm = ODCM(input_channels, self.kernel_size, self.dtype)
-        self.rtm = RTM(self.outshape1, self.tK, self.hA_rtm, self.dtype)
-        self.stm = STM(self.outshape2, self.tK, self.hA_stm, self.dtype)
-        self.ttm = TTM(self.outshape3, self.avgf, self.tK, self.hA_ttm, self.dtype)
+        self.odcm = ODCM(input_channels, self.kernel_size, self.dtype, token_stride)
+        pruned = pruned or {}
+        self.rtm = RTM(self.outshape1, self.tK, self.hA_rtm, self.dtype, self.checkpoint_every, self.share_blocks, pruned.get('rtm'))
+        self.stm = STM(self.outshape2, self.tK, self.hA_stm, self.dtype, self.checkpoint_every, self.share_blocks, pruned.get('stm'))
+        self.ttm = TTM(self.outshape3, self.avgf, self.tK, self.hA_ttm, self.dtype, self.checkpoint_every, self.ttm_rank, self.share_blocks, pruned.get('ttm'))
         self.cnndecoder = CNNdecoder(self.outshape4, self.num_cls, self.cfs, self.dtype)
+        S = self.outshape1.shape[3]
+        self.exits = nn.ModuleDict({name: ExitHead(S, num_cls, self.dtype) for name in ('rtm', 'stm')}) if early_exit else None
+        self.patient_heads = nn.ModuleList()  # per-patient fine-tuned ttm + cnndecoder, picked per sample by forward(x, head)
         
         self.fc_layer = torch.nn.Linear(120 * 150, num_cls)  # Adjust to match the desired flattened size and output classes
 
-    def forward(self, x):
+    def forward(self, x, head=None, channel_mask=None):  # channel_mask: [B, C] bool for montages zero-padded to C channels (False = absent)
+        if head is not None:  # windows of several patients: shared odcm/rtm/stm pass, per-patient ttm/cnndecoder
+            return self.forward_heads(x, head, channel_mask=channel_mask)
         #print("==== Forward Pass Start ====")
-        print(f"input shape to pipeline {x.shape}")
+        #print(f"input shape to pipeline {x.shape}")
         # x = self.odcm(x.transpose(1, 2))
         #print(f"Input shape to ODCM: {x.shape} (expected: [batch_size, channels, timesteps])")
         x = self.odcm(x)
-        print(f"Output shape from ODCM: {x.shape} (expected: [batch_size, ncf, reduced_timesteps])")
+        #print(f"Output shape from ODCM: {x.shape} (expected: [batch_size, ncf, reduced_timesteps])")
 
         # Pass through RTM
         #print(f"Input shape to RTM: {x.shape} (expected: [batch_size, channels, reduced_timesteps])")
-        x = self.rtm(x)
-        print(f"Output shape from RTM: {x.shape} (expected: [batch_size, timesteps, channels, embedding_dim])")
+        x = self.rtm(x, channel_mask=channel_mask)
+        #print(f"Output shape from RTM: {x.shape} (expected: [batch_size, timesteps, channels, embedding_dim])")
 
         # Pass through STM
         #print(f"Input shape to STM: {x.shape} (expected: [batch_size, timesteps, channels, embedding_dim])")
-        x = self.stm(x)
+        x = self.stm(x, channel_mask=channel_mask)
         #print(f"Output shape from STM: {x.shape} (expected: [batch_size, reduced_timesteps, embedding_dim])")
 
         # Pass through TTM
@@ -631,20 +801,150 @@ class EEGformer(nn.Module):
         x = self.ttm(x)
         #print(f"Output shape from TTM: {x.shape} (expected: [batch_size, submatrices, embedding_dim])")
 
-        # CNN Decoder
+        # CNN Decoder and softmax output
         #print(f"Input shape to CNN Decoder: {x.shape} (expected: [batch_size, submatrices, embedding_dim])")
-        x = self.cnndecoder(x)
-        #print(f"Output shape from CNN Decoder: {x.shape} (expected: [batch_size, num_classes])")
-
-        # Softmax output
-        #print("Before softmax", x.shape)
-        output_softmax = torch.softmax(x, dim=-1).squeeze(1)
+        output_softmax = self.decode(x, channel_mask=channel_mask)
 
         #print(f"Output shape after softmax: {output_softmax.shape} (expected: [batch_size, num_classes])")
         #print("==== Forward Pass End ====")
 
         return output_softmax
 
+    def decode(self, x, cnndecoder=None, channel_mask=None):  # TTM output -> class probabilities [B, num_cls]
+        x = (cnndecoder or self.cnndecoder)(x) if channel_mask is None else (cnndecoder or self.cnndecoder)(x, channel_mask)
+        if x.dtype in (torch.bfloat16, torch.float16):  # softmax in fp32 under autocast
+            x = x.float()
+        return torch.softmax(x, dim=-1).squeeze(1)
+
+    def add_patient_head(self, source=None):
+        """Append a copy of source's ttm and cnndecoder (e.g. a per-patient fine-tuned EEGformer; default: this model's) as a patient head; returns its index."""
+        source = source or self
+        self.patient_heads.append(nn.ModuleDict(dict(ttm=copy.deepcopy(source.ttm), cnndecoder=copy.deepcopy(source.cnndecoder))))
+        return len(self.patient_heads) - 1
+
+    def forward_heads(self, x, head, rows=None, channel_mask=None):
+        """
+        Class probabilities for a batch mixing windows of several patients.
+
+        odcm, rtm and stm (~99% of the FLOPs) run once for the whole batch; each group of samples with the same
+        head index then runs through that patient's ttm and cnndecoder, keeping the samples' batch positions.
+
+        Args:
+            x: [N, C, T] windows
+            head: per-sample index into patient_heads ([N] tensor or one int for all); -1 selects the model's own ttm/cnndecoder
+            rows: batch positions of the samples (default 0..N-1), e.g. to continue the positions of a previous chunk
+            channel_mask: [N, C] bool, False marks zero-padded channels of smaller montages
+        """
+        head = torch.as_tensor(head, device=x.device).expand(x.shape[0])
+        rows = torch.arange(x.shape[0], device=x.device) if rows is None else rows
+        x = self.stm(self.rtm(self.odcm(x), rows, channel_mask), rows, channel_mask)
+        probs = None
+        for k in head.unique().tolist():
+            idx = (head == k).nonzero().squeeze(1)
+            part = self if k < 0 else self.patient_heads[k]
+            p = self.decode(part.ttm(x.index_select(0, idx), rows[idx]), part.cnndecoder, None if channel_mask is None else channel_mask[idx])
+            if probs is None:
+                probs = p.new_empty(x.shape[0], self.num_cls)
+            probs[idx] = p
+        return probs
+
+    def predict_channels(self, x, reduce='mean', head=-1, chunk_size=None):
+        """
+        Scores of a single-channel model (input_channels=1) for every channel of multichannel windows.
+
+        The channels are folded into the batch dimension and run as one forward over all B * C folded samples,
+        replacing a forward per channel. Pass chunk_size to bound the activation memory instead (smaller chunks
+        give the same outputs at the cost of more calls).
+
+        Args:
+            x: [B, C, T] windows
+            reduce: per-window aggregation of the channel probabilities: 'mean', or 'max' (per class, renormalized)
+            head: patient head index per window ([B] or one int, see forward_heads)
+            chunk_size: folded samples per forward (None: all B * C at once)
+
+        Returns:
+            (per-channel probabilities [B, C, num_cls], per-window probabilities [B, num_cls])
+        """
+        if self.input_channels != 1:
+            raise ValueError(f"channel folding needs a single-channel model, this one has input_channels = {self.input_channels}")
+        B, C, T = x.shape
+        folded = x.reshape(B * C, 1, T)
+        heads = torch.as_tensor(head, device=x.device).expand(B).repeat_interleave(C)
+        chunk_size = chunk_size or B * C
+        rows = torch.arange(B, device=x.device).repeat_interleave(C)  # every channel of window b runs at batch position b, as model(x[:, c:c+1]) does
+        probs = torch.cat([self.forward_heads(folded[i:i + chunk_size], heads[i:i + chunk_size], rows[i:i + chunk_size])
+                           for i in range(0, B * C, chunk_size)]).reshape(B, C, self.num_cls)
+        if reduce == 'mean':
+            window = probs.mean(1)
+        elif reduce == 'max':
+            window = probs.max(1).values
+            window = window / window.sum(-1, keepdim=True)
+        else:
+            raise ValueError(f"reduce must be 'mean' or 'max', got {reduce!r}")
+        return probs, window
+
+    def forward_exits(self, x):  # outputs of every exit [RTM exit logits, STM exit logits, final probabilities], e.g. to train the exit heads
+        if self.exits is None:
+            raise ValueError("model was built without exit heads (early_exit=False)")
+        x = self.rtm(self.odcm(x))
+        outputs = [self.exits['rtm'](x[:, :, 0])]  # RTM CLS tokens: one per channel
+        x = self.stm(x)
+        outputs.append(self.exits['stm'](x[:, :, 0]))  # STM CLS tokens: one per filter
+        outputs.append(self.decode(self.ttm(x)))
+        return outputs
+
+    def predict_early_exit(self, x, threshold=0.9):
+        """
+        Inference that stops each sample at the first exit whose top class probability reaches threshold.
+
+        Samples leaving at the RTM or STM exit skip the remaining modules; the others keep their batch
+        positions (RTM/STM/TTM weights are per position), so any batch size works.
+
+        Returns:
+            (class probabilities [N, num_cls], exit index per sample: 0 = RTM, 1 = STM, 2 = final decoder)
+        """
+        if self.exits is None:
+            raise ValueError("model was built without exit heads (early_exit=False)")
+        rows = torch.arange(x.shape[0], device=x.device)
+        exit_index = torch.full((x.shape[0],), 2, dtype=torch.long, device=x.device)
+        x = self.rtm(self.odcm(x), rows)
+        probs = None
+        for index, name in enumerate(('rtm', 'stm')):
+            if index:
+                x = self.stm(x, rows)
+            p = torch.softmax(self.exits[name](x[:, :, 0]), dim=-1)
+            if probs is None:
+                probs = p.new_empty(exit_index.shape[0], self.num_cls)
+            done = p.max(-1).values >= threshold
+            probs[rows[done]] = p[done]
+            exit_index[rows[done]] = index
+            if done.all():
+                return probs, exit_index
+            rows, x = rows[~done], x[~done]
+        probs[rows] = self.decode(self.ttm(x, rows))
+        return probs, exit_index
+
+    def set_traceable(self, traceable=True, dynamic_batch=False):  # loop-free TTM averaging and CNNdecoder for torch.jit.trace / torch.compile / export
+        for part in [self] + list(self.patient_heads):
+            part.ttm.traceable = traceable
+            part.cnndecoder.traceable = traceable
+            part.ttm.dynamic_batch = dynamic_batch
+        for module in (self.rtm, self.stm):
+            module.dynamic_batch = dynamic_batch
+        return self
+
+    def get_config(self):  # constructor arguments (besides the dummy input) that rebuild this model
+        return dict(num_cls=self.num_cls, input_channels=self.input_channels, kernel_size=self.kernel_size, num_blocks=self.tK,
+                    num_heads_RTM=self.hA_rtm, num_heads_STM=self.hA_stm, num_heads_TTM=self.hA_ttm, num_submatrices=self.avgf,
+                    CF_second=self.cfs, dtype=self.dtype, checkpoint_every=self.checkpoint_every, ttm_rank=self.ttm_rank,
+                    share_blocks=self.share_blocks, pruned=self.pruned, early_exit=self.early_exit,
+                    token_stride=self.token_stride)
+
+    def rebuild(self, **overrides):  # freshly initialized model for the same input shape, with config overrides
+        B, C = self.outshape1.shape[:2]
+        sample_input = torch.zeros(B, self.samples, C, device=device)
+        return EEGformer(sample_input, **dict(self.get_config(), **overrides)).to(device)
+
     # CE - uses one hot encoded label or similar(such as multi class probability label)
     def eegloss(self, xf, label, L1_reg_const):  # CE Loss with L1 regularization
         wt = self.sa(self.cnndecoder.fc.weight) + self.sa(self.cnndecoder.cvd1.weight) + self.sa(self.cnndecoder.cvd2.weight) + self.sa(self.cnndecoder.cvd3.weight)
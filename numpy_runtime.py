@@ -0,0 +1,201 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Torch-free EEGformer inference (models.py architecture) on weights written by export.export_numpy.
+# Same computation as EEGformer.forward in traceable mode, in float32 with batched matmuls.
+
+CONFIG_PREFIX = "config."
+
+
+def gelu(x):  # exact (erf) GELU as nn.GELU, erf from Abramowitz-Stegun 7.1.26 (|error| < 1.5e-7)
+    a = np.abs(x) * np.float32(1 / math.sqrt(2))
+    t = 1 / (1 + np.float32(0.3275911) * a)
+    poly = t * np.float32(1.061405429) - np.float32(1.453152027)
+    for c in (1.421413741, -0.284496736, 0.254829592):
+        poly *= t
+        poly += np.float32(c)
+    poly *= t
+    np.square(a, out=a)
+    poly *= np.exp(np.negative(a, out=a), out=a)
+    erf = np.copysign(1 - poly, x, out=poly)
+    erf += 1
+    erf *= x
+    erf *= np.float32(0.5)
+    return erf
+
+
+def layer_norm(x, weight, bias, eps=1e-5):
+    mean = x.mean(-1, keepdims=True)
+    var = np.square(x - mean).mean(-1, keepdims=True)
+    return (x - mean) / np.sqrt(var + eps) * weight + bias
+
+
+def linear(x, weight, bias=None):  # x [..., in] @ weight [in, out] as one 2-D BLAS matmul (stacked small matmuls are slow)
+    out = (x.reshape(-1, x.shape[-1]) @ weight).reshape(*x.shape[:-1], weight.shape[-1])
+    return out if bias is None else np.add(out, bias, out=out)
+
+
+def linear_factors(params, name):  # [(weight [in, out], bias)] of an nn.Linear, or the down/up factors of a LowRankLinear
+    if f'{name}.weight' in params:
+        return [(np.ascontiguousarray(params[f'{name}.weight'].T), params.get(f'{name}.bias'))]
+    return [(np.ascontiguousarray(params[f'{name}.down.weight'].T), None),
+            (np.ascontiguousarray(params[f'{name}.up.weight'].T), params.get(f'{name}.up.bias'))]
+
+
+def apply_linear(x, factors):
+    for weight, bias in factors:
+        x = linear(x, weight, bias)
+    return x
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(-1, keepdims=True))
+    return e / e.sum(-1, keepdims=True)
+
+
+class NumpyTFB:  # GenericTFB (temporal=False) / TemporalTFB (temporal=True) of one transformer block
+    def __init__(self, params, prefix, temporal):
+        p = {k[len(prefix):]: v for k, v in params.items() if k.startswith(prefix)}
+        _, self.hA, self.Dh, self.M_size1 = p['Wqkv'].shape
+        self.temporal = temporal
+        self.wqkv = np.ascontiguousarray(p['Wqkv'].reshape(-1, self.M_size1).T)  # [D, 3*hA*Dh]
+        self.wqkv[:, :self.hA * self.Dh] /= np.float32(math.sqrt(self.Dh))  # fold the 1/sqrt(Dh) score scale into Q
+        self.head_features = p['head_features'].astype(np.int64) if 'head_features' in p else None  # kept features of a pruned GenericTFB
+        if temporal and 'Wo_u' in p:  # low-rank Wo = Wo_u @ Wo_v
+            self.wo = [(np.ascontiguousarray(p['Wo_v'].T), None), (np.ascontiguousarray(p['Wo_u'].T), None)]
+        elif temporal:
+            self.wo = [(np.ascontiguousarray(p['Wo'].T), None)]  # 'nm,bim -> bin' is imv @ Wo.T
+        else:
+            self.wo = p['Wo'].sum(1)  # 'nm,bijn -> bijn' scales feature n by sum_m Wo[n, m]
+        self.ln = (p['lnorm.weight'], p['lnorm.bias'])
+        self.lnz = (p['lnormz.weight'], p['lnormz.bias'])
+        self.fc1 = linear_factors(p, 'mlp.fc1')
+        self.fc2 = linear_factors(p, 'mlp.fc2')
+
+    def __call__(self, z):  # z [..., tokens, D] -> [..., tokens, D]; attention runs over the tokens axis
+        lead, tokens = z.shape[:-2], z.shape[-2]
+        qkv = linear(layer_norm(z, *self.ln), self.wqkv).reshape(*lead, tokens, 3, self.hA, self.Dh)
+        qkv = np.moveaxis(qkv, (-3, -2), (0, -3))  # [3, ..., hA, tokens, Dh]
+        imv = (qkv[0] @ np.swapaxes(qkv[1], -1, -2)) @ qkv[2]  # attention without softmax, as in models.py
+        imv = np.swapaxes(imv, -2, -3).reshape(*lead, tokens, self.hA * self.Dh)
+        if self.temporal:
+            z = apply_linear(imv, self.wo) + z
+        elif self.head_features is None:
+            z = imv * self.wo + z
+        else:  # pruned heads contribute nothing to the residual
+            z = z.copy()
+            z[..., self.head_features] += imv * self.wo
+        return apply_linear(gelu(apply_linear(layer_norm(z, *self.lnz), self.fc1)), self.fc2) + z
+
+
+class NumpyEEGformer:
+    """
+    EEGformer inference with NumPy only.
+
+    Args:
+        path: .npz written by export.export_numpy (state dict arrays and the model config)
+
+    Calling the model on x [N, C, T] float32 returns the class probabilities [N, num_cls]. The RTM/STM/TTM
+    weights are per batch position; sample i uses position i % B (B = batch size the model was built with).
+    """
+    def __init__(self, path):
+        with np.load(path) as archive:
+            params = {k: archive[k].astype(np.float32) for k in archive.files if not k.startswith(CONFIG_PREFIX)}
+            self.config = {k[len(CONFIG_PREFIX):]: archive[k].item() for k in archive.files if k.startswith(CONFIG_PREFIX)}
+        self.ncf = 120
+        self.avgf = self.config['num_submatrices']
+        self.odcm = [(params[f'odcm.cvf{i}.weight'][:, 0], params[f'odcm.cvf{i}.bias']) for i in (1, 2, 3)]
+        self.batch_size = params['rtm.bias'].shape[0]
+
+        # Embedding weights as right operands (two factors for a low-rank TTM), cls merged into the bias: z = [0, x @ W] + bias'
+        self.embed = {}
+        for name in ('rtm', 'stm', 'ttm'):
+            bias, cls = params[f'{name}.bias'].copy(), params[f'{name}.cls']
+            axis = 1 if name == 'ttm' else 2
+            first = (slice(None),) * axis + (slice(0, 1),)
+            bias[first] += cls
+            factors = [params[f'{name}.weight']] if f'{name}.weight' in params else [params[f'{name}.weight_v'], params[f'{name}.weight_u']]
+            self.embed[name] = ([np.ascontiguousarray(np.swapaxes(w, 1, 2)) for w in factors], bias)
+        self.tfb = {name: [NumpyTFB(params, f'{name}.tfb.{k}.', name == 'ttm')
+                           for k in range(self.config['num_blocks'])] for name in ('rtm', 'stm', 'ttm')}
+        self.lnorm_extra = (params['ttm.lnorm_extra.weight'], params['ttm.lnorm_extra.bias'])
+        self.decoder = {name: (params[f'cnndecoder.{name}.weight'].reshape(params[f'cnndecoder.{name}.weight'].shape[0], -1),
+                               params[f'cnndecoder.{name}.bias']) for name in ('cvd1', 'cvd2', 'cvd3', 'fc')}
+        self._segment_avg = {}
+        self._buffers = {}
+
+    def segment_avg(self, S):  # [avgf, S] averaging matrix of the TTM segments
+        if S not in self._segment_avg:
+            seg = S / self.avgf
+            avg = np.zeros((self.avgf, S), dtype=np.float32)
+            for i in range(self.avgf):
+                avg[i, int(i * seg):int((i + 1) * seg)] = 1 / seg
+            self._segment_avg[S] = avg
+        return self._segment_avg[S]
+
+    def buffer(self, name, shape):  # preallocated per-shape work buffer for the embedding outputs
+        key = (name, shape)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(shape, dtype=np.float32)
+        return self._buffers[key]
+
+    def embed_tokens(self, name, x, rows):  # x @ W per sample, cls token prepended along axis 2 (RTM/STM) or 1 (TTM), bias added
+        factors, bias = self.embed[name]
+        axis = 1 if name == 'ttm' else 2
+        factors, bias = [w[rows] for w in factors], bias[rows]
+        if axis == 2:
+            factors = [w[:, None] for w in factors]
+        for weight in factors[:-1]:
+            x = x @ weight
+        weight = factors[-1]
+        shape = list(x.shape[:-1]) + [weight.shape[-1]]
+        shape[axis] += 1
+        out = self.buffer(name, tuple(shape))
+        out[(slice(None),) * axis + (0,)] = 0
+        np.matmul(x, weight, out=out[(slice(None),) * axis + (slice(1, None),)])
+        return np.add(out, bias, out=out)
+
+    def odcm_forward(self, x):  # [N, C, T] -> [N, C, 120, S]; three depthwise valid convs with ReLU, then the token pooling
+        (w1, b1), (w2, b2), (w3, b3) = self.odcm
+        x = relu(np.einsum('nctk,ck->nct', sliding_window_view(x, w1.shape[-1], axis=-1), w1) + b1[:, None])
+        x = relu(np.einsum('nctk,ck->nct', sliding_window_view(x, w2.shape[-1], axis=-1), w2) + b2[:, None])
+        C = x.shape[1]
+        w3, b3 = w3.reshape(C, self.ncf, -1), b3.reshape(C, self.ncf, 1)
+        x = relu(np.einsum('nctk,cfk->ncft', sliding_window_view(x, w3.shape[-1], axis=-1), w3) + b3)
+        stride = self.config.get('token_stride', 1)
+        if stride > 1:
+            S = x.shape[3] // stride
+            x = x[..., :S * stride].reshape(x.shape[:3] + (S, stride)).mean(-1)
+        return x
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        N = x.shape[0]
+        rows = slice(None) if N == self.batch_size else np.arange(N) % self.batch_size
+
+        x = self.odcm_forward(x)  # [N, C, 120, S]
+        z = self.embed_tokens('rtm', x, rows)  # [N, C, 121, S]
+        for tfb in self.tfb['rtm']:
+            z = tfb(z)
+
+        z = self.embed_tokens('stm', z.transpose(0, 2, 1, 3), rows)  # [N, 121, C+1, S]
+        for tfb in self.tfb['stm']:
+            z = tfb(z)
+
+        N, F, C1, S = z.shape
+        pooled = (self.segment_avg(S) @ z.transpose(0, 3, 2, 1).reshape(N, S, C1 * F)).reshape(N, self.avgf, C1 * F)
+        z = self.embed_tokens('ttm', pooled, rows)  # [N, M+1, (C+1)*121]
+        for tfb in self.tfb['ttm']:
+            z = tfb(z)
+        z = layer_norm(z, *self.lnorm_extra).reshape(N, self.avgf + 1, C1, F)
+
+        (w1, b1), (w2, b2), (w3, b3), (wf, bf) = (self.decoder[k] for k in ('cvd1', 'cvd2', 'cvd3', 'fc'))
+        h = relu(np.einsum('nmsc,c->nsm', z, w1[0]) + b1[0])  # cvd1 over the 121 features
+        h = relu(w2 @ h + b2[:, None])  # cvd2 over channels: [N, CF_second, M+1]
+        h = relu(w3 @ h.swapaxes(1, 2) + b3[:, None])  # cvd3 over the M+1 tokens: [N, (M+1)/2, CF_second]
+        return softmax(h.reshape(N, -1) @ wf.T + bf)
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import torch
+import torch.nn as nn
+from collections import OrderedDict
+
+from checkpoint import state_dict_hash
+
+# Cache of class probabilities in front of EEGformer.forward for windows that are scored again and again (review
+# tooling re-opening studies). An entry is keyed by the model identity (weights and config), the window content and
+# the window's batch position: the RTM/STM/TTM weights are per position, so one window scores differently at
+# different positions of a batch.
+
+
+def model_identity(model):  # digest of the weights and config: entries of another checkpoint never match
+    digest = hashlib.sha256(state_dict_hash(model.state_dict()).encode())
+    digest.update(repr(sorted(model.get_config().items())).encode())
+    return digest.hexdigest()[:32]
+
+
+def window_keys(x, identity, rows):  # one key per window of x [N, C, T]: blake2b of its bytes, the identity and its batch position
+    x = x.detach().cpu().contiguous()
+    header = f"{identity}:{tuple(x.shape[1:])}:{x.dtype}:".encode()
+    data = x.reshape(x.shape[0], -1).view(torch.uint8).numpy()
+    return [hashlib.blake2b(header + str(row).encode() + b':' + data[i].tobytes(), digest_size=16).hexdigest()
+            for i, row in enumerate(rows)]
+
+
+class PredictionCache:
+    """
+    LRU map of window key -> class probabilities, bounded to max_entries.
+
+    Args:
+        max_entries: entries kept in memory; the least recently used entry is evicted beyond that
+        path: optional .pt file the entries are loaded from (if it exists) and written to by save()
+    """
+    def __init__(self, max_entries=100000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None and os.path.exists(path):
+            saved = torch.load(path)
+            for key, probs in zip(saved['keys'], saved['probs']):
+                self.put(key, probs)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        probs = self.entries.get(key)
+        if probs is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return probs
+
+    def put(self, key, probs):
+        self.entries[key] = probs
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_rate=self.hits / lookups * 100 if lookups else 0.0)
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, path=None):  # write the entries (in LRU order) to path or the cache's own path
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path given and cache has no path")
+        if not self.entries:
+            probs = torch.empty(0)
+        else:
+            probs = torch.stack(list(self.entries.values()))
+        tmp = path + '.tmp'
+        torch.save(dict(keys=list(self.entries), probs=probs), tmp)
+        os.replace(tmp, path)  # a crash while saving leaves the previous file intact
+        return path
+
+
+class CachedEEGformer(nn.Module):
+    """
+    EEGformer whose forward looks every window up in a PredictionCache first; only the misses run through the
+    model (forward_heads at their own batch positions), so hits skip the model entirely and the outputs equal the
+    uncached forward.
+
+    The model identity is computed once here; call refresh() after changing the weights (fine-tuning, load_state_dict).
+    """
+    def __init__(self, model, cache=None):
+        super(CachedEEGformer, self).__init__()
+        self.model = model
+        self.cache = cache if cache is not None else PredictionCache()
+        self.identity = model_identity(model)
+
+    def refresh(self):
+        self.identity = model_identity(self.model)
+        return self
+
+    def forward(self, x, rows=None):  # x [N, C, T] -> [N, num_cls]; rows: batch positions of the windows (default 0..N-1)
+        rows = torch.arange(x.shape[0], device=x.device) if rows is None else rows
+        keys = window_keys(x, self.identity, (rows % self.model.outshape1.shape[0]).tolist())
+        cached = [self.cache.get(key) for key in keys]
+        miss = [i for i, probs in enumerate(cached) if probs is None]
+        if miss:
+            idx = torch.tensor(miss, device=x.device)
+            with torch.no_grad():
+                computed = self.model.forward_heads(x.index_select(0, idx), -1, rows[idx])
+            for i, probs in zip(miss, computed):
+                cached[i] = probs.detach().cpu()
+                self.cache.put(keys[i], cached[i])
+        return torch.stack(cached).to(x.device)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,93 @@
+import torch
+
+from models import LowRankLinear, TemporalTFB
+
+
+def _out_rows(linear):  # weight whose rows are the output units: nn.Linear.weight, or LowRankLinear.up.weight
+    return linear.up.weight if isinstance(linear, LowRankLinear) else linear.weight
+
+
+def _in_cols(linear):  # weight whose columns are the input units: nn.Linear.weight, or LowRankLinear.down.weight
+    return linear.down.weight if isinstance(linear, LowRankLinear) else linear.weight
+
+
+def head_scores(tfb):
+    """
+    Magnitude importance of every attention head of a GenericTFB/TemporalTFB: the L1 norm of its Wqkv slice
+    times the L1 norm of the Wo entries its features feed (GenericTFB: the per-feature scale Wo.sum(1),
+    TemporalTFB: the Wo columns reading them).
+    """
+    with torch.no_grad():
+        qkv = tfb.Wqkv.abs().sum((0, 2, 3))
+        if not isinstance(tfb, TemporalTFB):
+            out = tfb.Wo.sum(1).abs()
+        elif tfb.rank is None:
+            out = tfb.Wo.abs().sum(0)
+        else:
+            out = (tfb.Wo_u @ tfb.Wo_v).abs().sum(0)
+        return (qkv * out.reshape(tfb.hA, tfb.Dh).sum(1)).float()
+
+
+def hidden_scores(mlp):
+    """Magnitude importance of every Mlp hidden unit: L1 norm of its fc1 row times L1 norm of its fc2 column."""
+    with torch.no_grad():
+        return (_out_rows(mlp.fc1).abs().sum(1) * _in_cols(mlp.fc2).abs().sum(0)).float()
+
+
+def _top(scores, keep):  # indices of the keep largest scores, in their original order
+    return scores.argsort(descending=True)[:keep].sort().values
+
+
+def _pruned_block(tfb, prefix, heads, units):  # state dict entries of tfb restricted to the kept heads / hidden units
+    state = {}
+    features = (heads[:, None] * tfb.Dh + torch.arange(tfb.Dh, device=heads.device)).reshape(-1)
+    state[prefix + 'Wqkv'] = tfb.Wqkv.detach()[:, heads]
+    if not isinstance(tfb, TemporalTFB):
+        state[prefix + 'Wo'] = tfb.Wo.detach()[features]
+    elif tfb.rank is None:
+        state[prefix + 'Wo'] = tfb.Wo.detach()[:, features]
+    else:
+        state[prefix + 'Wo_u'] = tfb.Wo_u.detach()
+        state[prefix + 'Wo_v'] = tfb.Wo_v.detach()[:, features]
+
+    fc1, fc2 = tfb.mlp.fc1, tfb.mlp.fc2
+    fc1_out = 'mlp.fc1.up.' if isinstance(fc1, LowRankLinear) else 'mlp.fc1.'
+    fc2_in = 'mlp.fc2.down.' if isinstance(fc2, LowRankLinear) else 'mlp.fc2.'
+    state[prefix + fc1_out + 'weight'] = _out_rows(fc1).detach()[units]
+    state[prefix + fc1_out + 'bias'] = (fc1.up.bias if isinstance(fc1, LowRankLinear) else fc1.bias).detach()[units]
+    state[prefix + fc2_in + 'weight'] = _in_cols(fc2).detach()[:, units]
+    return state
+
+
+def prune_eegformer(model, head_ratio=0.25, hidden_ratio=0.25):
+    """
+    Structurally pruned copy of a trained EEGformer: in every RTM/STM/TTM block the lowest-scoring attention
+    heads (head_scores) and Mlp hidden units (hidden_scores) are removed and the weights are physically
+    sliced, so the result is smaller and faster without sparse kernels.
+
+    Args:
+        model: EEGformer, possibly already pruned (head indices stay those of the unpruned model)
+        head_ratio: fraction of each block's heads to remove (at least one head is kept)
+        hidden_ratio: fraction of each block's Mlp hidden units to remove (at least one unit is kept)
+
+    Returns:
+        EEGformer with the pruned config (get_config()['pruned']) and the surviving trained weights; it can be
+        fine-tuned, saved and rebuilt like any EEGformer. The source model is not modified.
+    """
+    if model.share_blocks is not None:
+        raise ValueError(f"pruning needs independent blocks, the model shares them (share_blocks={model.share_blocks!r})")
+    state = model.state_dict()
+    pruned = {}
+    for name in ('rtm', 'stm', 'ttm'):
+        pruned[name] = []
+        for k, tfb in enumerate(getattr(model, name).tfb):
+            heads = _top(head_scores(tfb), max(1, round(tfb.hA * (1 - head_ratio))))
+            units = _top(hidden_scores(tfb.mlp), max(1, round(_out_rows(tfb.mlp.fc1).shape[0] * (1 - hidden_ratio))))
+            state.update(_pruned_block(tfb, f'{name}.tfb.{k}.', heads.to(tfb.Wqkv.device), units.to(tfb.Wqkv.device)))
+            original = tfb.heads if tfb.heads is not None else list(range(tfb.hA))
+            pruned[name].append(dict(heads=[original[h] for h in heads.tolist()], hidden=len(units)))
+
+    small = model.rebuild(pruned=pruned).train(model.training)
+    state.update({k: v for k, v in small.state_dict().items() if k.endswith('head_features')})
+    small.load_state_dict(state)
+    return small
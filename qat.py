@@ -0,0 +1,139 @@
+import copy
+import torch
+import torch.nn as nn
+import torch.ao.nn.qat as nnqat
+import torch.ao.nn.quantized.dynamic as nnqd
+from torch.ao.quantization import convert, default_dynamic_qat_qconfig, default_dynamic_qconfig
+
+from models import CNNdecoder, LowRankLinear, device
+from checkpoint import load_checkpoint, load_state_dict_file
+from quantization import LinearGenericTFB, LinearTemporalTFB, linearize_projections
+
+_QAT_MAPPING = {nn.Linear: nnqat.Linear, nn.Conv1d: nnqat.Conv1d}
+_INT8_MAPPING = {nn.Linear: nnqd.Linear, nn.Conv1d: nnqd.Conv1d}
+
+
+class FakeQuantInput(nn.Module):  # fake-quantizes the input of a QAT layer the way the int8 dynamic kernel quantizes it
+    def __init__(self, module, fake_quant):
+        super(FakeQuantInput, self).__init__()
+        self.fake_quant = fake_quant
+        self.module = module
+
+    def forward(self, x):
+        return self.module(self.fake_quant(x))
+
+
+class UnbatchedConv1d(nn.Module):  # CNNdecoder feeds cvd2/cvd3 unbatched [C, L] inputs, quantized convs need [N, C, L]
+    def __init__(self, conv):
+        super(UnbatchedConv1d, self).__init__()
+        self.conv = conv
+
+    def forward(self, x):
+        if x.dim() == 2:
+            return self.conv(x.unsqueeze(0)).squeeze(0)
+        return self.conv(x)
+
+
+def _linear_targets(parent, name):  # parent.name, or both factors if it is a LowRankLinear
+    layer = getattr(parent, name)
+    if isinstance(layer, LowRankLinear):
+        return [(layer, 'down'), (layer, 'up')]
+    return [(parent, name)]
+
+
+def _qat_targets(model):  # (parent, attribute) of the Mlp, Wqkv/Wo and CNNdecoder layers, each once even when shared across blocks
+    targets = []
+    for module in model.modules():
+        if isinstance(module, (LinearGenericTFB, LinearTemporalTFB)):
+            targets.append((module, 'qkv'))
+            if isinstance(module, LinearTemporalTFB):  # the GenericTFB Wo is a per-feature scale, not a matmul
+                targets += _linear_targets(module, 'wo')
+            targets += _linear_targets(module.mlp, 'fc1') + _linear_targets(module.mlp, 'fc2')
+        elif isinstance(module, CNNdecoder):
+            targets += [(module, name) for name in ('cvd1', 'cvd2', 'cvd3', 'fc')]
+    unique, seen = [], set()
+    for parent, name in targets:
+        if (id(parent), name) not in seen:
+            seen.add((id(parent), name))
+            unique.append((parent, name))
+    return unique
+
+
+def prepare_qat_eegformer(model, checkpoint=None):
+    """
+    Turn an fp32 EEGformer into a quantization-aware training model (in place).
+
+    Args:
+        model: EEGformer from models.py
+        checkpoint: optional fp32 state dict (.pth) loaded before the observers are inserted
+
+    Returns:
+        the model, where every Mlp.fc1/fc2, Wqkv/Wo projection and CNNdecoder conv/fc has a per-tensor
+        int8 weight fake-quant and a dynamic (current range) uint8 fake-quant on its input
+    """
+    if checkpoint is not None:
+        load_checkpoint(model, checkpoint)
+    linearize_projections(model)
+    converted = {}  # a projection shared across blocks gets one QAT layer
+    for parent, name in _qat_targets(model):
+        layer = getattr(parent, name)
+        if id(layer) not in converted:
+            layer.qconfig = default_dynamic_qat_qconfig
+            qat_layer = _QAT_MAPPING[type(layer)].from_float(layer)
+            converted[id(layer)] = FakeQuantInput(qat_layer, default_dynamic_qat_qconfig.activation())
+        setattr(parent, name, converted[id(layer)])
+    return model.train()
+
+
+def _to_int8(model):  # linearized fp32 model -> int8 dynamic quantized model (in place)
+    for parent, name in _qat_targets(model):
+        layer = getattr(parent, name)
+        layer.qconfig = default_dynamic_qconfig
+        if isinstance(layer, nn.Conv1d):
+            setattr(parent, name, UnbatchedConv1d(layer))
+    return convert(model, mapping=_INT8_MAPPING, inplace=True)
+
+
+def export_int8(model, path=None):
+    """
+    Int8 model from a QAT fine-tuned EEGformer; the fake-quant observers are dropped and the trained
+    layers are converted to dynamic quantized kernels. The state dict is saved to path if given.
+    """
+    qmodel = copy.deepcopy(model).cpu().eval()
+    for module in list(qmodel.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, FakeQuantInput):
+                setattr(module, name, child.module.to_float())
+    qmodel = _to_int8(qmodel)
+    if path is not None:
+        torch.save(qmodel.state_dict(), path)
+    return qmodel
+
+
+def load_int8(model, path):
+    """Rebuild an exported int8 model from a freshly constructed fp32 EEGformer of the same config."""
+    qmodel = _to_int8(linearize_projections(copy.deepcopy(model).cpu().eval()))
+    qmodel.load_state_dict(load_state_dict_file(path))
+    return qmodel
+
+
+def finetune_qat(model, train_loader, num_epochs=1, lr=1e-5, batch_size=None):
+    """Fine-tune a prepared QAT model with the notebooks' loss/optimizer; returns the mean loss per epoch."""
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    model.train()
+    losses = []
+    for epoch_idx in range(num_epochs):
+        total_loss, num_batches = 0.0, 0
+        for inputs, labels in train_loader:
+            if batch_size is not None and inputs.shape[0] != batch_size:
+                continue
+            inputs, labels = inputs.to(device), labels.to(device)
+            loss = criterion(model(inputs), labels)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            num_batches += 1
+        losses.append(total_loss / max(num_batches, 1))
+    return losses
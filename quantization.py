@@ -0,0 +1,113 @@
+import copy
+import torch
+import torch.nn as nn
+
+from models import GenericTFB, LowRankLinear, TemporalTFB
+
+
+def _linear_from(weight):  # nn.Linear (no bias) holding an existing [out, in] weight
+    linear = nn.Linear(weight.shape[1], weight.shape[0], bias=False, dtype=weight.dtype, device=weight.device)
+    with torch.no_grad():
+        linear.weight.copy_(weight)
+    return linear
+
+
+def _low_rank_from(up, down):  # LowRankLinear (no bias) holding existing up [out, r] / down [r, in] factors
+    linear = LowRankLinear(down.shape[1], up.shape[0], down.shape[0], bias=False, dtype=up.dtype).to(up.device)
+    with torch.no_grad():
+        linear.up.weight.copy_(up)
+        linear.down.weight.copy_(down)
+    return linear
+
+
+class LinearGenericTFB(GenericTFB):  # GenericTFB with the raw Wqkv/Wo einsums expressed through nn.Linear
+    def __init__(self, tfb):
+        nn.Module.__init__(self)
+        self.M_size1 = tfb.M_size1
+        self.dtype = tfb.dtype
+        self.heads = tfb.heads
+        self.hA = tfb.hA
+        self.Dh = tfb.Dh
+        self.register_buffer('head_features', tfb.head_features)
+
+        self.qkv = _linear_from(tfb.Wqkv.detach().reshape(3 * self.hA * self.Dh, self.M_size1))
+        # 'nm,bijn -> bijn' only ever uses the row sums of Wo, so the projection is a per-feature scale
+        self.register_buffer('wo_scale', tfb.Wo.detach().sum(1))
+
+        self.lnorm = tfb.lnorm
+        self.lnormz = tfb.lnormz
+        self.mlp = tfb.mlp
+
+    def project_qkv(self, z):  # [B, S, C+1, D] -> [B, 3, S, C+1, hA, Dh]
+        qkv = self.qkv(z).reshape(z.shape[0], z.shape[1], z.shape[2], 3, self.hA, self.Dh)
+        return qkv.permute(0, 3, 1, 2, 4, 5)
+
+    def project_out(self, imv):
+        return imv * self.wo_scale
+
+
+class LinearTemporalTFB(TemporalTFB):  # TemporalTFB with the raw Wqkv/Wo einsums expressed through nn.Linear
+    def __init__(self, tfb):
+        nn.Module.__init__(self)
+        self.avgf = tfb.avgf
+        self.M_size1 = tfb.M_size1
+        self.dtype = tfb.dtype
+        self.heads = tfb.heads
+        self.hA = tfb.hA
+        self.Dh = tfb.Dh
+
+        self.qkv = _linear_from(tfb.Wqkv.detach().reshape(3 * self.hA * self.Dh, self.M_size1))
+        if tfb.rank is None:
+            self.wo = _linear_from(tfb.Wo.detach())  # 'nm,bim -> bin' is F.linear(imv, Wo)
+        else:
+            self.wo = _low_rank_from(tfb.Wo_u.detach(), tfb.Wo_v.detach())
+
+        self.lnorm = tfb.lnorm
+        self.lnormz = tfb.lnormz
+        self.mlp = tfb.mlp
+
+    def project_qkv(self, z):  # [B, M+1, D] -> [B, 3, M+1, hA, Dh]
+        qkv = self.qkv(z).reshape(z.shape[0], z.shape[1], 3, self.hA, self.Dh)
+        return qkv.permute(0, 2, 1, 3, 4)
+
+    def project_out(self, imv):
+        return self.wo(imv)
+
+
+def linearize_projections(model):
+    """
+    Replace every GenericTFB/TemporalTFB of the model (in place) by an equivalent block whose
+    Wqkv/Wo projections are nn.Linear modules, which torch's quantization passes can see.
+    Blocks and projections shared across blocks (share_blocks) stay shared.
+    """
+    blocks, projections = {}, {}
+    for module in model.modules():
+        if isinstance(module, nn.ModuleList):
+            for i, tfb in enumerate(module):
+                if id(tfb) in blocks:
+                    module[i] = blocks[id(tfb)]
+                    continue
+                if type(tfb) is GenericTFB:
+                    linear = LinearGenericTFB(tfb)
+                elif type(tfb) is TemporalTFB:
+                    linear = LinearTemporalTFB(tfb)
+                else:
+                    continue
+                linear.qkv = projections.setdefault(id(tfb.Wqkv), linear.qkv)
+                if isinstance(linear, LinearTemporalTFB):
+                    linear.wo = projections.setdefault(id(tfb.Wo if tfb.rank is None else tfb.Wo_u), linear.wo)
+                module[i] = blocks[id(tfb)] = linear
+    return model
+
+
+def quantize_dynamic_eegformer(model, dtype=torch.qint8):
+    """
+    Int8 dynamic quantized copy of an EEGformer for CPU inference.
+
+    Mlp.fc1/fc2, the Wqkv/Wo projections of every transformer block and the decoder fc run as
+    dynamic quantized linear kernels (int8 weights, activations quantized on the fly). The
+    GenericTFB Wo reduces to a per-feature scale and stays fp32. The source model is not modified.
+    """
+    qmodel = copy.deepcopy(model).cpu().eval()
+    linearize_projections(qmodel)
+    return torch.ao.quantization.quantize_dynamic(qmodel, {nn.Linear}, dtype=dtype, inplace=True)
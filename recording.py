@@ -0,0 +1,211 @@
+import json
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+
+from models import device
+from checkpoint import state_dict_hash
+
+# Recording-level classification (30-60 min recordings) on top of the window-level EEGformer: the backbone runs
+# once over every window of a recording and its per-window embeddings are cached to disk; a small sequence model
+# (RecordingClassifier) over the cached embeddings is then trained and re-scored without running the backbone again.
+
+EMBEDDINGS = ('ttm_cls', 'decoder')  # TTM CLS token [(C+1)*121], or the CNNdecoder fc inputs [(M+1)//2 * CF_second]
+
+
+def sliding_windows(recording, window, hop):  # [C, N] recording -> [W, C, window] views of its windows, one every hop samples
+    recording = torch.as_tensor(recording)
+    if recording.shape[-1] < window:
+        raise ValueError(f"recording of {recording.shape[-1]} samples is shorter than one window ({window})")
+    return recording.unfold(-1, window, hop).transpose(0, 1)
+
+
+def sliding_odcm(model, recording, window, hop, first=0, count=None):
+    """
+    ODCM outputs [count, C, 120, S] of windows first .. first+count-1 of a recording [C, N], from one ODCM pass
+    over the span they cover. The ODCM convs are valid convolutions, so slicing their output over the span gives
+    the values of running each window separately, without recomputing the overlaps. They agree up to float
+    rounding (about 1e-7 absolute): the conv kernels may sum in another order for the longer input.
+    """
+    recording = torch.as_tensor(recording)
+    count = (recording.shape[-1] - window) // hop + 1 - first if count is None else count
+    span = recording[..., first * hop:first * hop + (count - 1) * hop + window]
+    out = model.odcm.convs(span[None].to(device, dtype=model.dtype))  # [1, C, 120, span - 3(k-1)]
+    steps = window - 3 * (model.kernel_size - 1)
+    out = out[0].unfold(-1, steps, hop).permute(2, 0, 1, 3)  # window j is out[..., j*hop:j*hop + steps]
+    return model.odcm.pool(out)
+
+
+def window_embeddings(model, x, kind='ttm_cls', rows=None, features=None):
+    """
+    Embeddings and class probabilities of windows x [N, C, T] from one backbone pass.
+
+    features: ODCM outputs of the windows (sliding_odcm) used instead of running ODCM on x (x may then be None)
+
+    Returns:
+        (embeddings [N, E], probabilities [N, num_cls])
+    """
+    features = model.odcm(x) if features is None else features
+    out = model.ttm(model.stm(model.rtm(features, rows), rows), rows)  # [N, M+1, C+1, 121]
+    if kind == 'decoder':
+        embedding = model.cnndecoder.features(out)
+    elif kind == 'ttm_cls':
+        embedding = out[:, 0].reshape(out.shape[0], -1)
+    else:
+        raise ValueError(f"kind must be one of {EMBEDDINGS}, got {kind!r}")
+    return embedding, model.decode(out)
+
+
+def embed_recording(model, recording, window, hop, kind='ttm_cls', chunk_size=None, shared_odcm=True):
+    """
+    Run the backbone over all windows of one recording in chunks of chunk_size windows.
+
+    Window j uses batch position j % B of the per-position RTM/STM/TTM weights whatever the chunking
+    (chunk_size None: the batch size B the model was built for). With shared_odcm, ODCM runs once over the
+    span of each chunk (sliding_odcm) instead of once per window.
+
+    Returns:
+        (embeddings [W, E], window probabilities [W, num_cls]) as float32 on the CPU
+    """
+    model = model.eval()
+    windows = sliding_windows(recording, window, hop)
+    chunk_size = chunk_size or model.outshape1.shape[0]
+    rows = torch.arange(windows.shape[0], device=device)
+    embeddings, probs = [], []
+    with torch.no_grad():
+        for i in range(0, windows.shape[0], chunk_size):
+            count = min(chunk_size, windows.shape[0] - i)
+            features = sliding_odcm(model, recording, window, hop, i, count) if shared_odcm else None
+            inputs = windows[i:i + count].to(device, dtype=model.dtype) if features is None else None  # unused with shared ODCM features
+            e, p = window_embeddings(model, inputs, kind, rows[i:i + count], features)
+            embeddings.append(e.float().cpu())
+            probs.append(p.float().cpu())
+    return torch.cat(embeddings), torch.cat(probs)
+
+
+def predict_sliding(model, recording, hop, chunk_size=None, shared_odcm=True):
+    """Window probabilities [W, num_cls] of a recording [C, N] scanned with the model's window length and the given hop (in samples)."""
+    return embed_recording(model, recording, model.samples, hop, chunk_size=chunk_size, shared_odcm=shared_odcm)[1]
+
+
+class RecordingEmbeddings(Dataset):
+    """Cached window embeddings written by build_recording_cache; item i is (embeddings [W_i, E], window probabilities [W_i, num_cls], label)."""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.ids = self.meta['ids']
+        self.labels = self.meta['labels']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        data = np.load(os.path.join(self.path, f'{self.ids[idx]}.npz'))
+        return torch.from_numpy(data['embeddings']), torch.from_numpy(data['probs']), torch.tensor(self.labels[idx], dtype=torch.long)
+
+
+def build_recording_cache(model, recordings, cache_dir, window, hop, kind='ttm_cls', chunk_size=None, key=None):
+    """
+    Embed every window of every recording once and store the embeddings, or reuse an earlier run.
+
+    Args:
+        model: trained window-level EEGformer
+        recordings: iterable of (recording id, recording [C, N], label)
+        cache_dir: directory holding the caches, one subdirectory per backbone hash, embedding kind and windowing
+        window, hop: window length T (the model's input length) and hop in samples
+        kind: 'ttm_cls' or 'decoder', see EMBEDDINGS
+        key: dataset name mixed into the cache name when one checkpoint is cached for several datasets
+
+    Returns:
+        RecordingEmbeddings
+    """
+    digest = state_dict_hash(model.state_dict(), [name + '.' for name in ('odcm', 'rtm', 'stm', 'ttm', 'cnndecoder')])
+    path = os.path.join(cache_dir, f"recordings-{kind}-{window}-{hop}-{digest[:16]}" + (f"-{key}" if key else ''))
+    if os.path.exists(os.path.join(path, 'meta.json')):  # meta.json is written last, so its presence marks a complete cache
+        return RecordingEmbeddings(path)
+    os.makedirs(path, exist_ok=True)
+    ids, labels = [], []
+    for rid, recording, label in recordings:
+        embeddings, probs = embed_recording(model, recording, window, hop, kind, chunk_size)
+        np.savez(os.path.join(path, f'{rid}.npz'), embeddings=embeddings.numpy(), probs=probs.numpy())
+        ids.append(str(rid))
+        labels.append(int(label))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(dict(kind=kind, window=window, hop=hop, ids=ids, labels=labels), f)
+    return RecordingEmbeddings(path)
+
+
+def pad_recordings(items):
+    """DataLoader collate_fn: pads (embeddings, probs, label) items to the longest recording; returns (embeddings, mask, labels)."""
+    lengths = [e.shape[0] for e, _, _ in items]
+    embeddings = torch.zeros(len(items), max(lengths), items[0][0].shape[1])
+    for i, (e, _, _) in enumerate(items):
+        embeddings[i, :e.shape[0]] = e
+    mask = torch.arange(max(lengths))[None] < torch.tensor(lengths)[:, None]
+    return embeddings, mask, torch.stack([label for _, _, label in items])
+
+
+class RecordingClassifier(nn.Module):
+    """
+    Sequence model over the window embeddings of a recording: projection, a bidirectional GRU over the windows,
+    attention pooling over the valid windows and a linear classifier. forward returns logits (trained with
+    nn.CrossEntropyLoss); predict applies the softmax.
+    """
+    def __init__(self, embedding_size, num_cls, hidden=64, dropout=0.1):
+        super(RecordingClassifier, self).__init__()
+        self.norm = nn.LayerNorm(embedding_size)
+        self.proj = nn.Linear(embedding_size, hidden)
+        self.gru = nn.GRU(hidden, hidden, batch_first=True, bidirectional=True)
+        self.attn = nn.Linear(2 * hidden, 1)
+        self.drop = nn.Dropout(dropout)
+        self.fc = nn.Linear(2 * hidden, num_cls)
+
+    def forward(self, embeddings, mask=None):  # [R, W, E] (+ [R, W] bool of valid windows) -> [R, num_cls] logits
+        h = self.drop(F.gelu(self.proj(self.norm(embeddings))))
+        if mask is None:
+            h, _ = self.gru(h)
+        else:  # packed, so the backward direction starts at each recording's last window instead of the padding
+            packed = nn.utils.rnn.pack_padded_sequence(h, mask.sum(1).cpu(), batch_first=True, enforce_sorted=False)
+            h, _ = nn.utils.rnn.pad_packed_sequence(self.gru(packed)[0], batch_first=True, total_length=embeddings.shape[1])
+        scores = self.attn(h).squeeze(-1)
+        if mask is not None:
+            scores = scores.masked_fill(~mask, float('-inf'))
+        pooled = (torch.softmax(scores, dim=1)[..., None] * h).sum(1)
+        return self.fc(self.drop(pooled))
+
+    def predict(self, embeddings, mask=None):  # class probabilities [R, num_cls]
+        return torch.softmax(self(embeddings, mask), dim=-1)
+
+
+def train_recording_classifier(classifier, dataset, num_epochs=10, lr=1e-3, batch_size=8):
+    """Train the aggregator on cached embeddings (cross-entropy on its logits, Adam); returns the mean loss per epoch."""
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(classifier.parameters(), lr=lr)
+    classifier.train()
+    losses = []
+    for epoch_idx in range(num_epochs):
+        total_loss, num_batches = 0.0, 0
+        for embeddings, mask, labels in DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=pad_recordings):
+            loss = criterion(classifier(embeddings.to(device), mask.to(device)), labels.to(device))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            num_batches += 1
+        losses.append(total_loss / max(num_batches, 1))
+    return losses
+
+
+def score_recordings(classifier, dataset, batch_size=8):
+    """Recording-level probabilities [R, num_cls] and labels [R] of cached recordings (no backbone pass)."""
+    classifier.eval()
+    probs, labels = [], []
+    with torch.no_grad():
+        for embeddings, mask, label in DataLoader(dataset, batch_size=batch_size, collate_fn=pad_recordings):
+            probs.append(classifier.predict(embeddings.to(device), mask.to(device)).cpu())
+            labels.append(label)
+    return torch.cat(probs), torch.cat(labels)
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import EEGformer, device  # noqa: E402
+
+# Small EEGformer for fast parity tests: S = 51 - 27 = 24 time steps, 2 RTM/STM heads, 2 TTM segments
+SMALL_CONFIG = dict(num_cls=2, input_channels=1, kernel_size=10, num_blocks=1, num_heads_RTM=2, num_heads_STM=2,
+                    num_heads_TTM=11, num_submatrices=2, CF_second=2)
+SMALL_BATCH = 4
+SMALL_SAMPLES = 51
+
+
+def build_small(batch_size=SMALL_BATCH, samples=SMALL_SAMPLES, **overrides):
+    torch.manual_seed(0)
+    config = dict(SMALL_CONFIG, **overrides)
+    return EEGformer(input=torch.randn(batch_size, samples, config['input_channels']), **config).to(device).eval()
+
+
+@pytest.fixture
+def small_model():
+    return build_small()
+
+
+def randomize_decoder(model, std=0.5):  # the fresh CNNdecoder's ReLUs are all inactive: outputs would not depend on the input
+    with torch.no_grad():
+        for p in model.cnndecoder.parameters():
+            p.normal_(0, std)
+    return model
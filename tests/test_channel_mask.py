@@ -0,0 +1,34 @@
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from models import device
+
+ATOL = 1e-6
+
+
+def masked_batch(channels=3, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    x = torch.randn(SMALL_BATCH, channels, SMALL_SAMPLES, generator=gen).to(device)
+    mask = torch.ones(SMALL_BATCH, channels, dtype=torch.bool, device=device)
+    mask[0, 2:] = False
+    mask[2, 1] = False
+    return x, mask
+
+
+def test_all_present_mask_matches_unmasked_forward():
+    model = build_small(input_channels=3)
+    x, _ = masked_batch()
+    with torch.no_grad():
+        torch.testing.assert_close(model(x, channel_mask=torch.ones(x.shape[:2], dtype=torch.bool, device=device)), model(x), atol=ATOL, rtol=0)
+
+
+def test_padded_channel_contents_do_not_matter():
+    model = build_small(input_channels=3)
+    x, mask = masked_batch()
+    noisy = x.clone()
+    noisy[~mask] = 100 * torch.randn(int((~mask).sum()), SMALL_SAMPLES, device=device)
+    with torch.no_grad():
+        expected = model(x * mask[:, :, None], channel_mask=mask)
+        torch.testing.assert_close(model(noisy, channel_mask=mask), expected, atol=ATOL, rtol=0)
+        model.set_traceable(True)
+        torch.testing.assert_close(model(noisy, channel_mask=mask), expected, atol=ATOL, rtol=0)
@@ -0,0 +1,32 @@
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES
+from models import device
+
+ATOL = 1e-6
+
+
+def per_channel_loop(model, x):  # reference: one forward per channel
+    with torch.no_grad():
+        return torch.stack([model(x[:, c:c + 1]) for c in range(x.shape[1])], 1)
+
+
+def test_predict_channels_matches_per_channel_loop(small_model):
+    torch.manual_seed(1)
+    for channels in (1, 3, 5):
+        x = torch.randn(SMALL_BATCH, channels, SMALL_SAMPLES, device=device)
+        expected = per_channel_loop(small_model, x)
+        with torch.no_grad():
+            probs, window = small_model.predict_channels(x)
+        torch.testing.assert_close(probs, expected, atol=ATOL, rtol=0)
+        torch.testing.assert_close(window, expected.mean(1), atol=ATOL, rtol=0)
+
+
+def test_predict_channels_independent_of_chunking(small_model):
+    torch.manual_seed(2)
+    x = torch.randn(SMALL_BATCH, 3, SMALL_SAMPLES, device=device)
+    with torch.no_grad():
+        reference, _ = small_model.predict_channels(x)
+        for chunk_size in (1, 5, 12):
+            probs, _ = small_model.predict_channels(x, chunk_size=chunk_size)
+            torch.testing.assert_close(probs, reference, atol=ATOL, rtol=0)
@@ -0,0 +1,32 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from distill import build_student, cache_soft_targets, distill
+
+
+def dataset(n=2 * SMALL_BATCH):
+    gen = torch.Generator().manual_seed(0)
+    return TensorDataset(torch.randn(n, 1, SMALL_SAMPLES, generator=gen), torch.randint(0, 2, (n,), generator=gen))
+
+
+def test_targets_follow_an_ordered_loader(tmp_path):
+    teacher = build_small()
+    loader = DataLoader(dataset(), batch_size=SMALL_BATCH)
+    targets = cache_soft_targets(teacher, loader, str(tmp_path / 'targets.pt'), SMALL_BATCH)
+    with torch.no_grad():
+        expected = torch.cat([teacher(x) for x, _ in loader])
+    torch.testing.assert_close(targets['probs'], expected)
+    losses = distill(build_student(teacher, num_heads_RTM=2, num_heads_STM=2, num_submatrices=2), loader, targets)
+    assert len(losses) == 1
+
+
+def test_shuffled_loader_is_rejected(tmp_path):
+    teacher = build_small()
+    loader = DataLoader(dataset(), batch_size=SMALL_BATCH, shuffle=True)
+    with pytest.raises(ValueError, match='shuffle=False'):
+        cache_soft_targets(teacher, loader, str(tmp_path / 'targets.pt'), SMALL_BATCH)
+    targets = cache_soft_targets(teacher, DataLoader(dataset(), batch_size=SMALL_BATCH), str(tmp_path / 'targets.pt'), SMALL_BATCH)
+    with pytest.raises(ValueError, match='shuffle=False'):
+        distill(build_student(teacher, num_heads_RTM=2, num_heads_STM=2, num_submatrices=2), loader, targets)
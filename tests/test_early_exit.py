@@ -0,0 +1,58 @@
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from early_exit import add_exit_heads, exit_outputs, train_exit_heads
+from models import device
+
+ATOL = 1e-6
+
+
+def exiting_model():
+    return add_exit_heads(build_small()).eval()
+
+
+def batches(num_batches=2, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    return [(torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, generator=gen), torch.randint(0, 2, (SMALL_BATCH,), generator=gen))
+            for _ in range(num_batches)]
+
+
+def test_exit_outputs_match_forward_exits():
+    model = exiting_model()
+    x = batches()[0][0].to(device)
+    with torch.no_grad():
+        expected = model.forward_exits(x)[:2]
+    for logits, reference in zip(exit_outputs(model, x), expected):
+        torch.testing.assert_close(logits, reference, atol=ATOL, rtol=0)
+
+
+def test_training_heads_leaves_backbone_untouched():
+    model = exiting_model()
+    backbone = {k: v.clone() for k, v in model.state_dict().items() if not k.startswith('exits.')}
+    train_exit_heads(model, batches(), num_epochs=2)
+    for name, param in model.named_parameters():
+        if not name.startswith('exits.'):
+            assert param.grad is None, name
+    for name, value in model.state_dict().items():
+        if name in backbone:
+            assert torch.equal(value, backbone[name]), name
+
+
+def test_early_exit_matches_forward_for_samples_reaching_the_end():
+    model = exiting_model()
+    x = batches()[0][0].to(device)
+    with torch.no_grad():
+        expected = model(x)
+        probs, exit_index = model.predict_early_exit(x, threshold=1.01)  # no exit can reach the threshold
+        assert (exit_index == 2).all()
+        torch.testing.assert_close(probs, expected, atol=ATOL, rtol=0)
+        probs, exit_index = model.predict_early_exit(x, threshold=0.5)  # every sample leaves at the RTM exit
+        assert (exit_index == 0).all()
+        torch.testing.assert_close(probs, torch.softmax(exit_outputs(model, x)[0], -1), atol=ATOL, rtol=0)
+
+
+def test_exit_heads_return_logits():
+    model = exiting_model()
+    x = batches()[0][0].to(device)
+    logits = exit_outputs(model, x)
+    assert all(not torch.allclose(out.sum(-1), torch.ones(SMALL_BATCH)) for out in logits)  # unnormalized, as nn.CrossEntropyLoss expects
@@ -0,0 +1,35 @@
+import copy
+
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from feature_cache import build_feature_cache, finetune_from_cache, prefix_forward
+from models import device
+
+
+def test_cached_step_matches_the_full_step(tmp_path):
+    model = build_small()
+    with torch.no_grad():  # the fresh decoder's ReLUs are all inactive: its output would not depend on the TTM output
+        for p in model.cnndecoder.parameters():
+            p.normal_(0, 0.1)
+    torch.manual_seed(1)
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES)
+    y = torch.tensor([0, 1, 1, 0])
+    dataset = torch.utils.data.TensorDataset(x, y)
+
+    full = copy.deepcopy(model)  # one step through the frozen prefix, samples at their own batch positions
+    trained = list(full.ttm.parameters()) + list(full.cnndecoder.parameters())
+    optimizer = torch.optim.Adam(trained, lr=1e-3)
+    with torch.no_grad():
+        features = prefix_forward(full, x.to(device), 'stm')
+    full.ttm.train(), full.cnndecoder.train()
+    loss = torch.nn.CrossEntropyLoss()(full.decode(full.ttm(features)), y.to(device))
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+    cache = build_feature_cache(model, dataset, str(tmp_path), 'stm', SMALL_BATCH, fp16=False)
+    cached_loss, = finetune_from_cache(model, cache, num_epochs=1, lr=1e-3, batch_size=SMALL_BATCH)  # one shuffled batch
+    assert abs(cached_loss - loss.item()) < 1e-6
+    for name, p in full.ttm.named_parameters():
+        torch.testing.assert_close(model.ttm.get_parameter(name), p, atol=1e-6, rtol=0)
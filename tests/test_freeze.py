@@ -0,0 +1,24 @@
+import pytest
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from freeze import freeze_for_inference
+from models import device
+
+ATOL = 1e-5
+
+
+def backbone(model, x):  # TTM output: the small model's decoder output barely depends on it
+    return model.ttm(model.stm(model.rtm(model.odcm(x))))
+
+
+@pytest.mark.parametrize('overrides', [{}, dict(ttm_rank=4), dict(num_blocks=2, share_blocks='all')])
+def test_frozen_model_matches_the_original(overrides):
+    model = build_small(**overrides)
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    with torch.no_grad():
+        expected, features = model(x), backbone(model, x)
+        frozen = freeze_for_inference(model)
+        torch.testing.assert_close(frozen(x), expected, atol=ATOL, rtol=0)
+        torch.testing.assert_close(backbone(frozen, x), features, atol=ATOL, rtol=0)
+        torch.testing.assert_close(model(x), expected, atol=0, rtol=0)  # the source model is not modified
@@ -0,0 +1,19 @@
+import pytest
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from lora import add_lora, remove_lora
+from models import device
+
+
+@pytest.mark.parametrize('share_blocks', [None, 'all'])
+def test_remove_lora_keeps_the_adapted_outputs(share_blocks):
+    model = add_lora(build_small(num_blocks=2, share_blocks=share_blocks), rank=2)
+    with torch.no_grad():
+        for name, p in model.named_parameters():
+            if name.endswith('.B'):
+                p.normal_(0, 0.05)  # non-zero adapters, so merging changes the weights
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    plain = remove_lora(model).eval()
+    with torch.no_grad():
+        torch.testing.assert_close(plain(x), model(x), atol=1e-5, rtol=0)
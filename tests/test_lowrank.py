@@ -0,0 +1,15 @@
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from lowrank import factorize_ttm
+from models import device
+
+
+def test_full_rank_factorization_matches_the_model():
+    model = build_small()
+    D = model.ttm.M_size1
+    low = factorize_ttm(model, D)  # rank D keeps every singular value: only float rounding separates the two
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    with torch.no_grad():
+        torch.testing.assert_close(low(x), model(x), atol=1e-4, rtol=0)
+    torch.testing.assert_close(low.ttm.weight_u @ low.ttm.weight_v, model.ttm.weight, atol=1e-4, rtol=0)
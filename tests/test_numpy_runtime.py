@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small, randomize_decoder
+from export import export_numpy
+from numpy_runtime import NumpyEEGformer
+
+ATOL = 1e-5
+
+
+@pytest.mark.parametrize('overrides', [{}, dict(ttm_rank=4), dict(num_blocks=2, share_blocks='all')])
+def test_numpy_runtime_matches_torch(tmp_path, overrides):
+    model = randomize_decoder(build_small(**overrides))
+    runtime = NumpyEEGformer(export_numpy(model, str(tmp_path / 'model.npz')))
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES)
+    with torch.no_grad():
+        expected = model(x).cpu().numpy()
+    np.testing.assert_allclose(runtime(x.numpy()), expected, atol=ATOL, rtol=0)
+    np.testing.assert_allclose(runtime(x[:2].numpy()), expected[:2], atol=ATOL, rtol=0)  # sample i at batch position i
@@ -0,0 +1,19 @@
+import pytest
+import torch
+
+from conftest import SMALL_BATCH, build_small, randomize_decoder
+from export import check_onnx_parity, export_onnx
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+ATOL = 1e-5
+
+
+@pytest.mark.parametrize('overrides', [{}, dict(ttm_rank=4)])
+def test_onnx_matches_torch(tmp_path, overrides):
+    model = randomize_decoder(build_small(**overrides))
+    path = export_onnx(model, str(tmp_path / 'model.onnx'))
+    torch.manual_seed(1)
+    diffs = check_onnx_parity(model, path, batch_sizes=(1, SMALL_BATCH, 2 * SMALL_BATCH + 1), atol=ATOL)
+    assert set(diffs) == {1, SMALL_BATCH, 2 * SMALL_BATCH + 1}
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES
+from models import device
+from prediction_cache import CachedEEGformer, PredictionCache
+
+ATOL = 0  # hits return the stored forward output, misses run the same model: exact
+
+
+def test_cached_forward_matches_plain_forward(small_model):
+    torch.manual_seed(0)
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    cached = CachedEEGformer(small_model, PredictionCache())
+    with torch.no_grad():
+        expected = small_model(x)
+        torch.testing.assert_close(cached(x), expected, atol=ATOL, rtol=0)  # all misses
+        y = x.clone()
+        y[SMALL_BATCH // 2:] = torch.randn(SMALL_BATCH - SMALL_BATCH // 2, 1, SMALL_SAMPLES, device=device)
+        torch.testing.assert_close(cached(y), small_model(y), atol=ATOL, rtol=0)  # half hits
+    assert cached.stats()['hits'] == SMALL_BATCH // 2
+    assert cached.stats()['misses'] == SMALL_BATCH + SMALL_BATCH - SMALL_BATCH // 2
+
+
+def test_window_at_another_position_misses(small_model):
+    torch.manual_seed(1)
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    cached = CachedEEGformer(small_model, PredictionCache())
+    with torch.no_grad():
+        cached(x)
+        # reversed, every window lands on another batch position
+        torch.testing.assert_close(cached(x.flip(0)), small_model(x.flip(0)), atol=ATOL, rtol=0)
+    assert cached.stats()['hits'] == 0
+
+
+def test_lru_eviction():
+    cache = PredictionCache(max_entries=2)
+    for key in 'abc':
+        cache.put(key, torch.zeros(2))
+    assert cache.get('a') is None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_save_and_reload(tmp_path, small_model):
+    path = str(tmp_path / 'cache.pt')
+    x = torch.randn(SMALL_BATCH, 1, SMALL_SAMPLES, device=device)
+    cached = CachedEEGformer(small_model, PredictionCache(path=path))
+    with torch.no_grad():
+        first = cached(x)
+    cached.cache.save()
+    assert os.path.exists(path)
+    reloaded = CachedEEGformer(small_model, PredictionCache(path=path))
+    with torch.no_grad():
+        torch.testing.assert_close(reloaded(x), first, atol=ATOL, rtol=0)
+    assert reloaded.stats()['hit_rate'] == 100.0
+
+
+def test_save_without_path_raises():
+    with pytest.raises(ValueError, match="no path given and cache has no path"):
+        PredictionCache().save()
@@ -0,0 +1,29 @@
+import torch
+
+from recording import RecordingClassifier, pad_recordings
+
+
+def items(lengths, size=6, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    return [(torch.randn(n, size, generator=gen), torch.zeros(n, 2), torch.tensor(i % 2)) for i, n in enumerate(lengths)]
+
+
+def test_classifier_returns_logits_and_predict_probabilities():
+    torch.manual_seed(0)
+    classifier = RecordingClassifier(6, 3).eval()
+    embeddings, mask, _ = pad_recordings(items([4, 2]))
+    with torch.no_grad():
+        logits = classifier(embeddings, mask)
+        probs = classifier.predict(embeddings, mask)
+    torch.testing.assert_close(probs, torch.softmax(logits, -1), atol=1e-6, rtol=0)
+    torch.testing.assert_close(probs.sum(-1), torch.ones(2), atol=1e-6, rtol=0)
+
+
+def test_padding_does_not_change_a_recording_score():
+    torch.manual_seed(0)
+    classifier = RecordingClassifier(6, 2).eval()
+    batch = items([5, 3])
+    embeddings, mask, _ = pad_recordings(batch)
+    alone, alone_mask, _ = pad_recordings(batch[1:])
+    with torch.no_grad():
+        torch.testing.assert_close(classifier(embeddings, mask)[1], classifier(alone, alone_mask)[0], atol=1e-5, rtol=0)
@@ -0,0 +1,41 @@
+import torch
+
+from conftest import SMALL_BATCH, SMALL_SAMPLES, build_small
+from models import device
+from recording import embed_recording, predict_sliding, sliding_odcm, sliding_windows
+
+ATOL = 1e-5  # shared and per-window ODCM agree up to float rounding (~1e-7), amplified slightly by the backbone
+HOP = 7
+
+
+def recording(num_windows=10, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    return torch.randn(1, SMALL_SAMPLES + HOP * (num_windows - 1) + 3, generator=gen)
+
+
+def test_sliding_odcm_matches_per_window_odcm():
+    for stride in (1, 2):
+        model = build_small(token_stride=stride)
+        rec = recording()
+        windows = sliding_windows(rec, SMALL_SAMPLES, HOP).to(device)
+        with torch.no_grad():
+            torch.testing.assert_close(sliding_odcm(model, rec, SMALL_SAMPLES, HOP), model.odcm(windows), atol=1e-6, rtol=0)
+            torch.testing.assert_close(sliding_odcm(model, rec, SMALL_SAMPLES, HOP, 3, 4), model.odcm(windows[3:7]), atol=1e-6, rtol=0)
+
+
+def test_predict_sliding_matches_independent_windows(small_model):
+    rec = recording()
+    shared = predict_sliding(small_model, rec, HOP)
+    independent = predict_sliding(small_model, rec, HOP, shared_odcm=False)
+    torch.testing.assert_close(shared, independent, atol=ATOL, rtol=0)
+    windows = sliding_windows(rec, SMALL_SAMPLES, HOP)[:SMALL_BATCH].to(device)
+    with torch.no_grad():
+        torch.testing.assert_close(shared[:SMALL_BATCH], small_model(windows).cpu(), atol=ATOL, rtol=0)
+
+
+def test_embeddings_independent_of_chunking(small_model):
+    rec = recording()
+    reference, _ = embed_recording(small_model, rec, SMALL_SAMPLES, HOP)
+    for chunk_size in (3, 10):
+        embeddings, _ = embed_recording(small_model, rec, SMALL_SAMPLES, HOP, chunk_size=chunk_size)
+        torch.testing.assert_close(embeddings, reference, atol=ATOL, rtol=0)
@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import SMALL_CONFIG, SMALL_SAMPLES
+from validate import config_problems, validate_config
+
+
+def test_small_config_is_valid():
+    assert config_problems(SMALL_CONFIG, SMALL_SAMPLES) == []
+
+
+@pytest.mark.parametrize('overrides, name', [
+    (dict(num_heads_RTM=None), 'num_heads_RTM'),
+    (dict(num_blocks='3'), 'num_blocks'),
+    (dict(kernel_size=2.5), 'kernel_size'),
+    (dict(num_cls=True), 'num_cls'),
+    (dict(CF_second=0), 'CF_second'),
+    (dict(token_stride=None), 'token_stride'),
+    (dict(ttm_rank='4'), 'ttm_rank'),
+    (dict(share_blocks='heads'), 'share_blocks'),
+    (dict(num_heads_RTM=5), 'num_heads_RTM'),  # does not divide S = 24
+    (dict(num_submatrices=5), 'num_submatrices'),
+    (dict(num_heads_TTM=4), 'num_heads_TTM'),  # does not divide (C+1)*121 = 242
+    (dict(pruned=dict(rtm=[dict(heads=[0, 2], hidden=8)])), "pruned['rtm']"),  # head 2 of 2
+    (dict(pruned=dict(rtm=[dict(heads=[0], hidden='8')])), "pruned['rtm']"),
+])
+def test_invalid_configs_are_reported(overrides, name):
+    problems = config_problems(dict(SMALL_CONFIG, **overrides), SMALL_SAMPLES)
+    assert any(problem.startswith(name) for problem in problems), problems
+    with pytest.raises(ValueError, match='invalid EEGformer config'):
+        validate_config(dict(SMALL_CONFIG, **overrides), SMALL_SAMPLES)
+
+
+def test_missing_entry_is_reported():
+    config = dict(SMALL_CONFIG)
+    del config['num_blocks']
+    assert config_problems(config, SMALL_SAMPLES) == ["num_blocks = None must be a positive integer"]
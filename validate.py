@@ -0,0 +1,162 @@
+import argparse
+import numbers
+
+# Shape constraints of models.EEGformer, checked from the config and input length alone (no torch needed):
+#   ODCM: S = T - 3 * (kernel_size - 1) time steps remain after the three valid convs, averaged in groups of token_stride
+#   RTM/STM: the embedding size is S, split into num_heads_RTM / num_heads_STM heads
+#   TTM: the S steps are averaged in num_submatrices equal segments, the token size (C+1)*121 is split into num_heads_TTM heads
+#   CNNdecoder: cvd3 halves the num_submatrices + 1 segment tokens
+
+NCF = 120  # depth-wise filters per channel in ODCM
+
+
+def _divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+
+def _nearest_divisors(n, value, count=3):  # divisors of n closest to value
+    return sorted(_divisors(n), key=lambda d: (abs(d - value), d))[:count]
+
+
+def _positive_int(value):  # bool is an int subclass but never a valid count
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool) and value >= 1
+
+
+def _index(value, size):  # value is an integer index into range(size)
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool) and 0 <= value < size
+
+
+def time_steps(config, samples):  # S, the length RTM/STM/TTM see
+    return (samples - 3 * (config['kernel_size'] - 1)) // config.get('token_stride', 1)
+
+
+def config_problems(config, samples):
+    """
+    Every violated constraint of an EEGformer config for inputs of length samples.
+
+    Args:
+        config: EEGformer constructor arguments, e.g. EEGformer.get_config() or benchmark.DEFAULT_CONFIG
+        samples: input length T
+
+    Returns:
+        list of messages, each naming the offending value and the nearest valid alternatives (empty if valid)
+    """
+    problems = []
+    for name in ('num_cls', 'input_channels', 'kernel_size', 'num_blocks', 'num_heads_RTM', 'num_heads_STM', 'num_heads_TTM',
+                 'num_submatrices', 'CF_second'):
+        if not _positive_int(config.get(name)):
+            problems.append(f"{name} = {config.get(name)!r} must be a positive integer")
+    if not _positive_int(config.get('token_stride', 1)):
+        problems.append(f"token_stride = {config['token_stride']!r} must be a positive integer")
+    rank = config.get('ttm_rank')
+    if rank is not None and not _positive_int(rank):
+        problems.append(f"ttm_rank = {rank!r} must be a positive integer or None")
+    if config.get('share_blocks') not in (None, 'all', 'attention', 'mlp'):
+        problems.append(f"share_blocks = {config['share_blocks']!r} must be None, 'all', 'attention' or 'mlp'")
+    if problems:  # the checks below compare against these counts
+        return problems
+    problems += pruned_problems(config)
+    if problems:
+        return problems
+
+    S = time_steps(config, samples)
+    if samples - 3 * (config['kernel_size'] - 1) < 1:
+        return [f"input length {samples} leaves no time steps after three convolutions of kernel_size {config['kernel_size']}; "
+                f"use samples >= {3 * (config['kernel_size'] - 1) + 1} or kernel_size <= {(samples - 1) // 3 + 1}"]
+    if S < 1:
+        return [f"token_stride = {config['token_stride']} pools the {samples - 3 * (config['kernel_size'] - 1)} time steps into no token; "
+                f"use token_stride <= {samples - 3 * (config['kernel_size'] - 1)}"]
+
+    for name in ('num_heads_RTM', 'num_heads_STM'):
+        if S % config[name]:
+            problems.append(f"{name} = {config[name]} does not divide the embedding size S = {S}; "
+                            f"nearest valid: {_nearest_divisors(S, config[name])}")
+    if S % config['num_submatrices']:
+        problems.append(f"num_submatrices = {config['num_submatrices']} does not split S = {S} into equal segments; "
+                        f"nearest valid: {_nearest_divisors(S, config['num_submatrices'])}")
+    L = (config['input_channels'] + 1) * (NCF + 1)
+    if L % config['num_heads_TTM']:
+        problems.append(f"num_heads_TTM = {config['num_heads_TTM']} does not divide the TTM token size (C+1)*121 = {L}; "
+                        f"nearest valid: {_nearest_divisors(L, config['num_heads_TTM'])}")
+    if problems:
+        problems.append(f"nearest input lengths valid for the given heads/submatrices: {nearest_samples(config, samples)}")
+    return problems
+
+
+def pruned_problems(config):  # the pruned entry: per stage one dict(heads=[distinct head indices], hidden=Mlp width) per block
+    pruned = config.get('pruned')
+    if pruned is None:
+        return []
+    problems = []
+    for name, heads_key in (('rtm', 'num_heads_RTM'), ('stm', 'num_heads_STM'), ('ttm', 'num_heads_TTM')):
+        blocks = pruned.get(name)
+        if blocks is None:
+            continue
+        if len(blocks) != config['num_blocks']:
+            problems.append(f"pruned['{name}'] has {len(blocks)} entries, one per block is needed (num_blocks = {config['num_blocks']})")
+            continue
+        for k, block in enumerate(blocks):
+            heads = list(block['heads'])
+            if not heads or len(set(heads)) != len(heads) or not all(_index(h, config[heads_key]) for h in heads):
+                problems.append(f"pruned['{name}'][{k}]['heads'] = {heads} must be distinct indices in [0, {heads_key} = {config[heads_key]})")
+            if not _positive_int(block['hidden']):
+                problems.append(f"pruned['{name}'][{k}]['hidden'] = {block['hidden']!r} must be a positive integer")
+    if config.get('share_blocks') is not None:
+        problems.append(f"pruned blocks cannot be shared (share_blocks = {config['share_blocks']!r})")
+    return problems
+
+
+def nearest_samples(config, samples, count=3):  # input lengths closest to samples for which S fits the RTM/STM heads and TTM segments
+    found = []
+    for delta in range(samples + 1):
+        for t in sorted({samples - delta, samples + delta}):
+            S = time_steps(config, t)
+            if S >= 1 and all(S % config[name] == 0 for name in ('num_heads_RTM', 'num_heads_STM', 'num_submatrices')):
+                found.append(t)
+        if len(found) >= count:
+            return found[:count]
+    return found
+
+
+def suggest_config(config, samples):
+    """Copy of config with each invalid head/submatrix count replaced by the nearest valid one for this input length."""
+    config = dict(config)
+    S = time_steps(config, samples)
+    if S < 1:
+        raise ValueError(config_problems(config, samples)[0])
+    for name in ('num_heads_RTM', 'num_heads_STM', 'num_submatrices'):
+        config[name] = _nearest_divisors(S, config[name], 1)[0]
+    config['num_heads_TTM'] = _nearest_divisors((config['input_channels'] + 1) * (NCF + 1), config['num_heads_TTM'], 1)[0]
+    return config
+
+
+def validate_config(config, samples):
+    """Raise ValueError listing every problem if the config cannot be built for inputs of length samples."""
+    problems = config_problems(config, samples)
+    if problems:
+        raise ValueError(f"invalid EEGformer config for input length {samples}:\n  " + "\n  ".join(problems))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check an EEGformer config before building it")
+    parser.add_argument("--samples", type=int, default=531)
+    parser.add_argument("--input-channels", type=int, default=1)
+    parser.add_argument("--num-cls", type=int, default=2)
+    parser.add_argument("--kernel-size", type=int, default=10)
+    parser.add_argument("--num-blocks", type=int, default=3)
+    parser.add_argument("--num-heads", type=int, nargs=3, default=(6, 6, 11), metavar=("RTM", "STM", "TTM"))
+    parser.add_argument("--num-submatrices", type=int, default=12)
+    parser.add_argument("--cf-second", type=int, default=2)
+    parser.add_argument("--token-stride", type=int, default=1)
+    args = parser.parse_args()
+
+    config = dict(num_cls=args.num_cls, input_channels=args.input_channels, kernel_size=args.kernel_size, num_blocks=args.num_blocks,
+                  num_heads_RTM=args.num_heads[0], num_heads_STM=args.num_heads[1], num_heads_TTM=args.num_heads[2],
+                  num_submatrices=args.num_submatrices, CF_second=args.cf_second, token_stride=args.token_stride)
+    problems = config_problems(config, args.samples)
+    for problem in problems:
+        print(problem)
+    if problems and time_steps(config, args.samples) >= 1:
+        print(f"suggested config: {suggest_config(config, args.samples)}")
+    elif not problems:
+        print("config is valid")